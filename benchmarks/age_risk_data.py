@@ -0,0 +1,83 @@
+"""
+Benchmark ``get_age_risk_data`` against a stub Cosmos container.
+
+Compares the bulk path (one patient scan reading the stored ``birth_year`` and
+``at_risk`` fields) with the original per-patient notification lookup,
+reporting round trips and wall time as the patient count grows.
+
+Usage:
+    python -m benchmarks.age_risk_data [--latency-ms 2] [--sizes 100 1000 5000]
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+
+def seed(stub, patient_count, at_risk_ratio=0.1):
+    from services.patient_fields import at_risk_flags, patient_derived_fields
+
+    patients, notifications = [], []
+    for _ in range(patient_count):
+        user_id = str(uuid.uuid4())
+        date_of_birth = f"{random.randint(1930, 2020)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}"
+        at_risk = random.random() < at_risk_ratio
+        patients.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "date_of_birth": date_of_birth,
+            **patient_derived_fields(None, date_of_birth),
+            "at_risk": at_risk_flags(["Stroke"] if at_risk else []),
+        })
+        if at_risk:
+            notifications.append({"id": str(uuid.uuid4()), "patient_id": user_id, "disease": "Stroke"})
+    stub.seed("patients", patients)
+    stub.seed("health_notifications", notifications)
+
+
+def per_patient_lookup(helper):
+    """The previous N+1 implementation, kept here only for comparison."""
+    patients = helper.get_container(helper.PATIENTS_CONTAINER_NAME).query_items(
+        query="SELECT c.id, c.date_of_birth, c.user_id FROM c", enable_cross_partition_query=True
+    )
+    result = []
+    for patient in patients:
+        notifications = list(helper.get_container(helper.HEALTH_NOTIFICATIONS_CONTAINER_NAME).query_items(
+            query="SELECT * FROM c WHERE c.patient_id = @user_id AND c.disease = 'Stroke'",
+            parameters=[{"name": "@user_id", "value": patient["user_id"]}],
+            enable_cross_partition_query=True,
+        ))
+        result.append({"patient_id": patient["id"], "at_risk_for_stroke": bool(notifications)})
+    return result
+
+
+def measure(stub, func):
+    stub.reset_round_trips()
+    started = time.perf_counter()
+    rows = func()
+    return len(rows), stub.round_trips(), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Simulated latency per Cosmos round trip.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    with patched_cosmos_client(latency=args.latency_ms / 1000) as stub:
+        from services import cosmosdb_helper as helper
+
+        print(f"{'patients':>10} {'path':>12} {'round trips':>12} {'seconds':>10}")
+        for size in args.sizes:
+            seed(stub, size)
+            for name, func in (("bulk", helper.get_age_risk_data), ("per-patient", lambda: per_patient_lookup(helper))):
+                rows, round_trips, elapsed = measure(stub, func)
+                assert rows == size
+                print(f"{size:>10} {name:>12} {round_trips:>12} {elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
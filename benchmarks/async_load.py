@@ -0,0 +1,71 @@
+"""
+Load test the sync and async Cosmos data layers against the stub container.
+
+The sync path serves requests from a fixed pool of threads, one per simulated
+gunicorn sync worker; the async path serves every request concurrently from
+a single event loop, as one ASGI process would. Each request loads the
+patient details page data (four Cosmos calls).
+
+Usage:
+    python -m benchmarks.async_load [--requests 200] [--workers 4] [--latency-ms 20]
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+
+def seed(stub, patient_count=50):
+    stub.seed("patients", [{"id": f"p{i}", "user_id": f"u{i}", "name": f"Patient {i}"} for i in range(patient_count)])
+    stub.seed("users", [{"id": f"u{i}", "email": f"u{i}@example.com"} for i in range(patient_count)])
+    stub.seed("medical_records", [
+        {"id": f"r{i}", "patient_id": f"p{i}", "created_date_utc": "2024-01-01T00:00:00"} for i in range(patient_count)
+    ])
+    stub.seed("health_notifications", [{"id": f"n{i}", "patient_id": f"u{i}"} for i in range(patient_count)])
+    return patient_count
+
+
+def run_sync(helper, request_count, workers, patient_count):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(lambda i: helper.get_patient_details(f"p{i % patient_count}"), range(request_count)))
+        elapsed = time.perf_counter() - started
+    assert all(result[0] for result in results)
+    return elapsed
+
+
+async def run_async(helper_async, request_count, patient_count):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        helper_async.get_patient_details(f"p{i % patient_count}") for i in range(request_count)
+    ))
+    elapsed = time.perf_counter() - started
+    assert all(result[0] for result in results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="Simulated gunicorn sync workers.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated latency per Cosmos round trip.")
+    args = parser.parse_args()
+
+    with patched_cosmos_client(latency=args.latency_ms / 1000) as stub:
+        from services import cosmosdb_helper as helper
+        from services import cosmosdb_helper_async as helper_async
+
+        patient_count = seed(stub)
+        sync_elapsed = run_sync(helper, args.requests, args.workers, patient_count)
+        async_elapsed = asyncio.run(run_async(helper_async, args.requests, patient_count))
+
+    print(f"{'mode':>6} {'requests':>9} {'seconds':>9} {'req/s':>9}")
+    print(f"{'sync':>6} {args.requests:>9} {sync_elapsed:>9.2f} {args.requests / sync_elapsed:>9.1f}")
+    print(f"{'async':>6} {args.requests:>9} {async_elapsed:>9.2f} {args.requests / async_elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure worker boot cost of importing the views with and without matplotlib.
+
+Each scenario runs in a fresh interpreter that sets up Django (with the Cosmos
+client stubbed out) and imports ``patients.views``; the "png" scenario also
+imports ``matplotlib.pyplot`` as the views used to do at module level.
+
+Usage:
+    python -m benchmarks.import_cost [--runs 5]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIO = """
+import json, resource, time
+started = time.perf_counter()
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+from benchmarks.stub_cosmos import patched_cosmos_client
+with patched_cosmos_client():
+    import django
+    django.setup()
+    import patients.views
+    if {import_matplotlib}:
+        import matplotlib.pyplot
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def run(import_matplotlib):
+    output = subprocess.run(
+        [sys.executable, "-c", SCENARIO.format(import_matplotlib=import_matplotlib)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'median import s':>16} {'median max RSS MB':>18}")
+    for mode, import_matplotlib in (("svg", False), ("png", True)):
+        samples = [run(import_matplotlib) for _ in range(args.runs)]
+        seconds = statistics.median(sample["seconds"] for sample in samples)
+        rss = statistics.median(sample["max_rss_mb"] for sample in samples)
+        print(f"{mode:>6} {seconds:>16.3f} {rss:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
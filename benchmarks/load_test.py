@@ -0,0 +1,261 @@
+"""
+Load test the main pages end to end against local Cosmos DB and blockchain stand-ins.
+
+For each data volume the stub Cosmos DB is seeded with that many patients
+(each with a user, medical records and, for some, a stroke notification), and
+then each scenario runs in turn. A scenario sends ``--requests`` requests from
+``--concurrency`` simulated doctors through Django's test client, so every
+request passes through the full middleware stack:
+
+- login: sign in with email and password,
+- patient_list: a page of the patient list after a random patient,
+- patient_search: the first page of a name prefix search, narrowed by sex, age
+  and, for every other request, stroke risk,
+- patient_details: a random patient's details page,
+- add_record: queue a blood work record for a random patient,
+- blockchain_drain: send the queued records to the blockchain API stub from
+  a single outbox worker, one batch per request, until the outbox is empty,
+- age_risk_chart: the age/risk distribution page.
+
+For each scenario it reports throughput, p50/p95/p99 latency, and the Cosmos
+DB round trips and blockchain API requests per request. Recorded blocks are
+written back to the ``medical_records`` container, as the blockchain service does.
+
+The stub answers equality filters from hash indexes but scans for the
+patient list and the age/risk page, which have no summary document here, so
+at a million patients those timings include the stub's own scan. The 1M
+volume needs several GB of memory.
+
+Usage:
+    python -m benchmarks.load_test [--sizes 1000 100000 1000000] [--concurrency 8] [--requests 200]
+        [--records-per-patient 3] [--cosmos-latency-ms 5] [--blockchain-latency-ms 50]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.stub_blockchain import patched_blockchain_client
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+PASSWORD = "load-test"
+RECORD_TYPES = ("PhysicalExam", "BloodWork", "BloodPressure", "DiseaseHistory")
+SCENARIOS = ("login", "patient_list", "patient_search", "patient_details", "add_record", "blockchain_drain", "age_risk_chart")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def patient_id(index):
+    return f"p{index:07d}"
+
+
+def seed(stub, patient_count, doctor_count, records_per_patient, at_risk_ratio=0.1):
+    """Fill the stub containers. Patients have no user lookups, so login is only measured for doctors."""
+    from services.cosmosdb_helper import RISK_DISEASE, email_lookup_id
+    from services.patient_fields import at_risk_flags, patient_derived_fields
+    from services.passwords import pwd_context
+
+    password_hash = pwd_context.hash(PASSWORD)
+    rng = random.Random(patient_count)
+    at_risk = {i for i in range(patient_count) if rng.random() < at_risk_ratio}
+    started = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    doctors = [{
+        "id": f"d{i}", "email": f"doctor{i}@example.com", "name": f"Doctor {i}",
+        "password_hash": password_hash, "roles": ["Doctor"],
+    } for i in range(doctor_count)]
+    stub.seed("users", doctors + [{
+        "id": f"u{i:07d}", "email": f"patient{i}@example.com", "name": f"Patient {i}",
+        "password_hash": password_hash, "roles": ["Patient"],
+    } for i in range(patient_count)])
+    stub.seed("lookups", [{"id": email_lookup_id(doctor["email"]), "type": "email", "user_id": doctor["id"]} for doctor in doctors])
+    def patient(i):
+        date_of_birth = f"{rng.randint(1930, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00"
+        return {
+            "id": patient_id(i), "user_id": f"u{i:07d}", "name": f"Patient {i}", "date_of_birth": date_of_birth,
+            "sex": rng.choice(("Male", "Female")), **patient_derived_fields(f"Patient {i}", date_of_birth),
+            "at_risk": at_risk_flags([RISK_DISEASE] if i in at_risk else []),
+        }
+    stub.seed("patients", (patient(i) for i in range(patient_count)))
+    stub.seed("medical_records", ({
+        "id": f"r{i:07d}-{j}", "patient_id": patient_id(i), "type": RECORD_TYPES[j % len(RECORD_TYPES)],
+        "created_date_utc": (started + timedelta(days=rng.randint(0, 1500))).isoformat(),
+        "glucose_level": round(rng.uniform(70, 200), 1),
+    } for i in range(patient_count) for j in range(records_per_patient)))
+    stub.seed("health_notifications", ({
+        "id": f"n{i:07d}", "patient_id": f"u{i:07d}", "disease": RISK_DISEASE, "title": "Stroke risk",
+        "text": "Elevated stroke risk detected.",
+    } for i in sorted(at_risk)))
+    stub.seed("sessions", [])
+    stub.seed("analytics", [])
+
+
+def store_block(stub):
+    """Return an ``on_block`` callback that saves recorded blocks as medical records."""
+    def on_block(key, block):
+        stub.get_database_client(None).get_container_client("medical_records").put({
+            **block, "id": key, "created_date_utc": datetime.now(timezone.utc).isoformat(),
+        })
+    return on_block
+
+
+def build_requests(patient_count, doctor_count):
+    """Map each client scenario to a function that sends one request with a test client."""
+    def login(client, i):
+        response = client.post("/patients/login/", {"email": f"doctor{i % doctor_count}@example.com", "password": PASSWORD})
+        return response.status_code == 302
+
+    def patient_list(client, i):
+        after = patient_id(random.randrange(patient_count))
+        return client.get("/patients/view/", {"page": f"after:{after}"}).status_code == 200
+
+    def patient_search(client, i):
+        query = {"q": f"patient {random.randrange(100)}", "sex": random.choice(("Male", "Female")), "age_min": 18, "age_max": 65}
+        if i % 2:
+            query["at_risk"] = 1
+        return client.get("/patients/view/", query).status_code == 200
+
+    def patient_details(client, i):
+        return client.get(f"/patients/patient/{patient_id(random.randrange(patient_count))}/").status_code == 200
+
+    def add_record(client, i):
+        response = client.post(
+            f"/patients/patients/{patient_id(random.randrange(patient_count))}/add_record/",
+            {"record_type": "BloodWork", "glucose_level": f"{random.uniform(70, 200):.1f}"},
+        )
+        return response.status_code == 302
+
+    def age_risk_chart(client, i):
+        return client.get("/patients/age-risk-distribution/").status_code == 200
+
+    return {
+        "login": login,
+        "patient_list": patient_list,
+        "patient_search": patient_search,
+        "patient_details": patient_details,
+        "add_record": add_record,
+        "age_risk_chart": age_risk_chart,
+    }
+
+
+def run_scenario(send, clients, request_count):
+    """Send ``request_count`` requests, each with a client from the pool, and return (samples, failures)."""
+    samples, failures = [], 0
+
+    def one(i):
+        client = clients.get()
+        try:
+            started = time.perf_counter()
+            ok = send(client, i)
+            return time.perf_counter() - started, ok
+        finally:
+            clients.put(client)
+
+    with ThreadPoolExecutor(max_workers=clients.qsize()) as pool:
+        for elapsed, ok in pool.map(one, range(request_count)):
+            samples.append(elapsed)
+            failures += not ok
+    return samples, failures
+
+
+def run_drain():
+    """Drain the outbox batch by batch, as the single ``drain_blockchain_outbox`` worker does."""
+    from patients.outbox import drain
+
+    samples, failures = [], 0
+    while True:
+        started = time.perf_counter()
+        sent, failed = drain()
+        if not sent and not failed:
+            return samples, failures
+        samples.append(time.perf_counter() - started)
+        failures += failed
+
+
+def measure(run, stub, blockchain):
+    stub.reset_round_trips()
+    blockchain.reset_calls()
+    started = time.perf_counter()
+    samples, failures = run()
+    elapsed = time.perf_counter() - started
+    request_count = max(len(samples), 1)
+    samples = samples or [0.0]
+    return {
+        "throughput": request_count / elapsed,
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "mean": statistics.mean(samples),
+        "failures": failures,
+        "cosmos_calls": stub.round_trips() / request_count,
+        "blockchain_calls": (blockchain.calls["login"] + blockchain.calls["blocks"]) / request_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="Patient counts to seed, e.g. 1000 100000 1000000.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulated doctors sending requests at once.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario.")
+    parser.add_argument("--records-per-patient", type=int, default=3)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5.0, help="Simulated latency per Cosmos round trip.")
+    parser.add_argument("--blockchain-latency-ms", type=float, default=50.0, help="Simulated latency per blockchain API request.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+    # The stub has no change feed to follow
+    os.environ.setdefault("PATIENT_CACHE_FEED_INTERVAL", "0")
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory, \
+            patched_cosmos_client(latency=args.cosmos_latency_ms / 1000) as stub, \
+            patched_blockchain_client(latency=args.blockchain_latency_ms / 1000, on_block=store_block(stub)) as blockchain:
+        import django
+        from django.conf import settings
+        # The outbox lives in the local database; keep it away from db.sqlite3
+        settings.DATABASES["default"]["NAME"] = os.path.join(directory, "load_test.sqlite3")
+        settings.DATABASES["default"].setdefault("OPTIONS", {})["timeout"] = 30
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "testserver"]
+        django.setup()
+        from django.core.management import call_command
+        from django.test import Client
+        call_command("migrate", verbosity=0)
+
+        print(
+            f"{'patients':>9} {'scenario':>17} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'cosmos/req':>11} {'chain/req':>10} {'failed':>7}"
+        )
+        for size in args.sizes:
+            seed(stub, size, args.concurrency, args.records_per_patient)
+            requests = build_requests(size, args.concurrency)
+            clients = queue.Queue()
+            for i in range(args.concurrency):
+                client = Client()
+                client.post("/patients/login/", {"email": f"doctor{i}@example.com", "password": PASSWORD})
+                clients.put(client)
+
+            for name in args.scenarios:
+                if name == "blockchain_drain":
+                    result = measure(run_drain, stub, blockchain)
+                else:
+                    result = measure(lambda: run_scenario(requests[name], clients, args.requests), stub, blockchain)
+                print(
+                    f"{size:>9} {name:>17} {result['throughput']:>8.1f} {result['p50'] * 1000:>8.1f} "
+                    f"{result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} "
+                    f"{result['cosmos_calls']:>11.2f} {result['blockchain_calls']:>10.2f} {result['failures']:>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure login password-check throughput at different bcrypt costs.
+
+For each cost a hash is made with that many rounds, then ``--logins`` checks
+are issued from ``--threads`` request threads, once running bcrypt inline in
+those threads (the old behaviour) and once through the password hashing
+process pool. Checks turned away because the pool is saturated are counted
+as rejected.
+
+Usage:
+    python -m benchmarks.password_hashing [--rounds 10 11 12] [--logins 40] [--threads 8]
+"""
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.passwords import HASH_WORKERS, PasswordHasher, PasswordHasherBusy, pwd_context
+
+PASSWORD = "correct horse battery staple"
+
+
+def run(check, password_hash, logins, threads):
+    def login(_):
+        try:
+            return check(PASSWORD, password_hash)
+        except PasswordHasherBusy:
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(login, range(logins)))
+        elapsed = time.perf_counter() - started
+    rejected = results.count(None)
+    assert all(results[i][0] for i in range(logins) if results[i] is not None)
+    return elapsed, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12], help="bcrypt costs to compare.")
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent request threads.")
+    parser.add_argument("--max-pending", type=int, default=None, help="Pool admission limit (default: no rejections).")
+    args = parser.parse_args()
+
+    # Rejections are reported in the table
+    logging.getLogger("services.passwords").setLevel(logging.ERROR)
+
+    print(f"pool workers: {HASH_WORKERS}")
+    print(f"{'rounds':>6} {'mode':>7} {'seconds':>9} {'logins/s':>9} {'rejected':>9}")
+    for rounds in args.rounds:
+        # Configure the cost as BCRYPT_ROUNDS would, so logins don't also rehash;
+        # the pool's worker processes read it when they start.
+        os.environ["BCRYPT_ROUNDS"] = str(rounds)
+        context = pwd_context.copy(bcrypt__rounds=rounds)
+        hasher = PasswordHasher(workers=HASH_WORKERS, max_pending=args.max_pending or args.logins)
+        password_hash = hasher.hash(PASSWORD)
+
+        for mode, check in (("inline", context.verify_and_update), ("pool", hasher.verify_and_update)):
+            elapsed, rejected = run(check, password_hash, args.logins, args.threads)
+            served = args.logins - rejected
+            print(f"{rounds:>6} {mode:>7} {elapsed:>9.2f} {served / elapsed:>9.1f} {rejected:>9}")
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the bulk patient importer with creating the same patients one at a time.
+
+"sequential" calls ``create_user_and_patient`` per row, as ``add_patient_view``
+does; "bulk" streams the rows through ``import_patients``. Both write to the
+stub Cosmos containers with a simulated round-trip latency and hash passwords
+at ``BCRYPT_ROUNDS``.
+
+Usage:
+    python -m benchmarks.patient_import [--patients 500] [--latency-ms 10] [--write-workers 16]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+
+def rows(count, prefix):
+    yield "name,email,password,date_of_birth,sex,ever_married\n"
+    for i in range(count):
+        yield f"Patient {i},{prefix}{i}@example.com,secret-{i},19{50 + i % 50}-01-{1 + i % 28:02d},{('Male', 'Female')[i % 2]},{i % 2}\n"
+
+
+def run_sequential(count):
+    from services.cosmosdb_helper import create_user_and_patient
+
+    started = time.perf_counter()
+    created = sum(
+        create_user_and_patient(f"Patient {i}", f"seq{i}@example.com", f"secret-{i}", "1980-01-01", "Female", False)
+        for i in range(count)
+    )
+    return created, time.perf_counter() - started
+
+
+def run_bulk(count, write_workers):
+    from patients.patient_import import import_name, import_patients, iter_patient_rows
+
+    name = import_name(line.encode() for line in rows(count, "bulk"))
+    started = time.perf_counter()
+    summary = import_patients(iter_patient_rows(rows(count, "bulk")), name, write_workers=write_workers, restart=True)
+    return summary["created"], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Simulated latency per Cosmos round trip.")
+    parser.add_argument("--write-workers", type=int, default=16)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory, patched_cosmos_client(latency=args.latency_ms / 1000) as stub:
+        import django
+        from django.conf import settings
+        # Import checkpoints live in the local database; keep them away from db.sqlite3
+        settings.DATABASES["default"]["NAME"] = os.path.join(directory, "patient_import.sqlite3")
+        django.setup()
+        from django.core.management import call_command
+        call_command("migrate", verbosity=0)
+
+        print(f"{'mode':>10} {'patients':>9} {'seconds':>9} {'per minute':>11} {'round trips':>12}")
+        for mode in ("sequential", "bulk"):
+            stub.reset_round_trips()
+            if mode == "sequential":
+                created, elapsed = run_sequential(args.patients)
+            else:
+                created, elapsed = run_bulk(args.patients, args.write_workers)
+            print(f"{mode:>10} {created:>9} {elapsed:>9.2f} {created / elapsed * 60:>11.0f} {stub.round_trips():>12}")
+
+
+if __name__ == "__main__":
+    main()
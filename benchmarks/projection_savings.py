@@ -0,0 +1,101 @@
+"""
+Compare whole-document and projected queries on the patient list, patient
+details and login paths.
+
+Each path runs once fetching every field and once fetching only the fields
+its page uses. The table shows the request charge (RU) and payload bytes
+recorded by ``services.cosmos_query``. The stub container reports no request
+charge, so RU columns are only meaningful with ``--live``, which runs against
+the account in ``COSMOS_CONNECTION_STRING``.
+
+Usage:
+    python -m benchmarks.projection_savings [--patients 200] [--records-per-patient 20] [--live]
+"""
+
+import argparse
+import os
+import random
+from contextlib import nullcontext
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+
+def seed(stub, patient_count, records_per_patient):
+    rng = random.Random(7)
+    stub.seed("patients", [{
+        "id": f"p{i:05d}", "user_id": f"u{i}", "name": f"Patient {i}", "date_of_birth": "1980-05-17T00:00:00",
+        "sex": rng.choice(["M", "F"]), "ever_married": rng.random() < 0.5,
+    } for i in range(patient_count)])
+    stub.seed("users", [{
+        "id": f"u{i}", "name": f"Patient {i}", "email": f"u{i}@example.com", "password_hash": "$2b$12$" + "x" * 53,
+        "roles": ["Patient"], "validator_id": "",
+    } for i in range(patient_count)])
+    stub.seed("medical_records", [{
+        "id": f"r{i}-{j}", "patient_id": f"p{i:05d}", "type": "PhysicalExam", "created_date_utc": "2024-01-01T00:00:00",
+        "work_type": "Private", "residency_type": "Urban", "height": 170, "weight": 70, "smoking_status": "never smoked",
+        "block_hash": "%064x" % rng.getrandbits(256), "previous_hash": "%064x" % rng.getrandbits(256),
+        "validator_id": "validator-1", "signature": "%0128x" % rng.getrandbits(512),
+    } for i in range(patient_count) for j in range(records_per_patient)])
+    stub.seed("health_notifications", [{
+        "id": f"n{i}", "patient_id": f"u{i}", "title": "Stroke risk", "text": "Elevated stroke risk detected.",
+        "disease": "Stroke", "model_version": "2024.1", "features": {"age": 44, "glucose_level": 105.2, "bmi": 24.2},
+    } for i in range(patient_count)])
+    stub.seed("lookups", [])
+
+
+def run_paths(helper, fields, patient_id, email):
+    from patients.views import HEALTH_NOTIFICATION_FIELDS, MEDICAL_RECORD_FIELDS, MEDICAL_RECORDS_PAGE_SIZE, PATIENT_LIST_FIELDS
+
+    projected = fields == "projected"
+    helper.get_patients_page_by_cursor(page_size=10, fields=PATIENT_LIST_FIELDS if projected else None)
+    helper.get_patient_details(
+        patient_id,
+        record_fields=MEDICAL_RECORD_FIELDS if projected else None,
+        notification_fields=HEALTH_NOTIFICATION_FIELDS if projected else None,
+        record_page_size=MEDICAL_RECORDS_PAGE_SIZE,
+    )
+    helper.get_user_by_email(email, fields=helper.LOGIN_USER_FIELDS if projected else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--records-per-patient", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="Query the real account instead of the stub.")
+    parser.add_argument("--patient-id", help="Patient to load details for with --live.")
+    parser.add_argument("--email", help="User email to look up with --live.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+    with nullcontext() if args.live else patched_cosmos_client() as stub:
+        import django
+        django.setup()
+        from services import cosmos_query
+        from services import cosmosdb_helper as helper
+
+        if args.live:
+            patient_id, email = args.patient_id, args.email
+        else:
+            seed(stub, args.patients, args.records_per_patient)
+            patient_id, email = "p00000", "u0@example.com"
+
+        results = {}
+        for fields in ("full", "projected"):
+            cosmos_query.reset_query_stats()
+            run_paths(helper, fields, patient_id, email)
+            results[fields] = cosmos_query.query_stats()
+
+    labels = sorted(set(results["full"]) | set(results["projected"]))
+    print(f"{'query':<30} {'full RU':>9} {'proj RU':>9} {'full bytes':>11} {'proj bytes':>11} {'saved':>7}")
+    for label in labels:
+        full = results["full"].get(label, {"request_charge": 0.0, "bytes": 0})
+        proj = results["projected"].get(label, {"request_charge": 0.0, "bytes": 0})
+        saved = 1 - proj["bytes"] / full["bytes"] if full["bytes"] else 0.0
+        print(
+            f"{label:<30} {full['request_charge']:>9.2f} {proj['request_charge']:>9.2f} "
+            f"{full['bytes']:>11} {proj['bytes']:>11} {saved:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
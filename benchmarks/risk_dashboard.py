@@ -0,0 +1,119 @@
+"""
+Measure risk dashboard latency with a cold cache against a risk cube built from a million patients.
+
+Synthetic patients (birth year, sex, marital status and the diseases they are
+at risk of) are reduced to cube cells with ``cube_cells``, as the risk summary
+worker does for each change feed page, and the cube is published to the stub
+``analytics`` container. The dashboard is then requested through the full
+middleware stack, clearing the per-process cube cache before every cold
+request. The script exits with status 1 if the slowest cold request exceeds
+``--budget-ms``.
+
+Usage:
+    python -m benchmarks.risk_dashboard [--patients 1000000] [--diseases 8] [--requests 20]
+        [--cosmos-latency-ms 5] [--budget-ms 250]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+PASSWORD = "risk-dashboard"
+DISEASES = ("Stroke", "Diabetes", "Hypertension", "Heart Disease", "Asthma", "COPD", "Kidney Disease", "Obesity")
+# Drill-down requests, cycled through by the benchmark
+QUERIES = (
+    {},
+    {"group_by": "sex"},
+    {"age_bucket": "41-50"},
+    {"age_bucket": "41-50", "sex": "Female"},
+    {"disease": "Stroke", "group_by": "ever_married"},
+)
+
+
+def synthetic_patients(count, disease_count, seed=0):
+    rng = np.random.default_rng(seed)
+    birth_years = rng.integers(1925, 2025, count)
+    sexes = rng.choice(np.array(["Male", "Female"], dtype=object), count)
+    ever_married = rng.random(count) < 0.6
+    flags = rng.random((count, disease_count)) < np.linspace(0.02, 0.15, disease_count)
+    names = np.array(DISEASES[:disease_count], dtype=object)
+    diseases = [names[row].tolist() for row in flags]
+    return birth_years, sexes, ever_married, diseases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--diseases", type=int, default=len(DISEASES), choices=range(1, len(DISEASES) + 1))
+    parser.add_argument("--requests", type=int, default=20, help="Cold and warm requests each.")
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5.0, help="Simulated latency per Cosmos round trip.")
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="Slowest acceptable cold-cache request.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+    os.environ.setdefault("PATIENT_CACHE_FEED_INTERVAL", "0")
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory, patched_cosmos_client(latency=args.cosmos_latency_ms / 1000) as stub:
+        import django
+        from django.conf import settings
+        settings.DATABASES["default"]["NAME"] = os.path.join(directory, "risk_dashboard.sqlite3")
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "testserver"]
+        django.setup()
+        from django.core.cache import caches
+        from django.test import Client
+        from services.cosmosdb_helper import email_lookup_id, save_risk_cube
+        from services.passwords import pwd_context
+        from services.risk_cube import RISK_CUBE_CACHE_ALIAS, cube_cells
+
+        patients = synthetic_patients(args.patients, args.diseases)
+        started = time.perf_counter()
+        cube = cube_cells(*patients)
+        build_seconds = time.perf_counter() - started
+        cube["updated_at"] = "benchmark"
+        save_risk_cube(cube)
+        print(f"Built {len(cube['patients'])} cells ({len(json.dumps(cube)) / 1024:.0f} KiB) from {args.patients} patients in {build_seconds:.2f}s")
+
+        stub.seed("users", [{
+            "id": "d0", "email": "doctor@example.com", "name": "Doctor", "roles": ["Doctor"],
+            "password_hash": pwd_context.hash(PASSWORD),
+        }])
+        stub.seed("lookups", [{"id": email_lookup_id("doctor@example.com"), "type": "email", "user_id": "d0"}])
+        stub.seed("sessions", [])
+        client = Client()
+        client.post("/patients/login/", {"email": "doctor@example.com", "password": PASSWORD})
+
+        results = {}
+        for mode in ("cold", "warm"):
+            samples = []
+            for i in range(args.requests):
+                if mode == "cold":
+                    caches[RISK_CUBE_CACHE_ALIAS].clear()
+                started = time.perf_counter()
+                response = client.get("/patients/risk-dashboard/", QUERIES[i % len(QUERIES)])
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+            results[mode] = samples
+
+        print(f"{'cache':>6} {'p50 ms':>8} {'max ms':>8} {'mean ms':>8}")
+        for mode, samples in results.items():
+            print(f"{mode:>6} {statistics.median(samples) * 1000:>8.1f} {max(samples) * 1000:>8.1f} {statistics.mean(samples) * 1000:>8.1f}")
+
+        slowest = max(results["cold"]) * 1000
+        if slowest > args.budget_ms:
+            print(f"Slowest cold request took {slowest:.1f} ms, over the {args.budget_ms:.0f} ms budget.")
+            sys.exit(1)
+        print(f"Slowest cold request took {slowest:.1f} ms, within the {args.budget_ms:.0f} ms budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare per-request session latency across the ``SESSION_STORE`` modes.
+
+Each request goes through ``CosmosDBSessionMiddleware`` with a signed-in
+session and a view that reads ``user_id`` and ``user_roles``, as the
+``login_required`` and ``role_required`` decorators do. Cosmos calls go to the
+stub container with a simulated round-trip latency.
+
+Usage:
+    python -m benchmarks.session_modes [--requests 500] [--latency-ms 5]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.stub_cosmos import patched_cosmos_client
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(mode, request_count, stub):
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.http import HttpResponse
+    from django.test import RequestFactory, override_settings
+    from middleware.custom_session_middleware import CosmosDBSessionMiddleware
+
+    def view(request):
+        request.session.get("user_id")
+        request.session.get("user_roles", [])
+        return HttpResponse("ok")
+
+    with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[mode]):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        middleware = CosmosDBSessionMiddleware(view)
+        factory = RequestFactory()
+
+        def login(request):
+            request.session.update({"user_id": "u1", "user_name": "Dr. A", "user_roles": ["Doctor"]})
+            return HttpResponse("ok")
+
+        cookie = CosmosDBSessionMiddleware(login)(factory.get("/")).cookies[settings.SESSION_COOKIE_NAME].value
+
+        stub.reset_round_trips()
+        samples = []
+        for _ in range(request_count):
+            request = factory.get("/patients/view/")
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+            started = time.perf_counter()
+            middleware(request)
+            samples.append(time.perf_counter() - started)
+    return samples, stub.round_trips()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated latency per Cosmos round trip.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+    with patched_cosmos_client(latency=args.latency_ms / 1000) as stub:
+        import django
+        django.setup()
+
+        print(f"{'mode':>7} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'round trips':>12}")
+        for mode in ("cosmos", "cached", "cookie"):
+            samples, round_trips = run(mode, args.requests, stub)
+            print(
+                f"{mode:>7} {percentile(samples, 0.5) * 1000:>8.2f} {percentile(samples, 0.99) * 1000:>8.2f} "
+                f"{statistics.mean(samples) * 1000:>8.2f} {round_trips:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
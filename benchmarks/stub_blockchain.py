@@ -0,0 +1,119 @@
+"""
+Local HTTP stand-in for the blockchain API used by benchmarks.
+
+Serves ``POST /auth/login`` and ``POST /blocks`` on a loopback port with a
+configurable latency per request. Logins return a bearer token that expires
+after ``token_ttl`` seconds; blocks need a valid token and are recorded once
+per ``Idempotency-Key``, as the real API does.
+"""
+
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+
+class StubBlockchainServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, token_ttl=300, on_block=None):
+        super().__init__(("127.0.0.1", 0), StubBlockchainHandler)
+        self.latency = latency
+        self.token_ttl = token_ttl
+        # Called with each newly recorded block, e.g. to store it where the app reads medical records
+        self.on_block = on_block
+        self.tokens = {}
+        self.blocks = {}
+        self.calls = {"login": 0, "blocks": 0, "duplicates": 0, "unauthorized": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = dict.fromkeys(self.calls, 0)
+
+
+class StubBlockchainHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if server.latency:
+            time.sleep(server.latency)
+
+        if self.path == "/auth/login":
+            server.count("login")
+            if body.get("username") != USERNAME or body.get("password") != PASSWORD:
+                return self._respond(401, {"detail": "Invalid credentials"})
+            token = secrets.token_urlsafe(16)
+            with server.lock:
+                server.tokens[token] = time.time() + server.token_ttl
+            return self._respond(200, {"access_token": token, "expires_in": server.token_ttl})
+
+        if self.path == "/blocks":
+            server.count("blocks")
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+            with server.lock:
+                valid = server.tokens.get(token, 0) > time.time()
+            if not valid:
+                server.count("unauthorized")
+                return self._respond(401, {"detail": "Token expired or invalid"})
+
+            key = self.headers.get("Idempotency-Key") or secrets.token_hex(8)
+            with server.lock:
+                duplicate = key in server.blocks
+                if not duplicate:
+                    server.blocks[key] = body
+            if duplicate:
+                server.count("duplicates")
+            elif server.on_block:
+                server.on_block(key, body)
+            return self._respond(200, {"id": key})
+
+        self._respond(404, {"detail": "Not found"})
+
+
+@contextmanager
+def patched_blockchain_client(latency=0.0, token_ttl=300, on_block=None):
+    """
+    Serve the stub API in a background thread and point ``services.blockchain``
+    at it while the context is active.
+    """
+    from services import blockchain
+
+    server = StubBlockchainServer(latency=latency, token_ttl=token_ttl, on_block=on_block)
+    thread = threading.Thread(target=server.serve_forever, name="stub-blockchain", daemon=True)
+    thread.start()
+    client = blockchain.BlockchainClient(base_url=server.base_url, username=USERNAME, password=PASSWORD)
+    try:
+        with mock.patch.object(blockchain, "_client", client):
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
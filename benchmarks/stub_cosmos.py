@@ -0,0 +1,434 @@
+"""
+Minimal in-memory stand-in for the ``azure.cosmos`` client used by benchmarks.
+
+Only the parameterized query shapes used by ``services.cosmosdb_helper`` are
+understood: ``SELECT [TOP n] [DISTINCT] [VALUE] <fields|*> FROM c [WHERE <condition>]
+[ORDER BY c.<field> [ASC|DESC][, ...]]`` where a condition combines comparisons of
+``c.<field>`` or ``c.<field>[@param]`` with ``=, !=, <, >, <=`` or ``>=``
+against ``@param``, ``'<literal>'``, ``true`` or ``false`` through ``AND``,
+``OR`` and parentheses. Patches ``set`` nested paths such as ``/at_risk/Stroke``.
+Every call counts as one round trip and sleeps for a configurable latency.
+Writes stamp an ``_etag`` and honour ``etag=`` preconditions on upserts and
+replaces; reads with ``match_condition=IfModified`` return None for an unchanged ``etag``.
+
+Like Cosmos DB's index, ``c.<field> = @param`` conditions are answered from a
+hash index per field, built on first use and kept current by writes, so
+queries by partition key stay cheap at a million documents. Range conditions
+and ``ORDER BY`` still scan every document. Containers can be shared between
+threads.
+"""
+
+import asyncio
+import heapq
+import re
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import azure.cosmos
+import azure.cosmos.aio
+from azure.core import MatchConditions
+
+SELECT_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?:TOP\s+(?P<top>@\w+|\d+)\s+)?(?P<distinct>DISTINCT\s+)?(?P<value>VALUE\s+)?"
+    r"(?P<fields>.+?)\s+FROM\s+c"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>c\.\w+(?:\s+(?:ASC|DESC))?(?:\s*,\s*c\.\w+(?:\s+(?:ASC|DESC))?)*))?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+CONDITION_PATTERN = re.compile(r"^c\.(\w+)(?:\[(@\w+)\])?\s*(=|!=|<=|>=|<|>)\s*(@\w+|'[^']*'|true|false)$")
+LITERALS = {"true": True, "false": False}
+OPERATORS = {
+    "=": lambda left, right: left == right,
+    "!=": lambda left, right: left != right,
+    "<": lambda left, right: left is not None and left < right,
+    ">": lambda left, right: left is not None and left > right,
+    "<=": lambda left, right: left is not None and left <= right,
+    ">=": lambda left, right: left is not None and left >= right,
+}
+
+
+def _split_top_level(text, keyword):
+    """Split ``text`` on ``keyword`` (AND/OR) wherever it isn't inside parentheses."""
+    separator = re.compile(rf"\s+{keyword}\s+", re.IGNORECASE)
+    parts, depth, start, index = [], 0, 0, 0
+    while index < len(text):
+        char = text[index]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0:
+            match = separator.match(text, index)
+            if match:
+                parts.append(text[start:index])
+                index = start = match.end()
+                continue
+        index += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _strip_parentheses(text):
+    while text.startswith("(") and text.endswith(")"):
+        depth = 0
+        for index, char in enumerate(text):
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            if depth == 0 and index < len(text) - 1:
+                return text
+        text = text[1:-1].strip()
+    return text
+
+
+def parse_condition(text, params):
+    """Compile a ``WHERE`` condition into a predicate over documents."""
+    text = _strip_parentheses(text.strip())
+    alternatives = _split_top_level(text, "OR")
+    if len(alternatives) > 1:
+        predicates = [parse_condition(part, params) for part in alternatives]
+        return lambda item: any(predicate(item) for predicate in predicates)
+    clauses = _split_top_level(text, "AND")
+    if len(clauses) > 1:
+        predicates = [parse_condition(part, params) for part in clauses]
+        return lambda item: all(predicate(item) for predicate in predicates)
+
+    condition = CONDITION_PATTERN.match(text)
+    if not condition:
+        raise NotImplementedError(f"Unsupported condition for stub container: {text}")
+    field, key, operator, operand = condition.groups()
+    value = params[operand] if operand.startswith("@") else LITERALS.get(operand, operand.strip("'"))
+    compare = OPERATORS[operator]
+    if key:
+        key = params[key]
+        return lambda item: compare((item.get(field) or {}).get(key), value)
+    return lambda item: compare(item.get(field), value)
+
+
+def equality_lookup(text, params):
+    """Return the (field, value) of a top-level ``c.<field> = @param`` clause of a condition, or None."""
+    text = _strip_parentheses(text.strip())
+    if len(_split_top_level(text, "OR")) > 1:
+        return None
+    for clause in _split_top_level(text, "AND"):
+        condition = CONDITION_PATTERN.match(_strip_parentheses(clause.strip()))
+        if condition and not condition.group(2) and condition.group(3) == "=" and condition.group(4).startswith("@"):
+            value = params[condition.group(4)]
+            if _hashable(value):
+                return condition.group(1), value
+    return None
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class StubContainer:
+    def __init__(self, name, items=None, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.round_trips = 0
+        self.etag_counter = 0
+        self._lock = threading.RLock()
+        self.load(items or [])
+
+    def load(self, items):
+        """Replace the container's documents, dropping any indexes built over the previous ones."""
+        with self._lock:
+            self.items = {item["id"]: item for item in items}
+            # field -> value -> {id: None}; documents whose value isn't hashable are never matched by equality
+            self._indexes = {}
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _index(self, field):
+        if field not in self._indexes:
+            index = {}
+            for item_id, item in self.items.items():
+                value = item.get(field)
+                if _hashable(value):
+                    index.setdefault(value, {})[item_id] = None
+            self._indexes[field] = index
+        return self._indexes[field]
+
+    def _reindex(self, item_id, old, new):
+        for field, index in self._indexes.items():
+            old_value = old.get(field) if old else None
+            new_value = new.get(field) if new else None
+            if old and _hashable(old_value):
+                index.get(old_value, {}).pop(item_id, None)
+            if new and _hashable(new_value):
+                index.setdefault(new_value, {})[item_id] = None
+
+    def read_item(self, item, partition_key, etag=None, match_condition=None, **kwargs):
+        self._round_trip()
+        return self._read(item, etag, match_condition)
+
+    def _read(self, item, etag=None, match_condition=None):
+        with self._lock:
+            if item not in self.items:
+                raise azure.cosmos.exceptions.CosmosResourceNotFoundError(message=f"{item} not found")
+            if match_condition == MatchConditions.IfModified and self.items[item].get("_etag") == etag:
+                # 304 Not Modified
+                return None
+            return dict(self.items[item])
+
+    def create_item(self, body, **kwargs):
+        if body["id"] in self.items:
+            self._round_trip()
+            raise azure.cosmos.exceptions.CosmosResourceExistsError(message=f"{body['id']} already exists")
+        return self.upsert_item(body)
+
+    def upsert_item(self, body, etag=None, match_condition=None, **kwargs):
+        self._round_trip()
+        return self._store(body, etag)
+
+    def put(self, body):
+        """Store a document without a round trip, as another service writing to the account would."""
+        return self._store(body)
+
+    def _store(self, body, etag=None):
+        with self._lock:
+            current = self.items.get(body["id"])
+            if etag and (current is None or current.get("_etag") != etag):
+                raise azure.cosmos.exceptions.CosmosAccessConditionFailedError(message=f"{body['id']} was modified")
+            self.etag_counter += 1
+            item = {**body, "_etag": f'"{self.etag_counter}"'}
+            self.items[body["id"]] = item
+            self._reindex(body["id"], current, item)
+            return dict(item)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        self._round_trip()
+        return self._replace(item, body, etag)
+
+    def _replace(self, item, body, etag=None):
+        with self._lock:
+            if item not in self.items:
+                raise azure.cosmos.exceptions.CosmosResourceNotFoundError(message=f"{item} not found")
+            return self._store(body, etag)
+
+    def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        self._round_trip()
+        with self._lock:
+            if item not in self.items:
+                raise azure.cosmos.exceptions.CosmosResourceNotFoundError(message=f"{item} not found")
+            body = dict(self.items[item])
+            for operation in patch_operations:
+                if operation["op"] not in ("set", "replace", "add"):
+                    raise NotImplementedError(f"Unsupported patch operation for stub container: {operation['op']}")
+                *parents, name = [
+                    part.replace("~1", "/").replace("~0", "~") for part in operation["path"].lstrip("/").split("/")
+                ]
+                target = body
+                for parent in parents:
+                    if not isinstance(target.get(parent), dict):
+                        raise azure.cosmos.exceptions.CosmosHttpResponseError(
+                            status_code=400, message=f"{item} has no {operation['path']} parent"
+                        )
+                    target[parent] = target = dict(target[parent])
+                target[name] = operation["value"]
+            return self._store(body)
+
+    def delete_item(self, item, partition_key, **kwargs):
+        self._round_trip()
+        self._delete(item)
+
+    def _delete(self, item):
+        with self._lock:
+            removed = self.items.pop(item, None)
+            if removed is None:
+                raise azure.cosmos.exceptions.CosmosResourceNotFoundError(message=f"{item} not found")
+            self._reindex(item, removed, None)
+
+    def query_items(self, query, parameters=None, enable_cross_partition_query=False, max_item_count=None, **kwargs):
+        self._round_trip()
+        match = SELECT_PATTERN.match(query)
+        if not match:
+            raise NotImplementedError(f"Unsupported query for stub container: {query}")
+
+        params = {param["name"]: param["value"] for param in (parameters or [])}
+        where = match.group("where")
+        predicate = parse_condition(where, params) if where else None
+        lookup = equality_lookup(where, params) if where else None
+        with self._lock:
+            if lookup:
+                field, value = lookup
+                candidates = [self.items[item_id] for item_id in self._index(field).get(value, ())]
+            else:
+                candidates = list(self.items.values())
+        matches = [item for item in candidates if predicate is None or predicate(item)]
+
+        top = match.group("top")
+        limit = int(params[top] if top.startswith("@") else top) if top else None
+        order = [key.strip()[2:].partition(" ") for key in match.group("order").split(",")] if match.group("order") else []
+        if len(order) == 1 and limit is not None:
+            # Only the first ``limit`` documents are needed; same result as sorting and slicing
+            field, _, direction = order[0]
+            pick = heapq.nlargest if direction.strip().upper() == "DESC" else heapq.nsmallest
+            matches = pick(limit, matches, key=lambda item: item.get(field) or "")
+        else:
+            # Stable sorts from the last key to the first give a multi-key order
+            for field, _, direction in reversed(order):
+                matches.sort(key=lambda item: item.get(field) or "", reverse=direction.strip().upper() == "DESC")
+
+        fields = [field.strip() for field in match.group("fields").split(",")]
+        results = [self._project(item, fields, bool(match.group("value"))) for item in matches]
+        if limit is not None:
+            results = results[:limit]
+
+        if match.group("distinct"):
+            if match.group("value"):
+                results = list(dict.fromkeys(results))
+            else:
+                results = [dict(row) for row in {tuple(sorted(row.items())) for row in results}]
+        return iter(results)
+
+    @staticmethod
+    def _project(item, fields, value_only):
+        if fields == ["*"]:
+            return dict(item)
+        names = [field[2:] if field.startswith("c.") else field for field in fields]
+        if value_only:
+            return item.get(names[0])
+        return {name: item.get(name) for name in names if name in item}
+
+
+class AsyncStubContainer:
+    """Awaitable view over a ``StubContainer`` whose latency is spent in ``asyncio.sleep``."""
+
+    def __init__(self, container):
+        self.container = container
+
+    async def _round_trip(self):
+        self.container.round_trips += 1
+        if self.container.latency:
+            await asyncio.sleep(self.container.latency)
+
+    async def read_item(self, item, partition_key, etag=None, match_condition=None, **kwargs):
+        await self._round_trip()
+        return self.container._read(item, etag, match_condition)
+
+    async def create_item(self, body, **kwargs):
+        await self._round_trip()
+        if body["id"] in self.container.items:
+            raise azure.cosmos.exceptions.CosmosResourceExistsError(message=f"{body['id']} already exists")
+        return self.container._store(body)
+
+    async def upsert_item(self, body, etag=None, match_condition=None, **kwargs):
+        await self._round_trip()
+        return self.container._store(body, etag)
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        await self._round_trip()
+        return self.container._replace(item, body, etag)
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        await self._round_trip()
+        latency, self.container.latency = self.container.latency, 0
+        try:
+            return self.container.patch_item(item, partition_key, patch_operations)
+        finally:
+            self.container.latency = latency
+            self.container.round_trips -= 1
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        await self._round_trip()
+        self.container._delete(item)
+
+    async def _iterate(self, query, parameters, kwargs):
+        await self._round_trip()
+        # The sync stub evaluates the query; undo its round trip so each call counts once.
+        latency, self.container.latency = self.container.latency, 0
+        try:
+            results = list(self.container.query_items(query, parameters=parameters, **kwargs))
+        finally:
+            self.container.latency = latency
+            self.container.round_trips -= 1
+        for item in results:
+            yield item
+
+    def query_items(self, query, parameters=None, **kwargs):
+        return self._iterate(query, parameters, kwargs)
+
+
+class StubDatabase:
+    def __init__(self, containers, latency=0.0):
+        self.containers = containers
+        self.latency = latency
+
+    def read(self, **kwargs):
+        time.sleep(self.latency)
+        return {"id": "stub"}
+
+    def get_container_client(self, name):
+        if name not in self.containers:
+            self.containers[name] = StubContainer(name, latency=self.latency)
+        return self.containers[name]
+
+
+class StubCosmosClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.containers = {}
+
+    def get_database_client(self, name):
+        return StubDatabase(self.containers, latency=self.latency)
+
+    def seed(self, name, items):
+        container = self.get_database_client(None).get_container_client(name)
+        container.load(dict(item) for item in items)
+        return container
+
+    def async_client(self):
+        """Return an object shaped like ``azure.cosmos.aio.CosmosClient`` over the same containers."""
+        stub = self
+
+        class _AsyncDatabase:
+            def get_container_client(self, name):
+                return AsyncStubContainer(stub.get_database_client(None).get_container_client(name))
+
+        class _AsyncClient:
+            def get_database_client(self, name):
+                return _AsyncDatabase()
+
+            async def close(self):
+                pass
+
+        return _AsyncClient()
+
+    def round_trips(self):
+        return sum(container.round_trips for container in self.containers.values())
+
+    def reset_round_trips(self):
+        for container in self.containers.values():
+            container.round_trips = 0
+
+
+@contextmanager
+def patched_cosmos_client(latency=0.0, connect_latency=0.0):
+    """
+    Route the sync and async ``CosmosClient.from_connection_string`` to a fresh
+    stub client while the context is active. The data layer creates its client
+    on first use, so Cosmos calls must be made inside the context.
+
+    :param connect_latency: Seconds the sync client takes to create, like the
+        account lookup a real ``CosmosClient`` makes when it is constructed.
+    """
+    stub = StubCosmosClient(latency=latency)
+
+    def connect(*args, **kwargs):
+        time.sleep(connect_latency)
+        return stub
+
+    with mock.patch.object(azure.cosmos.CosmosClient, "from_connection_string", side_effect=connect), \
+            mock.patch.object(azure.cosmos.aio.CosmosClient, "from_connection_string", side_effect=lambda *args, **kwargs: stub.async_client()):
+        yield stub
@@ -0,0 +1,83 @@
+"""
+Measure how long a new worker takes to import the app and serve its first
+patient details request.
+
+Each scenario runs in a fresh interpreter that sets up Django and imports
+``patients.views`` against the stub Cosmos client, whose construction takes
+``--connect-ms`` like the account lookup a real ``CosmosClient`` makes:
+
+- "eager" creates the client right after import, as the data layer used to
+  at import time,
+- "lazy" leaves it to the first request,
+- "warm" runs ``cosmosdb_helper.warm_up()`` first, as the gunicorn
+  ``post_fork`` hook does.
+
+Usage:
+    python -m benchmarks.worker_startup [--runs 5] [--connect-ms 300] [--latency-ms 20]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIO = """
+import json, time
+started = time.perf_counter()
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medicalrecords.settings")
+os.environ["PATIENT_CACHE_TTL"] = "0"
+from benchmarks.stub_cosmos import patched_cosmos_client
+with patched_cosmos_client(latency={latency}, connect_latency={connect_latency}) as stub:
+    import django
+    django.setup()
+    import patients.views
+    from services import cosmosdb_helper
+    if "{mode}" == "eager":
+        cosmosdb_helper.get_client()
+    imported = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if "{mode}" == "warm":
+        cosmosdb_helper.warm_up()
+    warm_up = time.perf_counter() - started
+
+    stub.seed("patients", [{{"id": "p1", "user_id": "u1", "name": "Patient"}}])
+    stub.seed("users", [{{"id": "u1", "email": "u1@example.com"}}])
+    requests = []
+    for _ in range(2):
+        started = time.perf_counter()
+        cosmosdb_helper.get_patient_details("p1")
+        requests.append(time.perf_counter() - started)
+print(json.dumps({{"import": imported, "warm_up": warm_up, "first": requests[0], "second": requests[1]}}))
+"""
+
+
+def run(mode, connect_latency, latency):
+    output = subprocess.run(
+        [sys.executable, "-c", SCENARIO.format(mode=mode, connect_latency=connect_latency, latency=latency)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--connect-ms", type=float, default=300.0, help="Simulated client construction time.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated latency per Cosmos round trip.")
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'import s':>9} {'warm-up s':>10} {'first req ms':>13} {'second req ms':>14}")
+    for mode in ("eager", "lazy", "warm"):
+        samples = [run(mode, args.connect_ms / 1000, args.latency_ms / 1000) for _ in range(args.runs)]
+        median = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+        print(
+            f"{mode:>6} {median['import']:>9.3f} {median['warm_up']:>10.3f} "
+            f"{median['first'] * 1000:>13.1f} {median['second'] * 1000:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts from the project root:
+
+    gunicorn medicalrecords.wsgi:application --bind 0.0.0.0:8000
+"""
+
+from dotenv import load_dotenv
+
+# The same environment file as medicalrecords/settings.py, so the worker hooks see the connection string
+load_dotenv(".env.local")
+
+def post_fork(server, worker):
+    # Each worker builds its own Cosmos DB client after forking and connects before taking requests
+    from services import cosmosdb_helper
+    cosmosdb_helper.warm_up()
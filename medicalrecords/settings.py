@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,15 +51,51 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "middleware.custom_session_middleware.CosmosDBSessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "middleware.custom_session_middleware.CosmosDBSessionMiddleware"
 ]
 
+# Where sessions are kept, selected with SESSION_STORE:
+#   "cosmos"  - the Cosmos DB "sessions" container; documents expire through the
+#               container's time-to-live, which must be enabled (default TTL -1)
+#   "cached"  - the same container behind a short-lived per-process cache; each
+#               cached read is revalidated with a conditional read on its etag
+#   "cookie"  - a signed, expiring cookie; no server-side store is touched
+SESSION_ENGINES = {
+    "cosmos": "middleware.cosmos_session",
+    "cached": "middleware.cached_cosmos_session",
+    "cookie": "django.contrib.sessions.backends.signed_cookies",
+}
+SESSION_STORE = os.getenv("SESSION_STORE", "cosmos")
+if SESSION_STORE not in SESSION_ENGINES:
+    raise ImproperlyConfigured(f"SESSION_STORE must be one of {', '.join(SESSION_ENGINES)}, not '{SESSION_STORE}'.")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_STORE]
+SESSION_CACHE_ALIAS = "sessions"
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "30"))
+
+# Serve the Cosmos-bound views and session middleware through azure.cosmos.aio.
+# Only takes effect when the app runs under ASGI (medicalrecords.asgi).
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "false").lower() == "true"
+
+if ASYNC_VIEWS:
+    MIDDLEWARE[MIDDLEWARE.index("middleware.custom_session_middleware.CosmosDBSessionMiddleware")] = (
+        "middleware.custom_session_middleware.AsyncCosmosDBSessionMiddleware"
+    )
+
+# Record latency and request charge for every Cosmos DB call, add a Server-Timing
+# header and a JSON log line per request, and serve Prometheus metrics at /metrics
+# to scrapers sending "Authorization: Bearer <COSMOS_METRICS_TOKEN>". /metrics
+# isn't served when no token is set.
+COSMOS_METRICS = os.getenv("COSMOS_METRICS", "false").lower() == "true"
+COSMOS_METRICS_TOKEN = os.getenv("COSMOS_METRICS_TOKEN", "")
+
+if COSMOS_METRICS:
+    MIDDLEWARE.insert(0, "middleware.cosmos_metrics_middleware.CosmosMetricsMiddleware")
+
 ROOT_URLCONF = "medicalrecords.urls"
 
 TEMPLATES = [
@@ -91,6 +128,77 @@ DATABASES = {
 }
 
 
+# Maximum rows accepted by one bulk medical record submission
+BULK_RECORDS_MAX_ROWS = 1000
+
+# Bulk patient imports (manage.py import_patients and the upload page): rows per
+# checkpointed chunk, threads writing to Cosmos DB, and processes hashing passwords
+PATIENT_IMPORT_CHUNK_SIZE = int(os.getenv("PATIENT_IMPORT_CHUNK_SIZE", "200"))
+PATIENT_IMPORT_WRITE_WORKERS = int(os.getenv("PATIENT_IMPORT_WRITE_WORKERS", "16"))
+PATIENT_IMPORT_HASH_WORKERS = int(os.getenv("PATIENT_IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Where uploaded patient files wait for the import worker; shared by the web and worker processes
+PATIENT_IMPORT_DIR = os.getenv("PATIENT_IMPORT_DIR", str(BASE_DIR / "patient_imports"))
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CHART_CACHE_TTL = 300
+# Seconds each process keeps the published risk cube and its rollups before
+# reading the cube again
+RISK_CUBE_CACHE_TTL = int(os.getenv("RISK_CUBE_CACHE_TTL", "60"))
+
+# Cached patient details pages (patient, user, medical records and notifications),
+# selected with PATIENT_CACHE:
+#   "local"  - a per-process LRU; each web process follows the Cosmos change feeds
+#              every PATIENT_CACHE_FEED_INTERVAL seconds to drop changed patients
+#   "shared" - Redis at PATIENT_CACHE_URL (needs the redis package), shared by every
+#              process; run `manage.py run_patient_cache_invalidator` once alongside
+# Entries also expire after PATIENT_CACHE_TTL seconds; 0 disables the cache.
+PATIENT_CACHE = os.getenv("PATIENT_CACHE", "local")
+PATIENT_CACHE_TTL = int(os.getenv("PATIENT_CACHE_TTL", "60"))
+PATIENT_CACHE_FEED_INTERVAL = float(os.getenv("PATIENT_CACHE_FEED_INTERVAL", "5"))
+PATIENT_CACHE_BACKENDS = {
+    "local": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "patient_details",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("PATIENT_CACHE_URL", "redis://localhost:6379/1"),
+    },
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Rendered report charts, keyed by a hash of their bucket counts (LRU with TTL)
+    "charts": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "charts",
+        "TIMEOUT": CHART_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": 64},
+    },
+    # Risk cube document and the dashboard rollups computed from it (LRU with TTL)
+    "risk_cube": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "risk_cube",
+        "TIMEOUT": RISK_CUBE_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": 256},
+    },
+    # Session reads for the "cached" session store (LRU with TTL)
+    "sessions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "sessions",
+        "TIMEOUT": SESSION_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    "patient_details": {**PATIENT_CACHE_BACKENDS[PATIENT_CACHE], "TIMEOUT": PATIENT_CACHE_TTL},
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,3 +239,13 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Age-based risk distribution report
+# Inclusive upper age of every bucket but the last: 0-18, 19-30, ..., 61+
+
+AGE_RISK_BUCKET_EDGES = [18, 30, 40, 50, 60]
+
+# "svg" draws the chart inline from the bucket data; "png" renders it with
+# matplotlib, which is only imported by workers that serve the PNG.
+AGE_RISK_CHART_MODE = os.getenv("AGE_RISK_CHART_MODE", "svg")
@@ -15,12 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
+from patients.views import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('patients/', include('patients.urls')),
 ]
 
+if settings.COSMOS_METRICS and settings.COSMOS_METRICS_TOKEN:
+    urlpatterns.append(path("metrics", metrics_view, name="metrics"))
+
 handler404 = 'patients.views.custom_page_not_found_view'
\ No newline at end of file
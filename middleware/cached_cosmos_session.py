@@ -0,0 +1,200 @@
+"""
+Cosmos DB session engine with a per-process read cache.
+
+Sessions are read through the ``SESSION_CACHE_ALIAS`` cache (a bounded LRU
+``LocMemCache`` with a short timeout). A cached session is revalidated on every
+load with a conditional read on its ``_etag``, which costs a 304 without a body
+while the session is unchanged; another worker's changes, including logout and
+role changes, are seen on the next request.
+
+Saves replace the document only if it still has the ``_etag`` it was loaded
+with. If another worker changed it in the meantime, this request's changes are
+merged into the current version; if it was deleted (e.g. by logout), the write
+is dropped and ``UpdateError`` raised, so a logged-out session never comes back.
+Select it with ``SESSION_ENGINE = "middleware.cached_cosmos_session"``.
+"""
+
+import copy
+import logging
+
+from azure.cosmos import exceptions
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.core.cache import caches
+from middleware.cosmos_session import SessionStore as CosmosStore
+from services import cosmosdb_helper, cosmosdb_helper_async
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "middleware.cached_cosmos_session"
+# Times a save is merged into a session other workers keep changing before giving up
+MERGE_ATTEMPTS = 3
+
+
+class SessionStore(CosmosStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        # Session data and etag as loaded, to make saves conditional and merge them on conflict
+        self._loaded = {}
+        self._etag = None
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    async def acache_key(self):
+        return self.cache_key_prefix + await self._aget_or_create_session_key()
+
+    def _cache_timeout(self, expiry_age):
+        return min(self._cache.default_timeout, expiry_age)
+
+    def _cached_entry(self):
+        try:
+            return self._cache.get(self.cache_key)
+        except Exception:
+            return None
+
+    async def _acached_entry(self):
+        try:
+            return await self._cache.aget(await self.acache_key())
+        except Exception:
+            return None
+
+    def _remember(self, data, etag):
+        self._loaded = copy.deepcopy(data)
+        self._etag = etag
+
+    def _merged(self, current):
+        """Apply the changes made to the session since it was loaded to ``current``."""
+        merged = dict(current)
+        for key in self._loaded.keys() - self._session_cache.keys():
+            merged.pop(key, None)
+        for key, value in self._session_cache.items():
+            if key not in self._loaded or self._loaded[key] != value:
+                merged[key] = value
+        return merged
+
+    def load(self):
+        if not self.session_key:
+            return {}
+        cached = self._cached_entry()
+        if cached is None or not cached["etag"]:
+            session = cosmosdb_helper.get_session_item(self.session_key)
+        else:
+            changed, session = cosmosdb_helper.read_session_if_changed(self.session_key, cached["etag"])
+            if not changed:
+                self._remember(cached["data"], cached["etag"])
+                return cached["data"]
+        if not session:
+            self._cache.delete(self.cache_key)
+            self._session_key = None
+            return {}
+        cached = {"data": session.get("data", {}), "etag": session.get("_etag")}
+        self._cache.set(
+            self.cache_key,
+            cached,
+            self._cache_timeout(self.get_expiry_age(expiry=cached["data"].get("_session_expiry"))),
+        )
+        self._remember(cached["data"], cached["etag"])
+        return cached["data"]
+
+    async def aload(self):
+        if not self.session_key:
+            return {}
+        cached = await self._acached_entry()
+        if cached is None or not cached["etag"]:
+            session = await cosmosdb_helper_async.get_session_item(self.session_key)
+        else:
+            changed, session = await cosmosdb_helper_async.read_session_if_changed(self.session_key, cached["etag"])
+            if not changed:
+                self._remember(cached["data"], cached["etag"])
+                return cached["data"]
+        if not session:
+            await self._cache.adelete(await self.acache_key())
+            self._session_key = None
+            return {}
+        cached = {"data": session.get("data", {}), "etag": session.get("_etag")}
+        await self._cache.aset(
+            await self.acache_key(),
+            cached,
+            self._cache_timeout(await self.aget_expiry_age(expiry=cached["data"].get("_session_expiry"))),
+        )
+        self._remember(cached["data"], cached["etag"])
+        return cached["data"]
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if must_create:
+            etag = self._write(must_create)
+        else:
+            etag = self._replace()
+        self._remember(self._session, etag)
+        self._cache.set(
+            self.cache_key, {"data": self._session, "etag": etag}, self._cache_timeout(self.get_expiry_age())
+        )
+
+    def _replace(self):
+        """Write the session over the version it was loaded from, merging in concurrent changes."""
+        self._get_session()
+        for _ in range(MERGE_ATTEMPTS):
+            if self.session_key is None or self._etag is None:
+                break
+            try:
+                return self._write(etag=self._etag)
+            except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+                self._cache.delete(self.cache_key)
+            current = cosmosdb_helper.get_session_item(self.session_key)
+            if current is None:
+                break
+            logger.info(f"Session {self.session_key} was changed by another worker; merging into it.")
+            self._session_cache = self._merged(current.get("data", {}))
+            self._remember(current.get("data", {}), current.get("_etag"))
+        logger.warning(f"Session {self.session_key} was deleted or keeps changing; dropping the write.")
+        raise UpdateError
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        if must_create:
+            etag = await self._awrite(must_create)
+        else:
+            etag = await self._areplace()
+        data = await self._aget_session()
+        self._remember(data, etag)
+        await self._cache.aset(
+            await self.acache_key(), {"data": data, "etag": etag}, self._cache_timeout(await self.aget_expiry_age())
+        )
+
+    async def _areplace(self):
+        await self._aget_session()
+        for _ in range(MERGE_ATTEMPTS):
+            if self.session_key is None or self._etag is None:
+                break
+            try:
+                return await self._awrite(etag=self._etag)
+            except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+                await self._cache.adelete(await self.acache_key())
+            current = await cosmosdb_helper_async.get_session_item(self.session_key)
+            if current is None:
+                break
+            logger.info(f"Session {self.session_key} was changed by another worker; merging into it.")
+            self._session_cache = self._merged(current.get("data", {}))
+            self._remember(current.get("data", {}), current.get("_etag"))
+        logger.warning(f"Session {self.session_key} was deleted or keeps changing; dropping the write.")
+        raise UpdateError
+
+    def delete(self, session_key=None):
+        super().delete(session_key)
+        session_key = session_key or self.session_key
+        if session_key:
+            self._cache.delete(self.cache_key_prefix + session_key)
+
+    async def adelete(self, session_key=None):
+        await super().adelete(session_key)
+        session_key = session_key or self.session_key
+        if session_key:
+            await self._cache.adelete(self.cache_key_prefix + session_key)
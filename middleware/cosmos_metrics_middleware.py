@@ -0,0 +1,69 @@
+import json
+import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from services import cosmos_metrics
+
+logger = logging.getLogger(__name__)
+
+class CosmosMetricsMiddleware:
+    """
+    Collect the Cosmos DB calls made while serving each request.
+
+    Adds a ``Server-Timing`` header with the Cosmos time and request charge,
+    logs one JSON line per request and feeds the per-view histograms served
+    at ``/metrics``. Only installed when ``COSMOS_METRICS`` is enabled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = cosmos_metrics.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            cosmos_metrics.end_request(token)
+        return self.process_response(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = cosmos_metrics.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            cosmos_metrics.end_request(token)
+        return self.process_response(request, response, metrics)
+
+    def process_response(self, request, response, metrics):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        totals = cosmos_metrics.observe_request(view, metrics)
+        response["Server-Timing"] = cosmos_metrics.server_timing(metrics)
+        logger.info(json.dumps({
+            "event": "cosmos_request",
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "calls": totals["calls"],
+            "cosmos_ms": round(totals["seconds"] * 1000, 1),
+            "request_charge": round(totals["request_charge"], 2),
+            "items": totals["items"],
+            "operations": [
+                {
+                    "container": container,
+                    "operation": operation,
+                    "calls": values["calls"],
+                    "cosmos_ms": round(values["seconds"] * 1000, 1),
+                    "request_charge": round(values["request_charge"], 2),
+                    "items": values["items"],
+                }
+                for (container, operation), values in sorted(metrics.operations.items())
+            ],
+        }))
+        return response
@@ -0,0 +1,105 @@
+"""
+Django session engine that stores sessions in the Cosmos DB ``sessions`` container.
+
+Documents keep the existing ``{"id": ..., "data": {...}}`` shape, plus a ``ttl``
+matching the session expiry so Cosmos removes abandoned sessions on its own.
+Select it with ``SESSION_ENGINE = "middleware.cosmos_session"``.
+"""
+
+from azure.cosmos import exceptions
+from django.contrib.sessions.backends.base import CreateError, SessionBase
+from services import cosmosdb_helper, cosmosdb_helper_async
+
+
+class SessionStore(SessionBase):
+    def load(self):
+        if not self.session_key:
+            return {}
+        data = cosmosdb_helper.get_session_data(self.session_key)
+        if not data:
+            self._session_key = None
+        return data
+
+    async def aload(self):
+        if not self.session_key:
+            return {}
+        data = await cosmosdb_helper_async.get_session_data(self.session_key)
+        if not data:
+            self._session_key = None
+        return data
+
+    def exists(self, session_key):
+        return cosmosdb_helper.session_exists(session_key)
+
+    async def aexists(self, session_key):
+        return await cosmosdb_helper_async.session_exists(session_key)
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        self._write(must_create)
+
+    def _write(self, must_create=False, etag=None):
+        """Write the session document and return its new etag."""
+        data = self._get_session(no_load=must_create)
+        ttl = self.get_expiry_age()
+        try:
+            if must_create:
+                item = cosmosdb_helper.create_session_data(self.session_key, data, ttl)
+            else:
+                item = cosmosdb_helper.save_session_data(self.session_key, data, ttl, etag=etag)
+        except exceptions.CosmosResourceExistsError:
+            raise CreateError
+        return item.get("_etag")
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        await self._awrite(must_create)
+
+    async def _awrite(self, must_create=False, etag=None):
+        data = await self._aget_session(no_load=must_create)
+        ttl = await self.aget_expiry_age()
+        try:
+            if must_create:
+                item = await cosmosdb_helper_async.create_session_data(self.session_key, data, ttl)
+            else:
+                item = await cosmosdb_helper_async.save_session_data(self.session_key, data, ttl, etag=etag)
+        except exceptions.CosmosResourceExistsError:
+            raise CreateError
+        return item.get("_etag")
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key:
+            cosmosdb_helper.delete_session_data(session_key)
+
+    async def adelete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key:
+            await cosmosdb_helper_async.delete_session_data(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        # Expired sessions are removed by the container's time-to-live.
+        pass
@@ -1,15 +1,88 @@
-import uuid
-from django.utils.deprecation import MiddlewareMixin
-from services.cosmosdb_helper import get_session_data, save_session_data
-
-class CosmosDBSessionMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        session_id = request.COOKIES.get('sessionid', str(uuid.uuid4()))
-        session_data = get_session_data(session_id)
-        request.session = session_data or {}
-
-    def process_response(self, request, response):
-        session_id = request.COOKIES.get('sessionid', str(uuid.uuid4()))
-        save_session_data(session_id, request.session)
-        response.set_cookie('sessionid', session_id)
+import time
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.exceptions import SessionInterrupted
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+
+class CosmosDBSessionMiddleware(SessionMiddleware):
+    """
+    Session middleware for the store chosen by ``SESSION_STORE`` (Cosmos DB by default).
+
+    Sessions load lazily on first access, are written back only when modified,
+    and the cookie is only set for non-empty sessions that changed, so requests
+    that never touch the session don't cost a Cosmos read or write.
+    """
+
+class AsyncCosmosDBSessionMiddleware(CosmosDBSessionMiddleware):
+    """
+    Async-only counterpart of ``CosmosDBSessionMiddleware`` that loads and saves
+    sessions through the ``azure.cosmos.aio`` client without leaving the event loop.
+    """
+    sync_capable = False
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        self.process_request(request)
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            # Load up front so later synchronous session access doesn't block the loop.
+            await request.session.aitems()
+
+        response = await self.get_response(request)
+        return await self.aprocess_response(request, response)
+
+    async def aprocess_response(self, request, response):
+        """Async version of ``SessionMiddleware.process_response``."""
+        try:
+            accessed = request.session.accessed
+            modified = request.session.modified
+            empty = request.session.is_empty()
+        except AttributeError:
+            return response
+
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and empty:
+            response.delete_cookie(
+                settings.SESSION_COOKIE_NAME,
+                path=settings.SESSION_COOKIE_PATH,
+                domain=settings.SESSION_COOKIE_DOMAIN,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+            patch_vary_headers(response, ("Cookie",))
+            return response
+
+        if accessed:
+            patch_vary_headers(response, ("Cookie",))
+        if not (modified or settings.SESSION_SAVE_EVERY_REQUEST) or empty or response.status_code >= 500:
+            return response
+
+        if await request.session.aget_expire_at_browser_close():
+            max_age = None
+            expires = None
+        else:
+            max_age = await request.session.aget_expiry_age()
+            expires = http_date(time.time() + max_age)
+
+        try:
+            await request.session.asave()
+        except UpdateError:
+            raise SessionInterrupted(
+                "The request's session was deleted before the request completed."
+            )
+        response.set_cookie(
+            settings.SESSION_COOKIE_NAME,
+            request.session.session_key,
+            max_age=max_age,
+            expires=expires,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            path=settings.SESSION_COOKIE_PATH,
+            secure=settings.SESSION_COOKIE_SECURE or None,
+            httponly=settings.SESSION_COOKIE_HTTPONLY or None,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
         return response
@@ -0,0 +1,117 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from patients.decorators import login_required, role_required
+from patients.outbox import unsent_records
+from patients.patient_cache_feed import start_listener
+from patients.views import (
+    HEALTH_NOTIFICATION_FIELDS,
+    MEDICAL_RECORD_FIELDS,
+    MEDICAL_RECORDS_PAGE_SIZE,
+    PATIENT_LIST_FIELDS,
+    PATIENTS_PAGE_SIZE,
+    _medical_records_page_response,
+    _parse_page_cursor,
+    _parse_patient_search,
+    _parse_record_filters,
+    _patient_details_context,
+    _patient_search_context,
+    _patients_page_context,
+    _login_busy_response,
+    _astart_session,
+)
+from services import cosmosdb_helper_async as cosmos
+from services.passwords import PasswordHasherBusy
+
+logger = logging.getLogger(__name__)
+
+# Async variants of the Cosmos-bound views, used when ASYNC_VIEWS is enabled
+# and the app is served through medicalrecords.asgi.
+
+@login_required
+@role_required(['Doctor'])
+async def view_patients(request):
+    search = _parse_patient_search(request.GET)
+    if search:
+        cursor = request.GET.get("cursor")
+        try:
+            page = await cosmos.search_patients(page_size=PATIENTS_PAGE_SIZE, cursor=cursor, fields=PATIENT_LIST_FIELDS, **search)
+        except ValueError:
+            logger.warning(f"Ignoring invalid patient search cursor: {cursor}")
+            cursor = None
+            page = await cosmos.search_patients(page_size=PATIENTS_PAGE_SIZE, fields=PATIENT_LIST_FIELDS, **search)
+        logger.info(f"Found {len(page['patients'])} patients matching {search}")
+        return render(request, 'patients/view_patients.html', _patient_search_context(request.GET, page, cursor))
+
+    direction, cursor_id = _parse_page_cursor(request.GET.get('page'))
+
+    patients, has_previous, has_more = await cosmos.get_patients_page_by_cursor(
+        page_size=PATIENTS_PAGE_SIZE,
+        after_id=cursor_id if direction == "after" else None,
+        before_id=cursor_id if direction == "before" else None,
+        fields=PATIENT_LIST_FIELDS,
+    )
+    logger.info(f"Retrieved {len(patients)} patients")
+
+    context = _patients_page_context(patients, has_previous, has_more)
+    return render(request, 'patients/view_patients.html', context)
+
+@login_required
+@role_required(['Patient', 'Doctor'])
+async def patient_user_details(request, patient_id):
+    start_listener()
+    record_filters = _parse_record_filters(request.GET)
+    patient, user, medical_records, health_notifications = await cosmos.get_cached_patient_details(
+        patient_id,
+        record_fields=MEDICAL_RECORD_FIELDS,
+        notification_fields=HEALTH_NOTIFICATION_FIELDS,
+        record_page_size=MEDICAL_RECORDS_PAGE_SIZE,
+        record_filters=record_filters,
+    )
+
+    if not patient:
+        logger.warning(f"No patient found with ID: {patient_id}")
+        return render(request, '404.html', status=404)
+
+    pending_records = await sync_to_async(unsent_records)(patient_id)
+    context = _patient_details_context(
+        patient, user, medical_records, health_notifications, pending_records, record_filters
+    )
+    return render(request, 'patients/patient_user_details.html', context)
+
+@login_required
+@role_required(['Patient', 'Doctor'])
+async def medical_records_page_view(request, patient_id):
+    try:
+        page = await cosmos.get_medical_records_page(
+            patient_id,
+            page_size=MEDICAL_RECORDS_PAGE_SIZE,
+            cursor=request.GET.get("cursor"),
+            fields=MEDICAL_RECORD_FIELDS,
+            **_parse_record_filters(request.GET),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return _medical_records_page_response(request, patient_id, page)
+
+async def login_view(request):
+    if request.method == "POST":
+        try:
+            user = await cosmos.verify_user(request.POST.get("email"), request.POST.get("password"))
+        except PasswordHasherBusy:
+            return _login_busy_response(request)
+
+        if user:
+            await _astart_session(request, user)
+            if "Patient" in user['roles']:
+                patient_id = await cosmos.get_patient_id_by_user_id(user['id'])
+                if patient_id:
+                    return redirect('patient_user_details', patient_id=patient_id)
+
+            return redirect('view_patients')
+
+        messages.error(request, "Invalid email or password.")
+
+    return render(request, 'patients/login.html')
@@ -1,7 +1,16 @@
+from asgiref.sync import iscoroutinefunction
 from django.shortcuts import redirect
 from functools import wraps
 
 def login_required(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            if not request.session.get('user_id'):
+                return redirect('login')
+            return await view_func(request, *args, **kwargs)
+        return _wrapped_async_view
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
         if not request.session.get('user_id'):
@@ -12,9 +21,19 @@ def login_required(view_func):
 def role_required(allowed_roles):
     """
     Decorator to restrict access to views based on user roles.
+    Works with both sync and async views.
     :param allowed_roles: List of roles allowed to access the view.
     """
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_async_view(request, *args, **kwargs):
+                user_roles = request.session.get('user_roles', [])
+                if any(role in allowed_roles for role in user_roles):
+                    return await view_func(request, *args, **kwargs)
+                return redirect('access_denied')
+            return _wrapped_async_view
+
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
             user_roles = request.session.get('user_roles', []) 
@@ -22,4 +41,4 @@ def role_required(allowed_roles):
                 return view_func(request, *args, **kwargs)
             return redirect('access_denied') 
         return _wrapped_view
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from services import cosmosdb_helper
+
+
+class Command(BaseCommand):
+    help = "Create the email and user ID lookup documents for existing users and patients."
+
+    def handle(self, *args, **options):
+        users = cosmosdb_helper.get_container(cosmosdb_helper.USERS_CONTAINER_NAME).query_items(
+            query="SELECT c.id, c.email FROM c",
+            enable_cross_partition_query=True
+        )
+        emails = 0
+        for user in users:
+            if user.get("email"):
+                cosmosdb_helper.save_email_lookup(user["email"], user["id"])
+                emails += 1
+
+        patients = cosmosdb_helper.get_container(cosmosdb_helper.PATIENTS_CONTAINER_NAME).query_items(
+            query="SELECT c.id, c.user_id FROM c",
+            enable_cross_partition_query=True
+        )
+        user_links = 0
+        for patient in patients:
+            if patient.get("user_id"):
+                cosmosdb_helper.save_user_lookup(patient["user_id"], patient["id"])
+                user_links += 1
+
+        self.stdout.write(f"Wrote {emails} email lookups and {user_links} user lookups.")
@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from services import cosmosdb_helper
+from services.patient_fields import at_risk_flags, patient_derived_fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Add or refresh the fields derived from each patient (name_lower, birth_year) and the at_risk flags "
+        "derived from their health notifications. Run it once for existing patients."
+    )
+
+    def handle(self, *args, **options):
+        notifications = cosmosdb_helper.get_container(cosmosdb_helper.HEALTH_NOTIFICATIONS_CONTAINER_NAME).query_items(
+            query="SELECT c.patient_id, c.disease FROM c",
+            enable_cross_partition_query=True
+        )
+        # Notifications store the user's ID in patient_id
+        diseases = defaultdict(set)
+        for notification in notifications:
+            if notification.get("patient_id") and notification.get("disease"):
+                diseases[notification["patient_id"]].add(notification["disease"])
+
+        patients = cosmosdb_helper.get_container(cosmosdb_helper.PATIENTS_CONTAINER_NAME).query_items(
+            query="SELECT c.id, c.user_id, c.name, c.date_of_birth, c.name_lower, c.birth_year, c.at_risk FROM c",
+            enable_cross_partition_query=True
+        )
+        checked = updated = 0
+        for patient in patients:
+            checked += 1
+            expected = {
+                **patient_derived_fields(patient.get("name"), patient.get("date_of_birth")),
+                # Keep flags set by the risk worker since the notifications were read
+                "at_risk": {**(patient.get("at_risk") or {}), **at_risk_flags(sorted(diseases.get(patient.get("user_id"), ())))},
+            }
+            fields = {name: value for name, value in expected.items() if patient.get(name) != value}
+            if fields and cosmosdb_helper.patch_patient_fields(patient["id"], fields):
+                updated += 1
+
+        self.stdout.write(f"Checked {checked} patients and updated {updated}.")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from patients.outbox import MAX_ATTEMPTS, drain
+
+
+class Command(BaseCommand):
+    help = "Send queued medical records from the local outbox to the blockchain API."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain everything that is due and exit.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to wait when the outbox is empty.")
+        parser.add_argument("--batch-size", type=int, default=50, help="Records sent per batch.")
+        parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="Attempts before a record is marked failed.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain(batch_size=options["batch_size"], max_attempts=options["max_attempts"])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} medical records, {failed} failed.")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
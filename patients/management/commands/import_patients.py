@@ -0,0 +1,60 @@
+import csv
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from patients.patient_import import import_name, import_patients, iter_patient_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Create patient accounts from a CSV (with a header row) or NDJSON file with name, email, password, "
+        "date_of_birth, sex and optionally ever_married. Running it again for a file with the same content "
+        "resumes after the last finished chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or NDJSON file to import.")
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first row.")
+        parser.add_argument("--chunk-size", type=int, default=settings.PATIENT_IMPORT_CHUNK_SIZE, help="Rows per checkpointed chunk.")
+        parser.add_argument("--write-workers", type=int, default=settings.PATIENT_IMPORT_WRITE_WORKERS, help="Concurrent Cosmos DB writers.")
+        parser.add_argument("--errors", help="Write failed rows to this CSV file.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        errors_file = open(options["errors"], "w", newline="") if options["errors"] else None
+        errors = csv.writer(errors_file) if errors_file else None
+        if errors:
+            errors.writerow(["row", "email", "error"])
+
+        def on_failure(row_number, email, error):
+            if errors:
+                errors.writerow([row_number, email, error])
+            else:
+                self.stderr.write(f"Row {row_number} ({email or 'no email'}): {error}")
+
+        with open(path, "rb") as content:
+            name = import_name(iter(lambda: content.read(1 << 20), b""))
+
+        started = time.perf_counter()
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as lines:
+                summary = import_patients(
+                    iter_patient_rows(lines, path),
+                    name,
+                    chunk_size=options["chunk_size"],
+                    write_workers=options["write_workers"],
+                    restart=options["restart"],
+                    on_failure=on_failure,
+                )
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        elapsed = time.perf_counter() - started
+        rate = summary["created"] / elapsed * 60 if elapsed else 0
+        self.stdout.write(
+            f"Created {summary['created']} patients, {summary['failed']} failed, "
+            f"{summary['skipped']} already imported, in {elapsed:.1f}s ({rate:.0f} patients/minute)."
+        )
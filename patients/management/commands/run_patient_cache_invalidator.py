@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from patients.patient_cache_feed import PatientCacheInvalidator
+
+
+class Command(BaseCommand):
+    help = (
+        "Follow the change feeds of the patients, users, medical_records and health_notifications "
+        "containers and drop changed patients from the shared patient details cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=settings.PATIENT_CACHE_FEED_INTERVAL or 5.0,
+            help="Seconds to wait between polls.",
+        )
+        parser.add_argument("--batch-size", type=int, default=100, help="Changed documents per change feed page.")
+
+    def handle(self, *args, **options):
+        # Changes made before the worker starts are covered by the cache TTL
+        self.stdout.write("Following change feeds for the patient details cache.")
+        PatientCacheInvalidator().run(options["interval"], max_item_count=options["batch_size"])
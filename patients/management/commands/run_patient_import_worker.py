@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from patients.patient_import import requeue_interrupted, run_next_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the patient files uploaded at /patients/bulk/, one at a time. Run a single worker: uploads "
+        "it finds running when it starts are taken as interrupted and resumed from their checkpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Import everything that is queued and exit.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to wait when nothing is queued.")
+        parser.add_argument("--chunk-size", type=int, default=settings.PATIENT_IMPORT_CHUNK_SIZE, help="Rows per checkpointed chunk.")
+        parser.add_argument("--write-workers", type=int, default=settings.PATIENT_IMPORT_WRITE_WORKERS, help="Concurrent Cosmos DB writers.")
+
+    def handle(self, *args, **options):
+        requeued = requeue_interrupted()
+        if requeued:
+            self.stdout.write(f"Resuming {requeued} interrupted imports.")
+        while True:
+            checkpoint = run_next_upload(chunk_size=options["chunk_size"], write_workers=options["write_workers"])
+            if checkpoint is not None:
+                self.stdout.write(
+                    f"Import of {checkpoint.filename} {checkpoint.get_status_display().lower()}: "
+                    f"{checkpoint.created} created, {checkpoint.failed} failed."
+                )
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from patients import risk_cube_feed
+from patients.risk_summary import run_once
+
+
+class Command(BaseCommand):
+    help = (
+        "Follow the change feeds of the patients and health_notifications containers, flag notified "
+        "patients as at risk, and keep the materialized age/risk summary and risk cube documents up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process pending changes and exit.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to wait between polls.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Changed documents per change feed page.")
+
+    def handle(self, *args, **options):
+        while True:
+            changed = run_once(max_item_count=options["batch_size"])
+            cube_changed = risk_cube_feed.run_once(max_item_count=options["batch_size"])
+            self.stdout.write(f"Applied {changed} changes to the age/risk summary and {cube_changed} to the risk cube.")
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
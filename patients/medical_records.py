@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+# Fields submitted to the blockchain for each medical record type
+RECORD_TYPE_FIELDS = {
+    "PhysicalExam": ["work_type", "residency_type", "height", "weight", "smoking_status"],
+    "BloodPressure": ["systolic_pressure", "diastolic_pressure"],
+    "BloodWork": ["glucose_level"],
+    "DiseaseHistory": ["disease_type"],
+}
+
+def record_data(source, record_type):
+    """
+    Pick the fields of ``record_type`` out of a form, CSV row or JSON object.
+
+    :param source: Any mapping with a ``get`` method, e.g. ``request.POST``.
+    :return: A dict of field name to submitted value.
+    """
+    return {field: source.get(field) for field in RECORD_TYPE_FIELDS.get(record_type, [])}
+
+def _text(value):
+    """Strip a submitted value, coercing JSON numbers and the like to strings."""
+    return "" if value is None else str(value).strip()
+
+def validate_record_row(row):
+    """
+    Check one bulk row and extract its record.
+
+    :return: A tuple of (patient_id, record_type, data, error); ``error`` is None when the row is valid.
+    """
+    patient_id = _text(row.get("patient_id"))
+    record_type = _text(row.get("record_type"))
+
+    if not patient_id:
+        return patient_id, record_type, {}, "Missing patient_id."
+    if record_type not in RECORD_TYPE_FIELDS:
+        return patient_id, record_type, {}, f"Unknown record_type '{record_type}'."
+
+    data = record_data(row, record_type)
+    missing = [field for field, value in data.items() if value is None or str(value).strip() == ""]
+    if missing:
+        return patient_id, record_type, data, f"Missing {', '.join(missing)}."
+
+    return patient_id, record_type, data, None
+
+def parse_bulk_records(content, filename=""):
+    """
+    Parse uploaded or pasted bulk records.
+
+    JSON must be a list of objects; anything else is read as CSV with a header row.
+    Every row needs ``patient_id`` and ``record_type`` plus the fields of its type.
+
+    :raises ValueError: If the content can't be parsed.
+    :return: A list of row dicts.
+    """
+    text = content.strip()
+    if filename.lower().endswith(".json") or text.startswith("["):
+        try:
+            rows = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON must be a list of objects.")
+        return rows
+
+    return list(csv.DictReader(io.StringIO(text)))
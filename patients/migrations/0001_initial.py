@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BirthYearRiskCounter',
+            fields=[
+                ('birth_year', models.IntegerField(primary_key=True, serialize=False)),
+                ('total', models.IntegerField(default=0)),
+                ('at_risk', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeFeedCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('continuation', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PatientRiskState',
+            fields=[
+                ('user_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('patient_id', models.CharField(blank=True, default='', max_length=64)),
+                ('birth_year', models.IntegerField(null=True)),
+                ('at_risk', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0002_outboxrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientImportCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
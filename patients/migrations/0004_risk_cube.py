@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_patientimportcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientCubeState',
+            fields=[
+                ('patient_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('birth_year', models.IntegerField(null=True)),
+                ('sex', models.CharField(blank=True, default='', max_length=16)),
+                ('ever_married', models.BooleanField(default=False)),
+                ('diseases', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RiskCubeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('birth_year', models.IntegerField()),
+                ('sex', models.CharField(blank=True, default='', max_length=16)),
+                ('ever_married', models.BooleanField(default=False)),
+                ('disease', models.CharField(blank=True, default='', max_length=100)),
+                ('patients', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('birth_year', 'sex', 'ever_married', 'disease'), name='unique_risk_cube_cell')],
+            },
+        ),
+    ]
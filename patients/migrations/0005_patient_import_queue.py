@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_risk_cube'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientimportcheckpoint',
+            name='failures',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='patientimportcheckpoint',
+            name='filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='patientimportcheckpoint',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='patientimportcheckpoint',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='patientimportcheckpoint',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=10),
+        ),
+    ]
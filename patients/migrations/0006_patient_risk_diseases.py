@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+def flag_counted_risk(apps, schema_editor):
+    # Users already counted as at risk were notified of the risk disease
+    PatientRiskState = apps.get_model("patients", "PatientRiskState")
+    PatientRiskState.objects.filter(at_risk=True).update(diseases=["Stroke"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patient_import_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientriskstate',
+            name='diseases',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(flag_counted_risk, migrations.RunPython.noop),
+    ]
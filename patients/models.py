@@ -1,3 +1,87 @@
 from django.db import models
 
-# Create your models here.
+class ChangeFeedCheckpoint(models.Model):
+    """Last processed change feed continuation for one partition key range of a Cosmos container."""
+    name = models.CharField(max_length=200, primary_key=True)
+    continuation = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+class PatientRiskState(models.Model):
+    """What the risk summary worker has counted for one user, so repeated changes only apply deltas."""
+    user_id = models.CharField(max_length=64, primary_key=True)
+    patient_id = models.CharField(max_length=64, blank=True, default="")
+    birth_year = models.IntegerField(null=True)
+    at_risk = models.BooleanField(default=False)
+    # Every disease the user was notified of, flagged again if a patient write drops its flag
+    diseases = models.JSONField(default=list)
+
+class BirthYearRiskCounter(models.Model):
+    """Running patient and at-risk totals per birth year."""
+    birth_year = models.IntegerField(primary_key=True)
+    total = models.IntegerField(default=0)
+    at_risk = models.IntegerField(default=0)
+
+class PatientCubeState(models.Model):
+    """The risk cube cells one patient currently counts in, so repeated changes only apply deltas."""
+    patient_id = models.CharField(max_length=64, primary_key=True)
+    birth_year = models.IntegerField(null=True)
+    sex = models.CharField(max_length=16, blank=True, default="")
+    ever_married = models.BooleanField(default=False)
+    diseases = models.JSONField(default=list)
+
+class RiskCubeCounter(models.Model):
+    """Patients in one risk cube cell; the cells with an empty disease count every patient."""
+    birth_year = models.IntegerField()
+    sex = models.CharField(max_length=16, blank=True, default="")
+    ever_married = models.BooleanField(default=False)
+    disease = models.CharField(max_length=100, blank=True, default="")
+    patients = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["birth_year", "sex", "ever_married", "disease"], name="unique_risk_cube_cell")
+        ]
+
+class OutboxRecord(models.Model):
+    """A medical record waiting to be written to the blockchain API by the outbox worker."""
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    idempotency_key = models.UUIDField(unique=True)
+    patient_id = models.CharField(max_length=64, db_index=True)
+    record_type = models.CharField(max_length=50)
+    data = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+class PatientImportCheckpoint(models.Model):
+    """
+    How far a bulk patient import got, so running it again resumes after the
+    last finished chunk. Uploaded files wait at ``path`` for the import worker.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    name = models.CharField(max_length=255, primary_key=True)
+    filename = models.CharField(max_length=255, blank=True, default="")
+    path = models.CharField(max_length=500, blank=True, default="")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DONE)
+    rows_done = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    # The first failed rows, as {"row", "email", "error"} dicts
+    failures = models.JSONField(default=list)
+    last_error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
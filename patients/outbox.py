@@ -0,0 +1,132 @@
+import logging
+import random
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from patients.models import OutboxRecord
+from services import patient_cache
+from services.blockchain import create_medical_records
+
+logger = logging.getLogger(__name__)
+
+# Retry delays grow as BASE * 2 ** attempts (with jitter) up to MAX
+RETRY_BASE_DELAY = timedelta(seconds=5)
+RETRY_MAX_DELAY = timedelta(minutes=30)
+MAX_ATTEMPTS = 10
+
+def enqueue_medical_record(patient_id, record_type, data):
+    """
+    Durably queue a medical record for the blockchain API.
+
+    :return: The queued ``OutboxRecord``.
+    """
+    record = OutboxRecord.objects.create(
+        idempotency_key=uuid.uuid4(),
+        patient_id=patient_id,
+        record_type=record_type,
+        data=data,
+        next_attempt_at=timezone.now(),
+    )
+    logger.info(f"Queued {record_type} medical record {record.idempotency_key} for patient ID {patient_id}.")
+    return record
+
+def enqueue_medical_records(records):
+    """
+    Durably queue many medical records for the blockchain API in one transaction.
+
+    :param records: Iterable of (patient_id, record_type, data) tuples.
+    :return: The queued ``OutboxRecord`` objects, in the order of ``records``.
+    """
+    now = timezone.now()
+    queued = OutboxRecord.objects.bulk_create([
+        OutboxRecord(
+            idempotency_key=uuid.uuid4(),
+            patient_id=patient_id,
+            record_type=record_type,
+            data=data,
+            next_attempt_at=now,
+        )
+        for patient_id, record_type, data in records
+    ])
+    logger.info(f"Queued {len(queued)} medical records.")
+    return queued
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE_DELAY * (2 ** (attempts - 1)), RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+def drain(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """
+    Send one batch of due outbox records to the blockchain API.
+
+    Records keep their idempotency key across retries, so a write that reached the
+    API but whose response was lost is not recorded twice.
+
+    :return: A tuple of (sent, failed) counts for the batch.
+    """
+    now = timezone.now()
+    batch = list(
+        OutboxRecord.objects
+        .filter(status=OutboxRecord.PENDING, next_attempt_at__lte=now)
+        .order_by("next_attempt_at", "id")[:batch_size]
+    )
+    if not batch:
+        return 0, 0
+
+    results = create_medical_records(
+        (record.patient_id, record.record_type, record.data, record.idempotency_key) for record in batch
+    )
+
+    sent = failed = 0
+    with transaction.atomic():
+        for record, created in zip(batch, results):
+            record.attempts += 1
+            if created:
+                record.status = OutboxRecord.SENT
+                record.sent_at = timezone.now()
+                record.last_error = ""
+                sent += 1
+            else:
+                failed += 1
+                record.last_error = "Blockchain API did not accept the record."
+                if record.attempts >= max_attempts:
+                    record.status = OutboxRecord.FAILED
+                    logger.error(f"Giving up on medical record {record.idempotency_key} after {record.attempts} attempts.")
+                else:
+                    record.next_attempt_at = timezone.now() + retry_delay(record.attempts)
+            record.save(update_fields=["attempts", "status", "sent_at", "last_error", "next_attempt_at"])
+
+    # The patient details page shows the new records on its next load
+    for patient_id in {record.patient_id for record in batch if record.status == OutboxRecord.SENT}:
+        patient_cache.invalidate(patient_id)
+
+    logger.info(f"Outbox batch finished: {sent} sent, {failed} failed.")
+    return sent, failed
+
+def unsent_records(patient_id):
+    """
+    List the patient's records that haven't reached the blockchain yet.
+
+    :return: A list of dicts, oldest first.
+    """
+    records = (
+        OutboxRecord.objects
+        .filter(patient_id=patient_id)
+        .exclude(status=OutboxRecord.SENT)
+        .order_by("created_at")
+    )
+    return [
+        {
+            "id": str(record.idempotency_key),
+            "type": record.record_type,
+            "status": record.status,
+            "attempts": record.attempts,
+            "created_date_utc": record.created_at.isoformat(),
+            "next_attempt_at": record.next_attempt_at.isoformat() if record.status == OutboxRecord.PENDING else None,
+            **record.data,
+        }
+        for record in records
+    ]
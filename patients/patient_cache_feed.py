@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from services import patient_cache
+from services.cosmosdb_helper import (
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME,
+    MEDICAL_RECORDS_CONTAINER_NAME,
+    PATIENTS_CONTAINER_NAME,
+    USERS_CONTAINER_NAME,
+    get_change_feed_range_ids,
+    get_patient_id_by_user_id,
+    read_change_feed,
+)
+
+logger = logging.getLogger(__name__)
+
+def _patient_for_user(user_id):
+    return get_patient_id_by_user_id(user_id) if user_id else None
+
+# How to find the cached patient a changed document belongs to
+PATIENT_ID_RESOLVERS = {
+    PATIENTS_CONTAINER_NAME: lambda document: document.get("id"),
+    MEDICAL_RECORDS_CONTAINER_NAME: lambda document: document.get("patient_id"),
+    # Health notifications store the user's ID in patient_id
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME: lambda document: _patient_for_user(document.get("patient_id")),
+    USERS_CONTAINER_NAME: lambda document: _patient_for_user(document.get("id")),
+}
+
+class PatientCacheInvalidator:
+    """
+    Follows the change feeds of every container that feeds the patient details
+    page and drops the cached details of each patient whose documents change.
+
+    Continuations are kept in memory and reading starts at ``start_time``: the
+    cache only needs to hear about changes made while its entries may be alive.
+    """
+
+    def __init__(self, start_time=None):
+        self.start_time = start_time or datetime.now(timezone.utc)
+        self.continuations = {}
+        self._range_ids = {}
+
+    def poll(self, max_item_count=100):
+        """
+        Read every pending change once.
+
+        :return: Number of changed documents that invalidated a cached patient.
+        """
+        invalidated = 0
+        for container_name, resolve in PATIENT_ID_RESOLVERS.items():
+            if container_name not in self._range_ids:
+                self._range_ids[container_name] = get_change_feed_range_ids(container_name)
+            for range_id in self._range_ids[container_name]:
+                key = (container_name, range_id)
+                pages = read_change_feed(
+                    container_name, range_id, self.continuations.get(key), max_item_count, start_time=self.start_time
+                )
+                for documents, continuation in pages:
+                    for document in documents:
+                        patient_id = resolve(document)
+                        if patient_id:
+                            patient_cache.invalidate(patient_id)
+                            invalidated += 1
+                    if continuation:
+                        self.continuations[key] = continuation
+        return invalidated
+
+    def run(self, interval, max_item_count=100, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                invalidated = self.poll(max_item_count)
+                if invalidated:
+                    logger.info(f"Invalidated cached details for {invalidated} changed documents.")
+            except Exception as e:
+                # Partition key ranges may have split; list them again on the next poll
+                self._range_ids.clear()
+                logger.error(f"Error following change feeds for the patient details cache: {e}")
+            stop_event.wait(interval)
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+def start_listener():
+    """
+    Start following the change feeds in a background thread of this process, once.
+
+    Only used with the per-process cache; with a shared cache a single
+    ``run_patient_cache_invalidator`` worker serves every process.
+    """
+    global _listener_pid
+    if settings.PATIENT_CACHE != "local" or not settings.PATIENT_CACHE_TTL or not settings.PATIENT_CACHE_FEED_INTERVAL:
+        return
+    # Checked against the PID so each forked worker starts its own thread
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        thread = threading.Thread(
+            target=PatientCacheInvalidator().run,
+            args=(settings.PATIENT_CACHE_FEED_INTERVAL,),
+            name="patient-cache-feed",
+            daemon=True,
+        )
+        thread.start()
+        _listener_pid = os.getpid()
+        logger.info("Started change feed listener for the patient details cache.")
@@ -0,0 +1,326 @@
+"""
+Streaming bulk import of patient accounts from CSV or NDJSON.
+
+Rows are read and written a chunk at a time, so a file of any size is never
+held in memory. Each chunk's passwords are hashed in parallel by the import's
+own process pool, and its users and patients are written by a bounded pool of
+threads as soon as their hashes are ready. After every chunk the number of
+rows done is saved in ``PatientImportCheckpoint``, so running the same import
+again resumes after the last finished chunk. Imports are named after the
+SHA-256 of the file, so only the same content resumes a checkpoint. User and
+patient IDs are derived from that name and the row number, which makes rows
+of an interrupted chunk safe to write again, while the IDs of a different file
+never collide with them.
+
+Uploads from the web page are stored under ``PATIENT_IMPORT_DIR`` and queued;
+the import worker (``manage.py run_patient_import_worker``) runs them one at a
+time, and the page shows their progress from the checkpoint.
+"""
+
+import csv
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from patients.models import PatientImportCheckpoint
+from services.cosmosdb_helper import new_user_and_patient, save_user_and_patient
+from services.passwords import PasswordHasher
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ("name", "email", "password", "date_of_birth", "sex")
+SEXES = ("Male", "Female")
+TRUE_VALUES = ("1", "true", "yes", "y", "on")
+# Namespace for the user and patient IDs of imported accounts
+IMPORT_NAMESPACE = uuid.UUID("8f0c6f2e-4d1b-4c55-9a8e-3f6d2b7c1e90")
+# Failed rows kept on the checkpoint for the upload page
+MAX_REPORTED_FAILURES = 500
+
+# Separate from the login pool, so an import doesn't turn logins away
+_hasher = PasswordHasher(workers=settings.PATIENT_IMPORT_HASH_WORKERS, max_pending=settings.PATIENT_IMPORT_HASH_WORKERS * 2)
+
+def iter_patient_rows(lines, filename=""):
+    """
+    Read patient rows from an iterable of text lines without loading them all.
+
+    NDJSON (one JSON object per line) is recognised by a ``.ndjson`` or
+    ``.jsonl`` file name or a first line starting with ``{``; anything else is
+    read as CSV with a header row.
+
+    :return: A generator of (row_number, row, error) tuples numbered from 1;
+        ``row`` is None when the line couldn't be parsed.
+    """
+    lines = iter(lines)
+    first = next(lines, "")
+    lines = itertools.chain([first], lines)
+
+    if filename.lower().endswith((".ndjson", ".jsonl")) or first.lstrip("\ufeff \t").startswith("{"):
+        row_number = 0
+        for line in lines:
+            line = line.strip().lstrip("\ufeff")
+            if not line:
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(row, dict):
+                yield row_number, row, None
+            else:
+                yield row_number, None, "Each line must be a JSON object."
+        return
+
+    for row_number, row in enumerate(csv.DictReader(line.lstrip("\ufeff") for line in lines), start=1):
+        yield row_number, row, None
+
+def validate_patient_row(row):
+    """
+    Check one import row and normalise its fields.
+
+    :return: A tuple of (fields, error); ``error`` is None when the row is valid.
+    """
+    fields = {field: str(row.get(field) or "").strip() for field in REQUIRED_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not fields[field]]
+    if missing:
+        return fields, f"Missing {', '.join(missing)}."
+    if "@" not in fields["email"]:
+        return fields, f"Invalid email '{fields['email']}'."
+    try:
+        fields["date_of_birth"] = datetime.date.fromisoformat(fields["date_of_birth"][:10]).isoformat()
+    except ValueError:
+        return fields, f"Invalid date_of_birth '{fields['date_of_birth']}'."
+    fields["sex"] = fields["sex"].capitalize()
+    if fields["sex"] not in SEXES:
+        return fields, f"Unknown sex '{fields['sex']}'."
+    fields["ever_married"] = str(row.get("ever_married") or "").strip().lower() in TRUE_VALUES
+    return fields, None
+
+def import_name(chunks):
+    """
+    Name an import after its file's content.
+
+    :param chunks: The file's content as an iterable of byte strings.
+    :return: ``sha256:`` followed by the hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+def _import_ids(name, row_number):
+    return (
+        str(uuid.uuid5(IMPORT_NAMESPACE, f"user:{name}:{row_number}")),
+        str(uuid.uuid5(IMPORT_NAMESPACE, f"patient:{name}:{row_number}")),
+    )
+
+def _save(name, row_number, fields, password_hash):
+    user_id, patient_id = _import_ids(name, row_number)
+    user, patient = new_user_and_patient(
+        fields["name"], fields["email"], password_hash, fields["date_of_birth"], fields["sex"],
+        fields["ever_married"], user_id=user_id, patient_id=patient_id,
+    )
+    return save_user_and_patient(user, patient)
+
+def import_patients(rows, name, chunk_size=None, write_workers=None, restart=False, on_failure=None):
+    """
+    Create a patient account for every valid row, resuming the import called ``name``.
+
+    :param rows: Rows from ``iter_patient_rows``.
+    :param name: Identifies the import for its checkpoint and IDs, from ``import_name``.
+    :param restart: Start from the first row instead of the checkpoint.
+    :param on_failure: Called with (row_number, email, error) for every row that wasn't imported.
+    :return: A dict with the ``created``, ``failed`` and ``skipped`` (done by an earlier run) row counts.
+    """
+    chunk_size = chunk_size or settings.PATIENT_IMPORT_CHUNK_SIZE
+    checkpoint, _ = PatientImportCheckpoint.objects.get_or_create(name=name)
+    if restart:
+        _reset(checkpoint)
+    checkpoint.status = PatientImportCheckpoint.RUNNING
+    checkpoint.last_error = ""
+    checkpoint.save()
+
+    summary = {"created": 0, "failed": 0, "skipped": 0}
+
+    def fail(row_number, email, error):
+        summary["failed"] += 1
+        if len(checkpoint.failures) < MAX_REPORTED_FAILURES:
+            checkpoint.failures.append({"row": row_number, "email": email, "error": error})
+        if on_failure:
+            on_failure(row_number, email, error)
+
+    try:
+        _import_chunks(rows, name, checkpoint, summary, fail, chunk_size, write_workers)
+    except Exception as e:
+        checkpoint.status = PatientImportCheckpoint.FAILED
+        checkpoint.last_error = str(e)
+        checkpoint.save()
+        raise
+    checkpoint.status = PatientImportCheckpoint.DONE
+    checkpoint.save()
+    return summary
+
+def _reset(checkpoint):
+    checkpoint.rows_done = checkpoint.created = checkpoint.failed = 0
+    checkpoint.failures = []
+
+def _import_chunks(rows, name, checkpoint, summary, fail, chunk_size, write_workers):
+    """Import ``rows`` a chunk at a time, saving the checkpoint after every chunk."""
+    rows = iter(rows)
+    with ThreadPoolExecutor(max_workers=write_workers or settings.PATIENT_IMPORT_WRITE_WORKERS, thread_name_prefix="patient-import") as executor:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            created_before, failed_before = summary["created"], summary["failed"]
+
+            valid, emails = [], set()
+            for row_number, row, error in chunk:
+                if row_number <= checkpoint.rows_done:
+                    summary["skipped"] += 1
+                    continue
+                fields, error = validate_patient_row(row) if row is not None else ({}, error)
+                email = fields.get("email", "")
+                if not error and email.lower() in emails:
+                    error = f"Email {email} appears more than once."
+                if error:
+                    fail(row_number, email, error)
+                    continue
+                emails.add(email.lower())
+                valid.append((row_number, fields))
+
+            # Writes start as each hash completes, in row order
+            hashes = _hasher.hash_many(fields["password"] for _, fields in valid)
+            results = executor.map(
+                _save, itertools.repeat(name), (row_number for row_number, _ in valid), (fields for _, fields in valid), hashes
+            )
+            for (row_number, fields), error in zip(valid, results):
+                if error:
+                    fail(row_number, fields["email"], error)
+                else:
+                    summary["created"] += 1
+
+            checkpoint.rows_done = max(checkpoint.rows_done, chunk[-1][0])
+            checkpoint.created += summary["created"] - created_before
+            checkpoint.failed += summary["failed"] - failed_before
+            checkpoint.save()
+            logger.info(f"Patient import {name}: {checkpoint.rows_done} rows done, {summary['created']} created, {summary['failed']} failed.")
+
+def enqueue_upload(uploaded, restart=False):
+    """
+    Store an uploaded file and queue it for the import worker.
+
+    An upload whose content is already queued or running isn't queued again.
+
+    :param uploaded: A Django ``UploadedFile``.
+    :param restart: Start from the first row instead of the checkpoint.
+    :return: The import's ``PatientImportCheckpoint``.
+    """
+    name = import_name(uploaded.chunks())
+    checkpoint, _ = PatientImportCheckpoint.objects.get_or_create(name=name)
+    if checkpoint.path and checkpoint.status in (PatientImportCheckpoint.QUEUED, PatientImportCheckpoint.RUNNING):
+        return checkpoint
+
+    directory = Path(settings.PATIENT_IMPORT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name.split(':', 1)[1]}.upload"
+    # The file holds plaintext passwords until the worker deletes it
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as file:
+        for chunk in uploaded.chunks():
+            file.write(chunk)
+
+    if restart:
+        _reset(checkpoint)
+    checkpoint.filename = uploaded.name
+    checkpoint.path = str(path)
+    checkpoint.status = PatientImportCheckpoint.QUEUED
+    checkpoint.last_error = ""
+    checkpoint.save()
+    logger.info(f"Queued patient import {name} of {uploaded.name}.")
+    return checkpoint
+
+def _status(checkpoint):
+    return {
+        "name": checkpoint.name,
+        "filename": checkpoint.filename,
+        "status": checkpoint.status,
+        "finished": checkpoint.status in (PatientImportCheckpoint.DONE, PatientImportCheckpoint.FAILED),
+        "rows_done": checkpoint.rows_done,
+        "created": checkpoint.created,
+        "failed": checkpoint.failed,
+        "last_error": checkpoint.last_error,
+        "updated_at": checkpoint.updated_at.isoformat(),
+    }
+
+def import_status(name):
+    """
+    Report an import's progress from its checkpoint.
+
+    :return: A dict with its status, row counts and first ``failures``, or None if there is no such import.
+    """
+    checkpoint = PatientImportCheckpoint.objects.filter(name=name).first()
+    if checkpoint is None:
+        return None
+    return {**_status(checkpoint), "failures": checkpoint.failures}
+
+def recent_uploads(limit=10):
+    """Report the progress of the latest uploaded imports, newest first."""
+    checkpoints = PatientImportCheckpoint.objects.exclude(filename="").order_by("-updated_at")[:limit]
+    return [_status(checkpoint) for checkpoint in checkpoints]
+
+def requeue_interrupted():
+    """Queue again the uploads a stopped worker left running; they resume from their checkpoints."""
+    return (
+        PatientImportCheckpoint.objects
+        .filter(status=PatientImportCheckpoint.RUNNING)
+        .exclude(path="")
+        .update(status=PatientImportCheckpoint.QUEUED)
+    )
+
+def run_next_upload(chunk_size=None, write_workers=None):
+    """
+    Import the oldest queued upload and delete its stored file.
+
+    :return: The upload's ``PatientImportCheckpoint``, or None if nothing is queued.
+    """
+    checkpoint = (
+        PatientImportCheckpoint.objects
+        .filter(status=PatientImportCheckpoint.QUEUED)
+        .exclude(path="")
+        .order_by("updated_at")
+        .first()
+    )
+    if checkpoint is None:
+        return None
+
+    try:
+        with open(checkpoint.path, encoding="utf-8-sig", errors="replace", newline="") as lines:
+            import_patients(
+                iter_patient_rows(lines, checkpoint.filename), checkpoint.name,
+                chunk_size=chunk_size, write_workers=write_workers,
+            )
+    except Exception as e:
+        logger.error(f"Patient import {checkpoint.name} of {checkpoint.filename} failed: {e}")
+        checkpoint.refresh_from_db()
+        if checkpoint.status == PatientImportCheckpoint.QUEUED:
+            # The stored file couldn't be read, so the import never started
+            checkpoint.status = PatientImportCheckpoint.FAILED
+            checkpoint.last_error = str(e)
+    else:
+        checkpoint.refresh_from_db()
+    try:
+        os.remove(checkpoint.path)
+    except FileNotFoundError:
+        pass
+    checkpoint.path = ""
+    checkpoint.save()
+    return checkpoint
@@ -0,0 +1,93 @@
+import logging
+
+from django.db.models import F
+from django.utils import timezone
+
+from patients.models import PatientCubeState, RiskCubeCounter
+from patients.risk_summary import follow_change_feed
+from services.cosmosdb_helper import PATIENTS_CONTAINER_NAME, save_risk_cube
+from services.patient_fields import birth_year
+from services.risk_cube import CELL_COLUMNS, cube_cells
+
+logger = logging.getLogger(__name__)
+
+# The cube follows the patients change feed with its own checkpoints, so it
+# builds from the beginning of the feed even where the summary is up to date.
+CHECKPOINT_PREFIX = "risk_cube:"
+
+def _contribution(state):
+    """Return the (birth_year, sex, ever_married, diseases) a patient counts in, or None."""
+    if state.birth_year is None:
+        return None
+    return state.birth_year, state.sex, state.ever_married, tuple(state.diseases)
+
+def apply_patient_changes(patients):
+    """
+    Apply a page of created or updated patient documents to the cube counters.
+    Patients are counted under the diseases flagged in their ``at_risk`` map.
+    Replaying the same documents is a no-op.
+
+    :return: Number of documents that changed the counters.
+    """
+    states = PatientCubeState.objects.in_bulk([patient["id"] for patient in patients])
+    stored = set(states)
+    removed, added, changed = [], [], {}
+    for patient in patients:
+        state = states.get(patient["id"]) or PatientCubeState(patient_id=patient["id"])
+        before = _contribution(state)
+        state.birth_year = patient["birth_year"] if "birth_year" in patient else birth_year(patient.get("date_of_birth"))
+        state.sex = patient.get("sex") or ""
+        state.ever_married = bool(patient.get("ever_married"))
+        state.diseases = sorted(disease for disease, flagged in (patient.get("at_risk") or {}).items() if flagged)
+        after = _contribution(state)
+        states[patient["id"]] = state
+        if before == after:
+            continue
+        if before:
+            removed.append(before)
+        if after:
+            added.append(after)
+        changed[patient["id"]] = state
+
+    if not changed:
+        return 0
+    contributions = removed + added
+    deltas = cube_cells(*zip(*contributions), weights=[-1] * len(removed) + [1] * len(added))
+    for *cell, patients_delta in zip(*(deltas[name] for name in CELL_COLUMNS), deltas["patients"]):
+        cell = dict(zip(CELL_COLUMNS, cell))
+        RiskCubeCounter.objects.get_or_create(**cell)
+        RiskCubeCounter.objects.filter(**cell).update(patients=F("patients") + patients_delta)
+
+    PatientCubeState.objects.bulk_create([state for pk, state in changed.items() if pk not in stored])
+    PatientCubeState.objects.bulk_update(
+        [state for pk, state in changed.items() if pk in stored], ["birth_year", "sex", "ever_married", "diseases"]
+    )
+    return len(changed)
+
+def process_changes(max_item_count=100):
+    """
+    Drain the patients change feed into the cube counters.
+
+    :return: Number of documents that changed the counters.
+    """
+    return follow_change_feed(PATIENTS_CONTAINER_NAME, apply_patient_changes, CHECKPOINT_PREFIX, max_item_count)
+
+def publish_cube():
+    """Write the non-empty cube cells to the cube document read by the risk dashboard."""
+    counters = RiskCubeCounter.objects.filter(patients__gt=0).values_list(*CELL_COLUMNS, "patients")
+    columns = list(zip(*counters)) or [()] * (len(CELL_COLUMNS) + 1)
+    cube = {name: list(column) for name, column in zip((*CELL_COLUMNS, "patients"), columns)}
+    cube["updated_at"] = timezone.now().isoformat()
+    save_risk_cube(cube)
+    logger.info(f"Published risk cube with {len(cube['patients'])} cells")
+
+def run_once(max_item_count=100):
+    """
+    Process pending patient changes and republish the cube if anything moved.
+
+    :return: Number of documents that changed the counters.
+    """
+    changed = process_changes(max_item_count)
+    if changed:
+        publish_cube()
+    return changed
@@ -0,0 +1,163 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from patients.models import BirthYearRiskCounter, ChangeFeedCheckpoint, PatientRiskState
+from services.cosmosdb_helper import (
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME,
+    PATIENTS_CONTAINER_NAME,
+    RISK_DISEASE,
+    get_change_feed_range_ids,
+    read_change_feed,
+    save_age_risk_summary,
+    set_patient_at_risk,
+)
+from services.patient_fields import birth_year
+
+logger = logging.getLogger(__name__)
+
+def _contribution(state):
+    """Return the (birth_year, total, at_risk) a user currently adds to the counters, or None."""
+    if not state.patient_id or state.birth_year is None:
+        return None
+    return state.birth_year, 1, int(state.at_risk)
+
+def _update_state(state, deltas, **changes):
+    before = _contribution(state)
+    modified = any(getattr(state, field) != value for field, value in changes.items())
+    for field, value in changes.items():
+        setattr(state, field, value)
+    # Saved even when the counters don't move, e.g. a notification that arrives before its patient
+    if modified:
+        state.save()
+    after = _contribution(state)
+    if before == after:
+        return False
+
+    if before:
+        deltas[before[0]][0] -= before[1]
+        deltas[before[0]][1] -= before[2]
+    if after:
+        deltas[after[0]][0] += after[1]
+        deltas[after[0]][1] += after[2]
+    return True
+
+def apply_patient_change(patient, deltas):
+    """
+    Record a created or updated patient document. Replaying the same document is a no-op.
+
+    Flags missing from the patient are set again for every disease the user was
+    notified of: a notification may have arrived before its patient, or a
+    concurrent patient write may have dropped the flag.
+    """
+    user_id = patient.get("user_id")
+    if not user_id:
+        return False
+    state, _ = PatientRiskState.objects.get_or_create(user_id=user_id)
+    flags = patient.get("at_risk") or {}
+    for disease in state.diseases:
+        if not flags.get(disease):
+            set_patient_at_risk(user_id, disease)
+    year = patient["birth_year"] if "birth_year" in patient else birth_year(patient.get("date_of_birth"))
+    return _update_state(state, deltas, patient_id=patient["id"], birth_year=year)
+
+def apply_notification_change(notification, deltas):
+    """
+    Flag the notified patient as at risk of the notification's disease, and count
+    them as at risk in the summary if it is ``RISK_DISEASE``. Notifications store
+    the user's ID in ``patient_id``.
+    """
+    user_id = notification.get("patient_id")
+    disease = notification.get("disease")
+    if not user_id or not disease:
+        return False
+    set_patient_at_risk(user_id, disease)
+    state, _ = PatientRiskState.objects.get_or_create(user_id=user_id)
+    changes = {"diseases": state.diseases if disease in state.diseases else [*state.diseases, disease]}
+    if disease == RISK_DISEASE:
+        changes["at_risk"] = True
+    return _update_state(state, deltas, **changes)
+
+def _apply_deltas(deltas):
+    for birth_year, (total, at_risk) in deltas.items():
+        if not total and not at_risk:
+            continue
+        BirthYearRiskCounter.objects.get_or_create(birth_year=birth_year)
+        BirthYearRiskCounter.objects.filter(birth_year=birth_year).update(
+            total=F("total") + total, at_risk=F("at_risk") + at_risk
+        )
+
+CHANGE_HANDLERS = {
+    PATIENTS_CONTAINER_NAME: apply_patient_change,
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME: apply_notification_change,
+}
+
+def follow_change_feed(container_name, apply_page, checkpoint_prefix="", max_item_count=100):
+    """
+    Drain the change feed of one container, committing ``apply_page``'s writes and
+    the checkpoint together per page. Checkpoints are named
+    ``<checkpoint_prefix><container>:<range>``, so several consumers can follow one container.
+
+    :param apply_page: Called with each page's documents; returns how many changed something.
+    :return: Total returned by ``apply_page``.
+    """
+    changed = 0
+    for range_id in get_change_feed_range_ids(container_name):
+        checkpoint_name = f"{checkpoint_prefix}{container_name}:{range_id}"
+        checkpoint = ChangeFeedCheckpoint.objects.filter(name=checkpoint_name).first()
+        continuation = checkpoint.continuation if checkpoint else None
+
+        for documents, continuation in read_change_feed(container_name, range_id, continuation, max_item_count):
+            with transaction.atomic():
+                changed += apply_page(documents)
+                if continuation:
+                    ChangeFeedCheckpoint.objects.update_or_create(
+                        name=checkpoint_name, defaults={"continuation": continuation}
+                    )
+            if documents:
+                logger.info(f"Processed {len(documents)} changes from {checkpoint_name}")
+    return changed
+
+def process_container(container_name, max_item_count=100):
+    """
+    Drain the change feed of one container into the birth year counters.
+
+    :return: Number of documents that changed the counters.
+    """
+    handler = CHANGE_HANDLERS[container_name]
+
+    def apply_page(documents):
+        deltas = defaultdict(lambda: [0, 0])
+        changed = sum(handler(document, deltas) for document in documents)
+        _apply_deltas(deltas)
+        return changed
+
+    return follow_change_feed(container_name, apply_page, max_item_count=max_item_count)
+
+def publish_summary():
+    """Write the current counters to the summary document read by the age/risk report."""
+    birth_years = {
+        str(counter.birth_year): {"total": counter.total, "at_risk": counter.at_risk}
+        for counter in BirthYearRiskCounter.objects.all()
+        if counter.total
+    }
+    save_age_risk_summary({
+        "disease": RISK_DISEASE,
+        "birth_years": birth_years,
+        "updated_at": timezone.now().isoformat(),
+    })
+    logger.info(f"Published age/risk summary with {len(birth_years)} birth years")
+
+def run_once(max_item_count=100):
+    """
+    Process pending changes from both containers and republish the summary if anything moved.
+
+    :return: Number of documents that changed the counters.
+    """
+    changed = sum(process_container(name, max_item_count) for name in CHANGE_HANDLERS)
+    if changed:
+        publish_summary()
+    return changed
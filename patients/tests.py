@@ -1,3 +1,1033 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from azure.core.exceptions import ServiceRequestError
+from azure.cosmos import exceptions
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from benchmarks.stub_cosmos import AsyncStubContainer, StubCosmosClient
+from middleware.cached_cosmos_session import SessionStore as CachedSessionStore
+from middleware.cosmos_session import SessionStore as CosmosSessionStore
+from patients import async_views, outbox, patient_cache_feed, patient_import, risk_summary
+from patients.medical_records import parse_bulk_records, validate_record_row
+from patients.models import (
+    BirthYearRiskCounter, ChangeFeedCheckpoint, OutboxRecord, PatientCubeState, PatientImportCheckpoint, RiskCubeCounter,
+)
+from patients.risk_cube_feed import apply_patient_changes
+from patients.views import _parse_page_cursor, _patients_page_context, metrics_view
+from services import blockchain, cosmos_metrics, cosmosdb_helper, cosmosdb_helper_async
+from services.analytics import birth_year_risk_histogram, get_age_risk_histogram, summary_age_risk_histogram
+from services.cosmosdb_helper import (
+    birth_date_bounds, decode_record_cursor, email_lookup_id, encode_patient_search_cursor, encode_record_cursor,
+    get_age_risk_summary, get_patients_page_by_cursor, medical_records_page, medical_records_query, patient_search_page,
+    patient_search_query, save_age_risk_summary, session_item, user_lookup_id,
+)
+from services.passwords import PasswordHasher, pwd_context
+from services.risk_cube import ALL_PATIENTS, CELL_COLUMNS, cube_cells, rollup
+
+TODAY = date(2024, 6, 15)
+LABELS = ["0-18", "19-30", "31-40", "41-50", "51-60", "61+"]
+
+
+class StubCosmosMixin:
+    """Serve the sync and async data layers from fresh in-memory containers."""
+
+    def setUp(self):
+        super().setUp()
+        self.cosmos = StubCosmosClient()
+        for target, container in (
+            ("services.cosmosdb_helper.get_container", self.container),
+            ("services.cosmosdb_helper_async.get_container", lambda name: AsyncStubContainer(self.container(name))),
+        ):
+            patcher = mock.patch(target, side_effect=container)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def container(self, name):
+        return self.cosmos.get_database_client(None).get_container_client(name)
+
+    def seed(self, name, items):
+        return self.cosmos.seed(name, items)
+
+    def log_in(self, user_id="d1", roles=("Doctor",)):
+        """Start a session in the ``sessions`` container for the test client."""
+        session = self.client.session
+        session.update({"user_id": user_id, "user_roles": list(roles)})
+        session.save()
+
+
+class PatientPageTests(StubCosmosMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed("patients", [{"id": f"p{i:02}", "name": f"Patient {i}", "sex": "Female"} for i in range(25)])
+
+    def ids(self, patients):
+        return [patient["id"] for patient in patients]
+
+    def test_pages_forward_from_the_last_id(self):
+        patients, has_previous, has_more = get_patients_page_by_cursor(10)
+        self.assertEqual(self.ids(patients), [f"p{i:02}" for i in range(10)])
+        self.assertEqual((has_previous, has_more), (False, True))
+
+        patients, has_previous, has_more = get_patients_page_by_cursor(10, after_id="p19")
+        self.assertEqual(self.ids(patients), [f"p{i:02}" for i in range(20, 25)])
+        self.assertEqual((has_previous, has_more), (True, False))
+
+    def test_pages_backward_from_the_first_id(self):
+        patients, has_previous, has_more = get_patients_page_by_cursor(10, before_id="p12")
+        self.assertEqual(self.ids(patients), [f"p{i:02}" for i in range(2, 12)])
+        self.assertEqual((has_previous, has_more), (True, True))
+
+        patients, has_previous, has_more = get_patients_page_by_cursor(10, before_id="p05")
+        self.assertEqual(self.ids(patients), [f"p{i:02}" for i in range(5)])
+        self.assertEqual((has_previous, has_more), (False, True))
+
+    def test_only_requested_fields_are_fetched(self):
+        patients, _, _ = get_patients_page_by_cursor(2, fields=("name",))
+        self.assertEqual(patients, [{"id": "p00", "name": "Patient 0"}, {"id": "p01", "name": "Patient 1"}])
+
+    def test_page_links_use_the_page_edges(self):
+        context = _patients_page_context([{"id": "p03"}, {"id": "p04"}], True, True)
+        self.assertEqual((context["previous_cursor"], context["next_cursor"]), ("before:p03", "after:p04"))
+        self.assertEqual(_parse_page_cursor(context["next_cursor"]), ("after", "p04"))
+        for value in (None, "3", "after:", "sideways:p04"):
+            self.assertEqual(_parse_page_cursor(value), (None, None))
+
+
+class AgeRiskHistogramTests(StubCosmosMixin, SimpleTestCase):
+    BIRTH_YEARS = [2010, 2000, 1990, 1990, 1950, None]
+    AT_RISK = [False, True, True, False, True, True]
+
+    def test_patients_are_bucketed_by_age_this_year(self):
+        self.assertEqual(
+            birth_year_risk_histogram(self.BIRTH_YEARS, self.AT_RISK, today=TODAY),
+            (LABELS, [1, 1, 2, 0, 0, 1], [0, 1, 1, 0, 0, 1]),
+        )
+
+    def test_bucket_edges_are_inclusive_upper_ages(self):
+        labels, totals, _ = birth_year_risk_histogram([2006, 2005], [False, False], edges=[18], today=TODAY)
+        self.assertEqual((labels, totals), (["0-18", "19+"], [1, 1]))
+
+    def test_summary_gives_the_same_histogram_as_the_patients(self):
+        summary = {"birth_years": {"2010": {"total": 1, "at_risk": 0}, "2000": {"total": 1, "at_risk": 1},
+                                   "1990": {"total": 2, "at_risk": 1}, "1950": {"total": 1, "at_risk": 1}}}
+        self.assertEqual(
+            summary_age_risk_histogram(summary, today=TODAY),
+            birth_year_risk_histogram(self.BIRTH_YEARS[:-1], self.AT_RISK[:-1], today=TODAY),
+        )
+
+    def test_summary_is_preferred_over_scanning_patients(self):
+        self.seed("patients", [
+            {"id": "p1", "birth_year": 1990, "at_risk": {"Stroke": True}},
+            {"id": "p2", "birth_year": 1990, "at_risk": {"Diabetes": True}},
+        ])
+        _, totals, risk = get_age_risk_histogram()
+        self.assertEqual((sum(totals), sum(risk)), (2, 1))
+
+        save_age_risk_summary({"disease": "Stroke", "birth_years": {"1990": {"total": 7, "at_risk": 3}}})
+        _, totals, risk = get_age_risk_histogram()
+        self.assertEqual((sum(totals), sum(risk)), (7, 3))
+
+
+class RiskSummaryTests(StubCosmosMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed("patients", [{"id": "p1", "user_id": "u1", "at_risk": {}}, {"id": "p2", "user_id": "u2", "at_risk": {}}])
+        self.seed("lookups", [
+            {"id": user_lookup_id("u1"), "type": "user", "patient_id": "p1"},
+            {"id": user_lookup_id("u2"), "type": "user", "patient_id": "p2"},
+        ])
+        self.feeds = {"patients": [], "health_notifications": []}
+        for name, side_effect in (
+            ("get_change_feed_range_ids", lambda container_name: ["0"]),
+            ("read_change_feed", self.read_change_feed),
+        ):
+            patcher = mock.patch.object(risk_summary, name, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def read_change_feed(self, container_name, range_id, continuation=None, max_item_count=100):
+        """Serve each container's pages after the page whose position was saved as the continuation."""
+        pages = self.feeds[container_name]
+        for position in range(int(continuation or 0), len(pages)):
+            yield pages[position], str(position + 1)
+
+    def counters(self):
+        return {counter.birth_year: (counter.total, counter.at_risk) for counter in BirthYearRiskCounter.objects.all()}
+
+    def test_changes_are_counted_once(self):
+        self.feeds["patients"].append([
+            {"id": "p1", "user_id": "u1", "birth_year": 1990},
+            {"id": "p2", "user_id": "u2", "date_of_birth": "1950-03-04T00:00:00"},
+        ])
+        self.feeds["health_notifications"].append([
+            {"id": "n1", "patient_id": "u1", "disease": "Stroke"},
+            {"id": "n2", "patient_id": "u1", "disease": "Stroke"},
+            {"id": "n3", "patient_id": "u2", "disease": "Diabetes"},
+        ])
+        self.assertEqual(risk_summary.run_once(), 3)
+        self.assertEqual(self.counters(), {1990: (1, 1), 1950: (1, 0)})
+        self.assertEqual(get_age_risk_summary()["birth_years"], {"1990": {"total": 1, "at_risk": 1}, "1950": {"total": 1, "at_risk": 0}})
+        self.assertEqual(self.container("patients").items["p2"]["at_risk"], {"Diabetes": True})
+
+        # Nothing new since the checkpoints
+        self.assertEqual(risk_summary.run_once(), 0)
+        self.assertEqual(ChangeFeedCheckpoint.objects.get(name="patients:0").continuation, "1")
+
+        # Replaying the same documents from the beginning doesn't move the counters
+        ChangeFeedCheckpoint.objects.all().delete()
+        self.assertEqual(risk_summary.run_once(), 0)
+        self.assertEqual(self.counters(), {1990: (1, 1), 1950: (1, 0)})
+
+    def test_changed_birth_year_moves_the_patient(self):
+        self.feeds["patients"] += [[{"id": "p1", "user_id": "u1", "birth_year": 1990}]]
+        self.feeds["health_notifications"] += [[{"id": "n1", "patient_id": "u1", "disease": "Stroke"}]]
+        risk_summary.run_once()
+        self.feeds["patients"] += [[{"id": "p1", "user_id": "u1", "birth_year": 1991}]]
+        self.assertEqual(risk_summary.run_once(), 1)
+        self.assertEqual(self.counters(), {1990: (0, 0), 1991: (1, 1)})
+        self.assertEqual(get_age_risk_summary()["birth_years"], {"1991": {"total": 1, "at_risk": 1}})
+
+    def test_notification_before_its_patient(self):
+        self.feeds["health_notifications"] += [[{"id": "n1", "patient_id": "u1", "disease": "Stroke"}]]
+        self.container("patients").load([])
+        self.assertEqual(risk_summary.run_once(), 0)
+        self.assertEqual(self.counters(), {})
+
+        self.container("patients").put({"id": "p1", "user_id": "u1", "at_risk": {}})
+        self.feeds["patients"] += [[{"id": "p1", "user_id": "u1", "birth_year": 1990}]]
+        self.assertEqual(risk_summary.run_once(), 1)
+        self.assertEqual(self.counters(), {1990: (1, 1)})
+        self.assertEqual(self.container("patients").items["p1"]["at_risk"], {"Stroke": True})
+
+    def test_dropped_flags_are_set_again_for_every_notified_disease(self):
+        self.feeds["health_notifications"] += [[
+            {"id": "n1", "patient_id": "u1", "disease": "Stroke"},
+            {"id": "n2", "patient_id": "u1", "disease": "Diabetes"},
+        ]]
+        risk_summary.run_once()
+        # A write that replaced the patient without its flags
+        self.container("patients").put({"id": "p1", "user_id": "u1", "at_risk": {}})
+        self.feeds["patients"] += [[{"id": "p1", "user_id": "u1", "birth_year": 1990, "at_risk": {}}]]
+        risk_summary.run_once()
+        self.assertEqual(self.container("patients").items["p1"]["at_risk"], {"Stroke": True, "Diabetes": True})
+        self.assertEqual(self.counters(), {1990: (1, 1)})
+
+
+class BlockchainClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = blockchain.BlockchainClient("https://chain.test", "user", "secret")
+        self.logins = 0
+        self.rejected = set()
+        self.blocks = []
+        patcher = mock.patch.object(self.client.session, "post", side_effect=self.post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def response(self, status_code, body=None):
+        return mock.Mock(status_code=status_code, text="", json=mock.Mock(return_value=body or {}))
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        if url.endswith("/auth/login"):
+            self.logins += 1
+            return self.response(200, {"access_token": f"token-{self.logins}", "expires_in": 3600})
+        token = headers["Authorization"].removeprefix("Bearer ")
+        if token in self.rejected:
+            return self.response(401)
+        self.blocks.append((token, headers.get("Idempotency-Key"), json))
+        return self.response(200)
+
+    def test_token_is_reused_until_it_nearly_expires(self):
+        self.assertTrue(self.client.create_medical_record("p1", "BloodWork", glucose_level="90"))
+        self.assertTrue(self.client.create_medical_record("p1", "BloodWork", glucose_level="95"))
+        self.assertEqual(self.logins, 1)
+
+        with mock.patch.object(blockchain.time, "time", return_value=time.time() + 3600 - blockchain.TOKEN_EXPIRY_MARGIN):
+            self.assertEqual(self.client.get_access_token(), "token-2")
+
+    def test_rejected_token_is_refreshed_and_the_write_retried(self):
+        self.client.get_access_token()
+        self.rejected.add("token-1")
+        self.assertTrue(self.client.create_medical_record("p1", "BloodWork", idempotency_key="key-1", glucose_level="90"))
+        self.assertEqual(self.logins, 2)
+        self.assertEqual(self.blocks, [("token-2", "key-1", {"patient_id": "p1", "type": "BloodWork", "glucose_level": "90"})])
+
+    def test_write_fails_when_the_new_token_is_rejected_too(self):
+        self.client.get_access_token()
+        self.rejected.update({"token-1", "token-2"})
+        self.assertFalse(self.client.create_medical_record("p1", "BloodWork", glucose_level="90"))
+        self.assertEqual(self.blocks, [])
+
+    def test_expiry_is_read_from_the_token_when_the_login_response_has_none(self):
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": 1700000000}).encode()).decode().rstrip("=")
+        self.assertEqual(blockchain._jwt_expiry(f"header.{payload}.signature"), 1700000000.0)
+        self.assertIsNone(blockchain._jwt_expiry("opaque-token"))
+
+
+class BulkMedicalRecordParsingTests(SimpleTestCase):
+    def test_csv_and_json_rows(self):
+        csv_rows = parse_bulk_records("patient_id,record_type,glucose_level\np1,BloodWork,90\n")
+        json_rows = parse_bulk_records('[{"patient_id": "p1", "record_type": "BloodWork", "glucose_level": "90"}]')
+        self.assertEqual(csv_rows, json_rows)
+        self.assertEqual(parse_bulk_records("[]", "records.json"), [])
+
+    def test_invalid_json(self):
+        for content, message in (('{"a": 1}', "JSON must be a list of objects."), ('[{"a": 1', "Invalid JSON")):
+            with self.assertRaisesMessage(ValueError, message):
+                parse_bulk_records(content, "records.json")
+
+    def test_validate_record_row(self):
+        self.assertEqual(
+            validate_record_row({"patient_id": " p1 ", "record_type": "BloodWork", "glucose_level": 90}),
+            ("p1", "BloodWork", {"glucose_level": 90}, None),
+        )
+        self.assertEqual(validate_record_row({"patient_id": 7, "record_type": None})[3], "Unknown record_type ''.")
+        self.assertEqual(validate_record_row({"record_type": "BloodWork"})[3], "Missing patient_id.")
+        self.assertEqual(
+            validate_record_row({"patient_id": "p1", "record_type": "BloodPressure", "systolic_pressure": "120", "diastolic_pressure": " "})[3],
+            "Missing diastolic_pressure.",
+        )
+
+
+class BulkMedicalRecordViewTests(StubCosmosMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.log_in()
+
+    def queued(self):
+        return list(OutboxRecord.objects.order_by("id").values_list("patient_id", "record_type", "data", "status"))
+
+    def post(self, data, **extra):
+        return self.client.post(f"{reverse('bulk_medical_records')}?format=json", data, **extra)
+
+    def test_valid_rows_are_queued_in_the_outbox(self):
+        upload = SimpleUploadedFile(
+            "records.csv",
+            b"\xef\xbb\xbfpatient_id,record_type,glucose_level\np1,BloodWork,90\n,BloodWork,91\np2,Unknown,\np3,BloodWork,95\n",
+        )
+        with mock.patch.object(outbox, "create_medical_records") as create_medical_records:
+            response = self.post({"records_file": upload})
+        create_medical_records.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["summary"], {"queued": 2, "invalid": 2})
+        self.assertEqual(
+            [(row["row"], row["status"], row["error"]) for row in body["rows"]],
+            [(1, "queued", None), (2, "invalid", "Missing patient_id."), (3, "invalid", "Unknown record_type 'Unknown'."),
+             (4, "queued", None)],
+        )
+        self.assertEqual(self.queued(), [
+            ("p1", "BloodWork", {"glucose_level": "90"}, OutboxRecord.PENDING),
+            ("p3", "BloodWork", {"glucose_level": "95"}, OutboxRecord.PENDING),
+        ])
+
+    def test_unparseable_content_is_rejected(self):
+        response = self.post({"records_text": "[1, 2]"})
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, "JSON must be a list of objects.", status_code=400)
+        self.assertEqual(self.queued(), [])
+
+    @override_settings(BULK_RECORDS_MAX_ROWS=2)
+    def test_too_many_rows_are_rejected(self):
+        response = self.post({"records_text": "patient_id,record_type,glucose_level\n" + "p1,BloodWork,90\n" * 3})
+        self.assertContains(response, "Too many rows: 3 (limit 2).", status_code=400)
+        self.assertEqual(self.queued(), [])
+
+    def test_doctors_only(self):
+        self.log_in(roles=("Patient",))
+        self.assertRedirects(self.post({"records_text": "[]"}), reverse("access_denied"), fetch_redirect_response=False)
+
+
+@mock.patch.object(outbox.patient_cache, "invalidate")
+@mock.patch.object(outbox, "create_medical_records")
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.record = outbox.enqueue_medical_record("patient", "BloodWork", {"glucose_level": "90"})
+
+    def test_failed_record_is_retried_with_backoff(self, create_medical_records, invalidate):
+        create_medical_records.side_effect = lambda records: [False for _ in records]
+        self.assertEqual(outbox.drain(), (0, 1))
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.attempts), (OutboxRecord.PENDING, 1))
+        delay = self.record.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=3) < delay <= timedelta(seconds=6), delay)
+
+        # Not due yet
+        self.assertEqual(outbox.drain(), (0, 0))
+
+        OutboxRecord.objects.update(next_attempt_at=timezone.now())
+        create_medical_records.side_effect = lambda records: [True for _ in records]
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.attempts), (OutboxRecord.SENT, 2))
+        invalidate.assert_called_once_with("patient")
+
+    def test_idempotency_key_is_kept_across_retries(self, create_medical_records, invalidate):
+        keys = []
+        create_medical_records.side_effect = lambda records: [keys.append(key) or False for *_, key in records]
+        for _ in range(2):
+            OutboxRecord.objects.update(next_attempt_at=timezone.now())
+            outbox.drain()
+        self.assertEqual(keys, [self.record.idempotency_key] * 2)
+
+    def test_record_fails_after_max_attempts(self, create_medical_records, invalidate):
+        create_medical_records.side_effect = lambda records: [False for _ in records]
+        for _ in range(3):
+            OutboxRecord.objects.update(next_attempt_at=timezone.now())
+            outbox.drain(max_attempts=3)
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.attempts), (OutboxRecord.FAILED, 3))
+        self.assertEqual(outbox.unsent_records("patient")[0]["status"], OutboxRecord.FAILED)
+
+    def test_bulk_records_are_drained_like_single_ones(self, create_medical_records, invalidate):
+        queued = outbox.enqueue_medical_records([("p1", "BloodWork", {"glucose_level": "91"}), ("p2", "BloodWork", {"glucose_level": "92"})])
+        self.assertEqual(len({record.idempotency_key for record in queued}), 2)
+        create_medical_records.side_effect = lambda records: [patient_id != "p2" for patient_id, *_ in records]
+        self.assertEqual(outbox.drain(), (2, 1))
+        self.assertEqual(
+            dict(OutboxRecord.objects.values_list("patient_id", "status")),
+            {"patient": OutboxRecord.SENT, "p1": OutboxRecord.SENT, "p2": OutboxRecord.PENDING},
+        )
+
+    def test_retry_delay_doubles_up_to_the_maximum(self, create_medical_records, invalidate):
+        with mock.patch.object(outbox.random, "uniform", return_value=1.0):
+            self.assertEqual(
+                [outbox.retry_delay(attempts) for attempts in (1, 2, 3)],
+                [outbox.RETRY_BASE_DELAY, outbox.RETRY_BASE_DELAY * 2, outbox.RETRY_BASE_DELAY * 4],
+            )
+            self.assertEqual(outbox.retry_delay(20), outbox.RETRY_MAX_DELAY)
+
+
+class LoginSessionTests(StubCosmosMixin, TestCase):
+    USER = {"id": "d1", "name": "Doctor", "email": "doctor@example.com", "roles": ["Doctor"]}
+
+    def sessions(self):
+        return self.container("sessions").items
+
+    def test_login_rotates_the_session_key(self):
+        planted = self.client.session
+        planted["theme"] = "dark"
+        planted.save()
+
+        with mock.patch("patients.views.verify_user", return_value=self.USER):
+            response = self.client.post(reverse("login"), {"email": "doctor@example.com", "password": "secret"})
+        self.assertRedirects(response, reverse("view_patients"), fetch_redirect_response=False)
+
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertNotEqual(session_key, planted.session_key)
+        self.assertNotIn(planted.session_key, self.sessions())
+        self.assertEqual(
+            self.sessions()[session_key]["data"],
+            {"theme": "dark", "user_id": "d1", "user_name": "Doctor", "user_roles": ["Doctor"]},
+        )
+
+    def test_async_login_rotates_the_session_key(self):
+        async def log_in():
+            planted = CosmosSessionStore()
+            await planted.aset("theme", "dark")
+            await planted.asave()
+            request = RequestFactory().post("/patients/login/", {"email": "doctor@example.com", "password": "secret"})
+            request.session = CosmosSessionStore(planted.session_key)
+            await request.session.aitems()
+            with mock.patch.object(async_views.cosmos, "verify_user", mock.AsyncMock(return_value=self.USER)):
+                response = await async_views.login_view(request)
+            # As the session middleware does after the view
+            await request.session.asave()
+            return planted.session_key, request.session, response
+
+        planted_key, session, response = asyncio.run(log_in())
+        self.assertEqual(response.status_code, 302)
+        self.assertNotEqual(session.session_key, planted_key)
+        self.assertNotIn(planted_key, self.sessions())
+        self.assertEqual(
+            self.sessions()[session.session_key]["data"],
+            {"theme": "dark", "user_id": "d1", "user_name": "Doctor", "user_roles": ["Doctor"]},
+        )
+
+
+class CachedSessionTests(StubCosmosMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        self.session = CachedSessionStore()
+        self.session.update({"user_id": "d1", "cart": 1})
+        self.session.save()
+        self.key = self.session.session_key
+
+    def stored(self):
+        return self.container("sessions").items[self.key]["data"]
+
+    def test_unchanged_session_is_served_from_the_cache(self):
+        with mock.patch("services.cosmosdb_helper.get_session_item") as get_session_item, \
+                mock.patch("services.cosmosdb_helper.read_session_if_changed", wraps=cosmosdb_helper.read_session_if_changed) as revalidate:
+            self.assertEqual(CachedSessionStore(self.key).load(), {"user_id": "d1", "cart": 1})
+        get_session_item.assert_not_called()
+        self.assertEqual(revalidate.call_args.args[0], self.key)
+
+    def test_change_on_another_worker_is_seen_on_the_next_read(self):
+        cosmosdb_helper.save_session_data(self.key, {"user_id": "d1", "user_roles": ["Admin"]})
+        self.assertEqual(CachedSessionStore(self.key).load(), {"user_id": "d1", "user_roles": ["Admin"]})
+
+    def test_logout_on_another_worker_is_seen_on_the_next_read(self):
+        cosmosdb_helper.delete_session_data(self.key)
+        session = CachedSessionStore(self.key)
+        self.assertEqual(session.load(), {})
+        self.assertIsNone(session.session_key)
+        self.assertIsNone(caches[settings.SESSION_CACHE_ALIAS].get(CachedSessionStore.cache_key_prefix + self.key))
+
+    def test_conflicting_save_merges_into_current_session(self):
+        session = CachedSessionStore(self.key)
+        session["cart"] = 5
+        del session["user_id"]
+        cosmosdb_helper.save_session_data(self.key, {"user_id": "d1", "cart": 1, "visits": 2})
+        session.save()
+        self.assertEqual(self.stored(), {"cart": 5, "visits": 2})
+
+    def test_save_to_deleted_session_is_dropped(self):
+        session = CachedSessionStore(self.key)
+        session["last_seen"] = "now"
+        cosmosdb_helper.delete_session_data(self.key)
+        with self.assertRaises(UpdateError):
+            session.save()
+        self.assertNotIn(self.key, self.container("sessions").items)
+
+    def test_async_change_on_another_worker_is_seen_on_the_next_read(self):
+        async def load():
+            await cosmosdb_helper_async.save_session_data(self.key, {"user_id": "d2"})
+            return await CachedSessionStore(self.key).aload()
+
+        self.assertEqual(asyncio.run(load()), {"user_id": "d2"})
+
+    def test_async_conflicting_save_merges_into_current_session(self):
+        async def save():
+            session = CachedSessionStore(self.key)
+            await session.aset("cart", 5)
+            await cosmosdb_helper_async.save_session_data(self.key, {"user_id": "d1", "cart": 1, "visits": 2})
+            await session.asave()
+
+        asyncio.run(save())
+        self.assertEqual(self.stored(), {"user_id": "d1", "cart": 5, "visits": 2})
+
+
+class EmailLookupTests(StubCosmosMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed("users", [{"id": "u1", "name": "Ann", "email": "ann@example.com", "roles": ["Patient"]}])
+        self.seed("patients", [{"id": "p1", "name": "Ann", "date_of_birth": "1980-01-01", "user_id": "u1", "at_risk": {}}])
+        self.seed("lookups", [
+            {"id": email_lookup_id("ann@example.com"), "type": "email", "user_id": "u1"},
+            {"id": email_lookup_id("bob@example.com"), "type": "email", "user_id": "u2"},
+        ])
+
+    def lookups(self):
+        return self.container("lookups").items
+
+    def update(self, email, name="Ann Smith"):
+        patient = {"id": "p1", "name": name, "date_of_birth": "1980-01-01", "user_id": "u1", "at_risk": {}}
+        user = {"id": "u1", "name": name, "email": email, "roles": ["Patient"]}
+        return cosmosdb_helper.update_patient_data("p1", patient, user)
+
+    def test_claim_email(self):
+        self.assertTrue(cosmosdb_helper.claim_email("new@example.com", "u1"))
+        self.assertEqual(self.lookups()[email_lookup_id("new@example.com")]["user_id"], "u1")
+        # Claiming again for the same user is accepted, for another user it isn't
+        self.assertTrue(cosmosdb_helper.claim_email("new@example.com", "u1"))
+        self.assertFalse(cosmosdb_helper.claim_email("bob@example.com", "u1"))
+        self.assertEqual(self.lookups()[email_lookup_id("bob@example.com")]["user_id"], "u2")
+
+    def test_update_moves_the_email_lookup(self):
+        self.assertIsNone(self.update("ann.smith@example.com"))
+        self.assertNotIn(email_lookup_id("ann@example.com"), self.lookups())
+        self.assertEqual(self.lookups()[email_lookup_id("ann.smith@example.com")]["user_id"], "u1")
+        self.assertEqual(self.lookups()[user_lookup_id("u1")]["patient_id"], "p1")
+        self.assertEqual(cosmosdb_helper.get_user_by_email("ann.smith@example.com")["id"], "u1")
+        patient = self.container("patients").items["p1"]
+        self.assertEqual((patient["name"], patient["name_lower"]), ("Ann Smith", "ann smith"))
+
+    def test_update_keeps_flags_set_meanwhile(self):
+        cosmosdb_helper.set_patient_at_risk("u1", "Stroke")
+        # The edit form still holds the patient as it was read, without the flag
+        self.assertIsNone(self.update("ann@example.com"))
+        patient = self.container("patients").items["p1"]
+        self.assertEqual((patient["name"], patient["birth_year"], patient["at_risk"]), ("Ann Smith", 1980, {"Stroke": True}))
+
+    def test_update_to_an_email_of_another_user_is_rejected(self):
+        self.assertEqual(self.update("bob@example.com"), "Email bob@example.com is already registered.")
+        self.assertEqual(self.container("users").items["u1"]["email"], "ann@example.com")
+        self.assertEqual(self.container("patients").items["p1"]["name"], "Ann")
+        self.assertEqual(self.lookups()[email_lookup_id("ann@example.com")]["user_id"], "u1")
+
+    def test_failed_user_write_releases_the_claimed_email(self):
+        with mock.patch.object(self.container("users"), "replace_item", side_effect=exceptions.CosmosHttpResponseError(status_code=503, message="Unavailable")):
+            self.assertEqual(self.update("ann.smith@example.com"), "Failed to update patient. Please try again.")
+        self.assertNotIn(email_lookup_id("ann.smith@example.com"), self.lookups())
+        self.assertEqual(self.lookups()[email_lookup_id("ann@example.com")]["user_id"], "u1")
+
+
+class ChargingContainer:
+    """Container client that reports a request charge per call, like the Cosmos SDK does."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def read_item(self, item, partition_key, response_hook=None):
+        response_hook({"x-ms-request-charge": "1"}, self.items[0])
+        return self.items[0]
+
+    def query_items(self, query, response_hook=None):
+        # The SDK calls the hook right away with the headers of the previous call
+        response_hook({"x-ms-request-charge": "99"}, None)
+
+        def pages():
+            for item in self.items:
+                response_hook({"x-ms-request-charge": "2.5"}, [item])
+                yield item
+        return pages()
+
+
+class AsyncChargingContainer:
+    def __init__(self, items):
+        self.items = items
+
+    async def read_item(self, item, partition_key, response_hook=None):
+        response_hook({"x-ms-request-charge": "1"}, self.items[0])
+        return self.items[0]
+
+
+class CosmosMetricsTests(SimpleTestCase):
+    ITEMS = [{"id": "p1"}, {"id": "p2"}]
+
+    def collect(self, call):
+        metrics, token = cosmos_metrics.begin_request()
+        try:
+            call()
+        finally:
+            cosmos_metrics.end_request(token)
+        return metrics.operations
+
+    def test_containers_are_only_wrapped_when_enabled(self):
+        container = ChargingContainer(self.ITEMS)
+        with override_settings(COSMOS_METRICS=False):
+            self.assertIs(cosmos_metrics.instrument(container, "patients"), container)
+        with override_settings(COSMOS_METRICS=True):
+            self.assertIsInstance(cosmos_metrics.instrument(container, "patients"), cosmos_metrics.InstrumentedContainer)
+            self.assertIsInstance(
+                cosmos_metrics.instrument_async(AsyncChargingContainer(self.ITEMS), "patients"),
+                cosmos_metrics.AsyncInstrumentedContainer,
+            )
+
+    def test_point_read_records_charge_and_keeps_the_callers_hook(self):
+        container = cosmos_metrics.InstrumentedContainer(ChargingContainer(self.ITEMS), "patients")
+        caller_hook = mock.Mock()
+        operations = self.collect(lambda: container.read_item("p1", partition_key="p1", response_hook=caller_hook))
+        totals = operations[("patients", "read")]
+        self.assertEqual((totals["calls"], totals["request_charge"], totals["items"]), (1, 1.0, 1))
+        caller_hook.assert_called_once()
+
+    def test_query_counts_only_its_own_pages(self):
+        container = cosmos_metrics.InstrumentedContainer(ChargingContainer(self.ITEMS), "patients")
+        operations = self.collect(lambda: list(container.query_items("SELECT * FROM c")))
+        totals = operations[("patients", "query")]
+        self.assertEqual((totals["calls"], totals["request_charge"], totals["items"]), (1, 5.0, 2))
+
+    def test_async_point_read_records_charge(self):
+        container = cosmos_metrics.AsyncInstrumentedContainer(AsyncChargingContainer(self.ITEMS), "users")
+
+        async def read():
+            metrics, token = cosmos_metrics.begin_request()
+            try:
+                await container.read_item("p1", partition_key="p1")
+            finally:
+                cosmos_metrics.end_request(token)
+            return metrics.operations
+
+        totals = asyncio.run(read())[("users", "read")]
+        self.assertEqual((totals["calls"], totals["request_charge"]), (1, 1.0))
+
+    @override_settings(COSMOS_METRICS_TOKEN="scrape-token")
+    def test_metrics_need_the_bearer_token(self):
+        factory = RequestFactory()
+        self.assertEqual(metrics_view(factory.get("/metrics")).status_code, 401)
+        self.assertEqual(metrics_view(factory.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")).status_code, 401)
+
+        response = metrics_view(factory.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE cosmos_operation_duration_seconds histogram", response.content.decode())
+
+    @override_settings(COSMOS_METRICS_TOKEN="")
+    def test_metrics_are_refused_without_a_configured_token(self):
+        request = RequestFactory().get("/metrics", HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(metrics_view(request).status_code, 401)
+
+
+class ChangeFeedContainer:
+    """Container client whose change feed pages report their etag through the response hook, as the SDK does."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.client_connection = mock.Mock(last_response_headers={"etag": "another thread's etag"})
+
+    def query_items_change_feed(self, response_hook=None, **kwargs):
+        self.kwargs = kwargs
+        # The SDK calls the hook once up front with the client's last headers
+        response_hook(self.client_connection.last_response_headers, None)
+        feed = mock.Mock()
+
+        def by_page():
+            for etag, documents in self.pages:
+                response_hook({"etag": etag}, documents)
+                yield iter(documents)
+        feed.by_page = by_page
+        return feed
+
+
+class PatientCacheInvalidatorTests(StubCosmosMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed("lookups", [{"id": user_lookup_id("u1"), "type": "user", "patient_id": "p1"}])
+        self.feeds = {
+            "patients": [[{"id": "p2"}]],
+            "users": [[{"id": "u1"}, {"id": "u-without-patient"}]],
+            "medical_records": [[{"id": "r1", "patient_id": "p3"}], [{"id": "r2", "patient_id": "p3"}]],
+            "health_notifications": [[{"id": "n1", "patient_id": "u1"}]],
+        }
+        self.reads = []
+        for name, target in (
+            ("get_change_feed_range_ids", lambda container_name: ["0"]),
+            ("read_change_feed", self.read_change_feed),
+        ):
+            patcher = mock.patch(f"patients.patient_cache_feed.{name}", side_effect=target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(patient_cache_feed.patient_cache, "invalidate")
+        self.invalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_change_feed(self, container_name, range_id, continuation, max_item_count, start_time=None):
+        self.reads.append((container_name, continuation))
+        pages = self.feeds[container_name]
+        start = int(continuation or 0)
+        for position in range(start, len(pages)):
+            yield pages[position], str(position + 1)
+
+    def test_changed_documents_invalidate_their_patients(self):
+        invalidator = patient_cache_feed.PatientCacheInvalidator()
+        self.assertEqual(invalidator.poll(), 5)
+        self.assertEqual(
+            sorted(call.args[0] for call in self.invalidate.call_args_list), ["p1", "p1", "p2", "p3", "p3"]
+        )
+
+    def test_next_poll_resumes_from_the_saved_continuations(self):
+        invalidator = patient_cache_feed.PatientCacheInvalidator()
+        invalidator.poll()
+        self.feeds["patients"].append([{"id": "p4"}])
+        self.reads.clear()
+        self.invalidate.reset_mock()
+
+        self.assertEqual(invalidator.poll(), 1)
+        self.invalidate.assert_called_once_with("p4")
+        self.assertEqual(
+            dict(self.reads), {"patients": "1", "users": "1", "medical_records": "2", "health_notifications": "1"}
+        )
+
+    def test_failed_poll_lists_the_ranges_again(self):
+        invalidator = patient_cache_feed.PatientCacheInvalidator()
+        invalidator.poll()
+        stop = mock.Mock(is_set=mock.Mock(side_effect=[False, True]))
+        with mock.patch.object(invalidator, "poll", side_effect=exceptions.CosmosHttpResponseError(status_code=410, message="Gone")):
+            invalidator.run(0, stop_event=stop)
+        self.assertEqual(invalidator._range_ids, {})
+
+
+class ReadChangeFeedTests(SimpleTestCase):
+    def test_continuation_comes_from_each_pages_own_headers(self):
+        container = ChangeFeedContainer([('"5"', [{"id": "p1"}]), ('"6"', [])])
+        with mock.patch("services.cosmosdb_helper.get_container", return_value=container):
+            pages = list(cosmosdb_helper.read_change_feed("patients", "0", continuation='"4"'))
+        self.assertEqual(pages, [([{"id": "p1"}], '"5"'), ([], '"6"')])
+        self.assertEqual(
+            (container.kwargs["continuation"], container.kwargs["is_start_from_beginning"]), ('"4"', False)
+        )
+
+
+class WarmUpTests(SimpleTestCase):
+    def test_failures_are_logged_not_raised(self):
+        for error in (ServiceRequestError("Connection refused"), ValueError("Invalid connection string")):
+            with self.subTest(error=error), \
+                    mock.patch("services.cosmosdb_helper.get_client", side_effect=error), \
+                    self.assertLogs("services.cosmosdb_helper", "ERROR") as logs:
+                cosmosdb_helper.warm_up()
+            self.assertIn(str(error), logs.output[0])
+
+    def test_warm_up_reads_the_database(self):
+        with mock.patch("services.cosmosdb_helper.get_client", return_value=StubCosmosClient()):
+            with self.assertLogs("services.cosmosdb_helper", "INFO") as logs:
+                cosmosdb_helper.warm_up()
+        self.assertIn("warmed up", logs.output[0])
+
+
+class AsyncDataLayerTests(StubCosmosMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed("patients", [{"id": f"p{i:02}", "name": f"Patient {i}"} for i in range(25)])
+
+    def test_patient_pages_match_the_sync_layer(self):
+        for cursor in ({}, {"after_id": "p09"}, {"before_id": "p12"}, {"before_id": "p05"}):
+            with self.subTest(**cursor):
+                self.assertEqual(
+                    asyncio.run(cosmosdb_helper_async.get_patients_page_by_cursor(10, fields=("name",), **cursor)),
+                    get_patients_page_by_cursor(10, fields=("name",), **cursor),
+                )
+
+    def test_sessions_are_stored_with_their_ttl(self):
+        asyncio.run(cosmosdb_helper_async.create_session_data("s1", {"user_id": "d1"}, ttl=60.5))
+        stored = self.container("sessions").items["s1"]
+        self.assertEqual({key: stored[key] for key in ("id", "data", "ttl")}, session_item("s1", {"user_id": "d1"}, 60.5))
+        self.assertEqual(stored["ttl"], 60)
+
+
+class MedicalRecordPageTests(SimpleTestCase):
+    def test_record_cursor_round_trip(self):
+        records = [{"id": f"r{i}", "created_date_utc": f"2024-01-0{i + 1}T00:00:00"} for i in range(3)]
+        page = medical_records_page(records, 2)
+        self.assertEqual(page["records"], records[:2])
+        self.assertEqual(decode_record_cursor(page["next_cursor"]), ("2024-01-02T00:00:00", "r1"))
+        self.assertIsNone(medical_records_page(records)["next_cursor"])
+
+        query, parameters = medical_records_query("patient", page_size=2, cursor=page["next_cursor"])
+        self.assertIn("c.created_date_utc < @cursor_date", query)
+        self.assertIn({"name": "@limit", "value": 3}, parameters)
+
+    def test_filters_bound_the_creation_date(self):
+        query, parameters = medical_records_query(
+            "patient", record_type="BloodWork", date_from=date(2024, 1, 1), date_to=date(2024, 1, 31)
+        )
+        self.assertIn("c.type = @record_type AND c.created_date_utc >= @date_from AND c.created_date_utc < @date_to", query)
+        self.assertIn({"name": "@date_to", "value": "2024-02-01"}, parameters)
+
+    def test_invalid_record_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_record_cursor("!!")
+
+
+class PatientImportTests(TestCase):
+    ROWS = [
+        {"name": f"Patient {i}", "email": f"patient{i}@example.com", "password": f"secret {i}",
+         "date_of_birth": "1990-01-02", "sex": "female"}
+        for i in range(5)
+    ]
+
+    def setUp(self):
+        hasher = mock.patch.object(patient_import, "_hasher")
+        hasher.start().hash_many.side_effect = lambda passwords: (f"hash:{password}" for password in passwords)
+        self.addCleanup(hasher.stop)
+        self.saved = []
+        save = mock.patch.object(patient_import, "save_user_and_patient", side_effect=self.save)
+        save.start()
+        self.addCleanup(save.stop)
+
+    def save(self, user, patient):
+        self.saved.append((user["id"], patient["id"], user["email"], user["password_hash"]))
+        return None
+
+    def rows(self):
+        return ((row_number, dict(row), None) for row_number, row in enumerate(self.ROWS, start=1))
+
+    def test_validate_patient_row(self):
+        fields, error = patient_import.validate_patient_row({**self.ROWS[0], "date_of_birth": "1990-01-02T00:00:00", "ever_married": "Yes"})
+        self.assertIsNone(error)
+        self.assertEqual((fields["sex"], fields["date_of_birth"], fields["ever_married"]), ("Female", "1990-01-02", True))
+
+        for row, expected in (
+            ({**self.ROWS[0], "email": "", "sex": None}, "Missing email, sex."),
+            ({**self.ROWS[0], "email": "nobody"}, "Invalid email 'nobody'."),
+            ({**self.ROWS[0], "date_of_birth": "02/01/1990"}, "Invalid date_of_birth '02/01/1990'."),
+            ({**self.ROWS[0], "sex": "other"}, "Unknown sex 'Other'."),
+        ):
+            self.assertEqual(patient_import.validate_patient_row(row)[1], expected)
+
+    def test_import_reports_failed_rows(self):
+        rows = [(1, dict(self.ROWS[0]), None), (2, dict(self.ROWS[0]), None), (3, None, "Invalid JSON: oops")]
+        summary = patient_import.import_patients(rows, "sha256:dupes", chunk_size=10)
+        self.assertEqual(summary, {"created": 1, "failed": 2, "skipped": 0})
+        checkpoint = PatientImportCheckpoint.objects.get(name="sha256:dupes")
+        self.assertEqual(checkpoint.failures, [
+            {"row": 2, "email": "patient0@example.com", "error": "Email patient0@example.com appears more than once."},
+            {"row": 3, "email": "", "error": "Invalid JSON: oops"},
+        ])
+
+    def test_import_resumes_after_last_finished_chunk(self):
+        def fail_on_row_4(user, patient):
+            if user["email"] == "patient3@example.com":
+                raise exceptions.CosmosHttpResponseError(status_code=503, message="Service unavailable")
+            return self.save(user, patient)
+
+        with mock.patch.object(patient_import, "save_user_and_patient", side_effect=fail_on_row_4):
+            with self.assertRaises(exceptions.CosmosHttpResponseError):
+                patient_import.import_patients(self.rows(), "sha256:resume", chunk_size=2, write_workers=1)
+        checkpoint = PatientImportCheckpoint.objects.get(name="sha256:resume")
+        self.assertEqual((checkpoint.status, checkpoint.rows_done, checkpoint.created), (PatientImportCheckpoint.FAILED, 2, 2))
+        first_run = list(self.saved)
+
+        summary = patient_import.import_patients(self.rows(), "sha256:resume", chunk_size=2, write_workers=1)
+        self.assertEqual(summary, {"created": 3, "failed": 0, "skipped": 2})
+        checkpoint.refresh_from_db()
+        self.assertEqual((checkpoint.status, checkpoint.rows_done, checkpoint.created), (PatientImportCheckpoint.DONE, 5, 5))
+        # Row 3 was written by both runs under the same IDs
+        self.assertIn(self.saved[len(first_run)], first_run)
+        self.assertEqual(len({user_id for user_id, *_ in self.saved}), 5)
+
+    def test_ids_depend_on_import_name(self):
+        patient_import.import_patients(self.rows(), "sha256:one", chunk_size=10)
+        patient_import.import_patients(self.rows(), "sha256:two", chunk_size=10)
+        self.assertEqual(len({user_id for user_id, *_ in self.saved}), 10)
+
+    def test_restart_imports_every_row_again(self):
+        patient_import.import_patients(self.rows(), "sha256:restart", chunk_size=2)
+        summary = patient_import.import_patients(self.rows(), "sha256:restart", chunk_size=2, restart=True)
+        self.assertEqual(summary, {"created": 5, "failed": 0, "skipped": 0})
+
+    def test_import_name_is_content_hash(self):
+        self.assertEqual(patient_import.import_name([b"a", b"bc"]), patient_import.import_name([b"abc"]))
+        self.assertNotEqual(patient_import.import_name([b"abc"]), patient_import.import_name([b"abd"]))
+
+
+class PasswordHasherTests(SimpleTestCase):
+    def test_hash_many_waits_for_slots_and_keeps_order(self):
+        hasher = PasswordHasher(workers=2, max_pending=1)
+        self.addCleanup(hasher.shutdown)
+        passwords = ["first", "second", "third"]
+        hashes = list(hasher.hash_many(passwords))
+        self.assertEqual(len(hashes), 3)
+        for password, password_hash in zip(passwords, hashes):
+            self.assertTrue(pwd_context.verify(password, password_hash))
+
+
+class PatientSearchTests(SimpleTestCase):
+    def test_birth_date_bounds(self):
+        self.assertEqual(birth_date_bounds(30, 40, today=TODAY), ("1983-06-16", "1994-06-16"))
+        self.assertEqual(birth_date_bounds(today=TODAY), (None, None))
+        self.assertEqual(birth_date_bounds(age_min=0, today=TODAY), (None, "2024-06-16"))
+
+    def test_birth_date_bounds_on_29_february(self):
+        self.assertEqual(birth_date_bounds(1, 1, today=date(2024, 2, 29)), ("2022-03-01", "2023-03-01"))
+
+    def test_search_cursor_seeds_the_next_page(self):
+        patients = [{"id": f"p{i}", "name_lower": f"pat {i}"} for i in range(3)]
+        page = patient_search_page(patients, 2)
+        self.assertEqual(page["patients"], patients[:2])
+        self.assertEqual(page["next_cursor"], encode_patient_search_cursor(patients[1]))
+        self.assertIsNone(patient_search_page(patients, 3)["next_cursor"])
+
+        query, parameters = patient_search_query(cursor=page["next_cursor"])
+        self.assertIn("(c.name_lower > @cursor_name OR (c.name_lower = @cursor_name AND c.id > @cursor_id))", query)
+        self.assertIn({"name": "@cursor_name", "value": "pat 1"}, parameters)
+        self.assertIn({"name": "@cursor_id", "value": "p1"}, parameters)
+
+    def test_search_query_adds_sort_key_to_projection(self):
+        query, _ = patient_search_query(fields=("name",), limit=11)
+        self.assertTrue(query.startswith("SELECT TOP @limit c.id, c.name, c.name_lower FROM c"))
+
+    def test_name_prefix_is_a_range_on_the_lowercase_name(self):
+        _, parameters = patient_search_query(name_prefix=" Ann ")
+        self.assertIn({"name": "@name_from", "value": "ann"}, parameters)
+        self.assertIn({"name": "@name_to", "value": "ann\uffff"}, parameters)
+
+    def test_invalid_search_cursor(self):
+        for cursor in ("not a cursor", encode_record_cursor({"created_date_utc": 1, "id": "r1"})):
+            with self.assertRaises(ValueError):
+                patient_search_query(cursor=cursor)
+
+
+def cells(cube):
+    """Index a cube by its cells, as {(birth_year, sex, ever_married, disease): patients}."""
+    return dict(zip(zip(*(cube[name] for name in CELL_COLUMNS)), cube["patients"]))
+
+
+class RiskCubeTests(SimpleTestCase):
+    def setUp(self):
+        self.cube = cube_cells(
+            [1990, 1990, 1950, 2010],
+            ["Female", "Female", "Male", None],
+            [True, True, False, False],
+            [["Stroke"], [], ["Stroke", "Diabetes"], []],
+        )
+
+    def test_cube_cells_counts_every_patient_and_each_disease(self):
+        self.assertEqual(cells(self.cube), {
+            (1990, "Female", True, ALL_PATIENTS): 2,
+            (1990, "Female", True, "Stroke"): 1,
+            (1950, "Male", False, ALL_PATIENTS): 1,
+            (1950, "Male", False, "Stroke"): 1,
+            (1950, "Male", False, "Diabetes"): 1,
+            (2010, "", False, ALL_PATIENTS): 1,
+        })
+
+    def test_cube_cells_weights_cancel_out(self):
+        cube = cube_cells([1990, 1990], ["Female", "Female"], [True, True], [["Stroke"], ["Stroke"]], weights=[1, -1])
+        self.assertEqual(cells(cube), {})
+
+    def test_cube_cells_without_patients(self):
+        self.assertEqual(cube_cells([], [], [], []), {name: [] for name in (*CELL_COLUMNS, "patients")})
+
+    def test_rollup_by_age_bucket(self):
+        result = rollup(self.cube, today=TODAY)
+        self.assertEqual(result["diseases"], ["Diabetes", "Stroke"])
+        self.assertEqual(result["patients"], 4)
+        self.assertEqual(result["at_risk"], [1, 2])
+        self.assertEqual(result["groups"], [
+            {"label": "0-18", "patients": 1, "at_risk": [0, 0]},
+            {"label": "31-40", "patients": 2, "at_risk": [0, 1]},
+            {"label": "61+", "patients": 1, "at_risk": [1, 1]},
+        ])
+
+    def test_rollup_filters_and_disease(self):
+        result = rollup(self.cube, "sex", {"age_bucket": "31-40"}, disease="Stroke", today=TODAY)
+        self.assertEqual(result["diseases"], ["Stroke"])
+        self.assertEqual(result["groups"], [{"label": "Female", "patients": 2, "at_risk": [1]}])
+
+    def test_rollup_unknown_filter_value_matches_nothing(self):
+        result = rollup(self.cube, "sex", {"ever_married": "Maybe"}, today=TODAY)
+        self.assertEqual((result["patients"], result["groups"]), (0, []))
+
+
+class RiskCubeFeedTests(TestCase):
+    def patient(self, patient_id, **fields):
+        return {"id": patient_id, "birth_year": 1990, "sex": "Female", "ever_married": True, "at_risk": {}, **fields}
+
+    def counters(self):
+        return {
+            (counter.birth_year, counter.sex, counter.ever_married, counter.disease): counter.patients
+            for counter in RiskCubeCounter.objects.exclude(patients=0)
+        }
+
+    def test_replaying_the_same_documents_is_a_no_op(self):
+        page = [self.patient("p1", at_risk={"Stroke": True, "Diabetes": False}), self.patient("p2")]
+        self.assertEqual(apply_patient_changes(page), 2)
+        expected = {(1990, "Female", True, ALL_PATIENTS): 2, (1990, "Female", True, "Stroke"): 1}
+        self.assertEqual(self.counters(), expected)
+
+        self.assertEqual(apply_patient_changes(page), 0)
+        self.assertEqual(self.counters(), expected)
+
+    def test_changed_patient_moves_between_cells(self):
+        apply_patient_changes([self.patient("p1", at_risk={"Stroke": True})])
+        self.assertEqual(apply_patient_changes([self.patient("p1", birth_year=1950, at_risk={})]), 1)
+        self.assertEqual(self.counters(), {(1950, "Female", True, ALL_PATIENTS): 1})
+        self.assertEqual(PatientCubeState.objects.get(pk="p1").diseases, [])
+
+    def test_birth_year_is_derived_from_date_of_birth(self):
+        patient = self.patient("p1", date_of_birth="1980-02-03T00:00:00")
+        del patient["birth_year"]
+        apply_patient_changes([patient])
+        self.assertEqual(self.counters(), {(1980, "Female", True, ALL_PATIENTS): 1})
@@ -1,15 +1,27 @@
 # patients/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    from . import async_views as cosmos_views
+else:
+    cosmos_views = views
+
 urlpatterns = [
-    path('view/', views.view_patients, name='view_patients'),
-    path('patient/<str:patient_id>/', views.patient_user_details, name='patient_user_details'),
+    path('view/', cosmos_views.view_patients, name='view_patients'),
+    path('patient/<str:patient_id>/', cosmos_views.patient_user_details, name='patient_user_details'),
+    path('patients/<str:patient_id>/records/', cosmos_views.medical_records_page_view, name='medical_records_page'),
+    path('patients/<str:patient_id>/records/pending/', views.pending_medical_records_view, name='pending_medical_records'),
     path('patients/<str:patient_id>/add_record/', views.create_medical_record_view, name='create_medical_record'),
+    path('records/bulk/', views.bulk_medical_records_view, name='bulk_medical_records'),
     path('add/', views.add_patient_view, name='add_patient'),
-    path('login/', views.login_view, name='login'), 
+    path('bulk/', views.bulk_patients_view, name='bulk_patients'),
+    path('login/', cosmos_views.login_view, name='login'), 
     path('logout/', views.logout_view, name='logout'),
     path('access_denied/', views.access_denied_view, name='access_denied'),
     path('patients/<str:patient_id>/update/', views.update_patient_view, name='update_patient'),
     path('age-risk-distribution/', views.age_risk_distribution_view, name='age_risk_distribution'),
+    path('age-risk-distribution/chart/<str:chart_key>.png', views.age_risk_chart_view, name='age_risk_chart'),
+    path('risk-dashboard/', views.risk_dashboard_view, name='risk_dashboard'),
 ]
@@ -1,40 +1,214 @@
 from django.urls import reverse
 import datetime
+import hmac
 import logging
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db import DatabaseError
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
 from patients.decorators import login_required, role_required
-from services.blockchain import create_medical_record
-from services.cosmosdb_helper import create_user_and_patient, get_age_risk_data, get_patient_details, get_patient_id_by_user_id, get_patients_page, update_patient_data, verify_user 
+from patients.outbox import enqueue_medical_record, enqueue_medical_records, unsent_records
+from patients.patient_import import enqueue_upload, import_status, recent_uploads
+from patients.patient_cache_feed import start_listener
+from patients.medical_records import RECORD_TYPE_FIELDS, parse_bulk_records, record_data, validate_record_row
+from services.analytics import get_age_risk_histogram
+from services.charts import get_chart_png, remember_chart_data, svg_bars
+from services.cosmos_metrics import render_metrics
+from services.passwords import PasswordHasherBusy
+from services.patient_fields import age_bucket
+from services.risk_cube import DIMENSIONS as RISK_DIMENSIONS, get_risk_rollup
+from services.cosmosdb_helper import create_user_and_patient, get_cached_patient_details, get_medical_records_page, get_patient_details, get_patient_id_by_user_id, get_patients_page_by_cursor, search_patients, update_patient_data, verify_user 
 from django.contrib import messages
-import matplotlib.pyplot as plt
-import io
-import base64
-from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+PATIENTS_PAGE_SIZE = 10
+# Medical records shown on the patient page and added by each "load more"
+MEDICAL_RECORDS_PAGE_SIZE = 12
+
+# Fields each page reads from Cosmos DB, so queries don't return whole documents
+PATIENT_LIST_FIELDS = ("id", "name", "date_of_birth", "birth_year", "sex")
+MEDICAL_RECORD_FIELDS = (
+    "id", "type", "created_date_utc", "note",
+    *dict.fromkeys(field for fields in RECORD_TYPE_FIELDS.values() for field in fields),
+)
+HEALTH_NOTIFICATION_FIELDS = ("id", "title", "text", "disease")
+
+def _parse_page_cursor(value):
+    """
+    Split a ``?page=`` cursor such as ``after:<id>`` or ``before:<id>`` into
+    its direction and patient ID. Anything else (including legacy page
+    numbers) starts from the first page.
+    """
+    direction, _, patient_id = (value or "").partition(":")
+    if direction in ("after", "before") and patient_id:
+        return direction, patient_id
+    return None, None
+
+def _label_age_groups(patients):
+    """Add each patient's ``age_bucket``, computed from the stored ``birth_year`` for the configured buckets."""
+    return [
+        {**patient, "age_bucket": age_bucket(patient.get("birth_year"), settings.AGE_RISK_BUCKET_EDGES)}
+        for patient in patients
+    ]
+
+def _patients_page_context(patients, has_previous, has_more):
+    return {
+        'patients': _label_age_groups(patients),
+        'has_previous': has_previous and bool(patients),
+        'has_more': has_more and bool(patients),
+        'previous_cursor': f"before:{patients[0]['id']}" if patients else "",
+        'next_cursor': f"after:{patients[-1]['id']}" if patients else "",
+    }
+
+# Query parameters of the patient list search form
+PATIENT_SEARCH_PARAMS = ("q", "email", "sex", "age_min", "age_max", "at_risk")
+
+def _parse_patient_search(params):
+    """
+    Read the patient list search form (``q`` for a name prefix, ``email``,
+    ``sex``, ``age_min``, ``age_max`` and ``at_risk``) from query parameters.
+    Blank and malformed values are ignored.
+
+    :return: The filters to pass to ``search_patients``; empty when not searching.
+    """
+    def parse_age(value):
+        try:
+            age = int(value)
+        except (TypeError, ValueError):
+            return None
+        return age if 0 <= age <= 150 else None
+
+    sex = params.get("sex")
+    filters = {
+        "name_prefix": (params.get("q") or "").strip() or None,
+        "email": (params.get("email") or "").strip() or None,
+        "sex": sex if sex in ("Male", "Female") else None,
+        "age_min": parse_age(params.get("age_min")),
+        "age_max": parse_age(params.get("age_max")),
+        "at_risk": params.get("at_risk") in ("1", "on", "true"),
+    }
+    return {name: value for name, value in filters.items() if value not in (None, False)}
+
+def _patient_search_context(params, page, cursor):
+    """Template context for a page of patient search results; only forward paging is offered."""
+    first_page = params.copy()
+    first_page.pop("cursor", None)
+    next_page = first_page.copy()
+    next_page["cursor"] = page["next_cursor"] or ""
+    return {
+        'patients': _label_age_groups(page["patients"]),
+        'searching': True,
+        'search': {name: params.get(name, "") for name in PATIENT_SEARCH_PARAMS},
+        'has_previous': bool(cursor),
+        'has_more': page["next_cursor"] is not None,
+        'first_page_query': first_page.urlencode(),
+        'next_page_query': next_page.urlencode(),
+    }
+
+RECORD_TYPE_NAMES = {
+    "PhysicalExam": "Physical Exam",
+    "BloodWork": "Blood Work",
+    "BloodPressure": "Blood Pressure",
+    "DiseaseHistory": "Disease History",
+}
+
+def _parse_record_filters(params):
+    """
+    Read the medical record history filters (``type``, ``from`` and ``to``) from
+    query parameters. Unknown record types and malformed dates are ignored.
+    """
+    def parse_date(value):
+        try:
+            return datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+
+    record_type = params.get("type")
+    return {
+        "record_type": record_type if record_type in RECORD_TYPE_FIELDS else None,
+        "date_from": parse_date(params.get("from")),
+        "date_to": parse_date(params.get("to")),
+    }
+
+def _label_records(records):
+    for record in records:
+        record["display_name"] = RECORD_TYPE_NAMES.get(record["type"], record["type"])
+    return records
+
+def _patient_details_context(patient, user, medical_records, health_notifications, pending_records, record_filters):
+    return {
+        'patient': patient,
+        'age_group': age_bucket(patient.get("birth_year"), settings.AGE_RISK_BUCKET_EDGES),
+        'at_risk_diseases': sorted(disease for disease, flagged in (patient.get("at_risk") or {}).items() if flagged),
+        'user': user,
+        'medical_records': _label_records(medical_records["records"]),
+        'next_records_cursor': medical_records["next_cursor"],
+        'record_filters': record_filters,
+        'record_types': RECORD_TYPE_NAMES,
+        'pending_records': _label_records(pending_records),
+        'health_notifications': health_notifications
+    }
+
+def _medical_records_page_response(request, patient_id, page):
+    records = _label_records(page["records"])
+    return JsonResponse({
+        "patient_id": patient_id,
+        "records": records,
+        "next_cursor": page["next_cursor"],
+        "html": render_to_string('patients/_medical_record_cards.html', {'medical_records': records}, request),
+    })
+
+def _login_busy_response(request):
+    messages.error(request, "Too many sign-ins right now. Please try again in a moment.")
+    return render(request, 'patients/login.html', status=503)
+
+def _session_user(user):
+    return {'user_id': user['id'], 'user_name': user['name'], 'user_roles': user['roles']}
+
+def _start_session(request, user):
+    # A new session key on login, so a session ID planted before it can't be used to ride the login
+    request.session.cycle_key()
+    request.session.update(_session_user(user))
+
+async def _astart_session(request, user):
+    await request.session.acycle_key()
+    await request.session.aupdate(_session_user(user))
+
 @login_required
 @role_required(['Doctor'])
 def view_patients(request):
-    page_size = 10
-    page = int(request.GET.get('page', 1))
+    search = _parse_patient_search(request.GET)
+    if search:
+        cursor = request.GET.get("cursor")
+        try:
+            page = search_patients(page_size=PATIENTS_PAGE_SIZE, cursor=cursor, fields=PATIENT_LIST_FIELDS, **search)
+        except ValueError:
+            logger.warning(f"Ignoring invalid patient search cursor: {cursor}")
+            cursor = None
+            page = search_patients(page_size=PATIENTS_PAGE_SIZE, fields=PATIENT_LIST_FIELDS, **search)
+        logger.info(f"Found {len(page['patients'])} patients matching {search}")
+        return render(request, 'patients/view_patients.html', _patient_search_context(request.GET, page, cursor))
+
+    direction, cursor_id = _parse_page_cursor(request.GET.get('page'))
     
-    logger.info(f"Fetching patients list, page: {page}, page size: {page_size}")
+    logger.info(f"Fetching patients list, cursor: {direction} {cursor_id}, page size: {PATIENTS_PAGE_SIZE}")
     
-    patients, has_more = get_patients_page(page_size=page_size, page=page)
-    logger.info(f"Retrieved {len(patients)} patients for page {page}")
+    patients, has_previous, has_more = get_patients_page_by_cursor(
+        page_size=PATIENTS_PAGE_SIZE,
+        after_id=cursor_id if direction == "after" else None,
+        before_id=cursor_id if direction == "before" else None,
+        fields=PATIENT_LIST_FIELDS,
+    )
+    logger.info(f"Retrieved {len(patients)} patients")
 
-    for patient in patients:
-        dob = patient.get("date_of_birth")
-        patient["date_of_birth"] = datetime.datetime.fromisoformat(dob).date()
-
-    context = {
-        'patients': patients,
-        'has_more': has_more,
-        'page': page 
-    }
+    context = _patients_page_context(patients, has_previous, has_more)
 
-    logger.info(f"Rendering view_patients.html with {len(patients)} patients for page {page}")
+    logger.info(f"Rendering view_patients.html with {len(patients)} patients")
     return render(request, 'patients/view_patients.html', context)
 
 @login_required
@@ -42,79 +216,147 @@ def view_patients(request):
 def patient_user_details(request, patient_id):
     logger.info(f"Fetching details for patient with ID: {patient_id}")
     
-    patient, user, medical_records, health_notifications = get_patient_details(patient_id)
-    
+    start_listener()
+    record_filters = _parse_record_filters(request.GET)
+    patient, user, medical_records, health_notifications = get_cached_patient_details(
+        patient_id,
+        record_fields=MEDICAL_RECORD_FIELDS,
+        notification_fields=HEALTH_NOTIFICATION_FIELDS,
+        record_page_size=MEDICAL_RECORDS_PAGE_SIZE,
+        record_filters=record_filters,
+    )
+
     if not patient:
         logger.warning(f"No patient found with ID: {patient_id}")
         return render(request, '404.html', status=404)
 
-    dob = patient.get("date_of_birth")
-    patient["date_of_birth"] = datetime.datetime.fromisoformat(dob).date()
-
     logger.info(f"Patient found: {patient.get('name')} with ID: {patient_id}")
 
-    record_type_names = {
-        "PhysicalExam": "Physical Exam",
-        "BloodWork": "Blood Work",
-        "BloodPressure": "Blood Pressure",
-        "DiseaseHistory": "Disease History",
-    }
-
-    for record in medical_records:
-        record["display_name"] = record_type_names.get(record["type"], record["type"])
-
-
-    context = {
-        'patient': patient,
-        'user': user,
-        'medical_records': medical_records,
-        'health_notifications': health_notifications
-    }
+    context = _patient_details_context(
+        patient, user, medical_records, health_notifications, unsent_records(patient_id), record_filters
+    )
 
     logger.info(f"Rendering patient_user_details.html for patient ID: {patient_id}")
     return render(request, 'patients/patient_user_details.html', context)
 
+@login_required
+@role_required(['Patient', 'Doctor'])
+def medical_records_page_view(request, patient_id):
+    """History API: the page of the patient's medical records after ``?cursor=``, with the page's filters."""
+    try:
+        page = get_medical_records_page(
+            patient_id,
+            page_size=MEDICAL_RECORDS_PAGE_SIZE,
+            cursor=request.GET.get("cursor"),
+            fields=MEDICAL_RECORD_FIELDS,
+            **_parse_record_filters(request.GET),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return _medical_records_page_response(request, patient_id, page)
+
+@login_required
+@role_required(['Patient', 'Doctor'])
+def pending_medical_records_view(request, patient_id):
+    """Status API: the patient's medical records still waiting for (or given up on by) the outbox worker."""
+    return JsonResponse({"patient_id": patient_id, "records": unsent_records(patient_id)})
+
 @login_required
 @role_required(['Doctor'])
 def create_medical_record_view(request, patient_id):
     if request.method == "POST":
         record_type = request.POST.get("record_type")
         
-        data = {}
-        if record_type == "PhysicalExam":
-            data = {
-                "work_type": request.POST.get("work_type"),
-                "residency_type": request.POST.get("residency_type"),
-                "height": request.POST.get("height"),
-                "weight": request.POST.get("weight"),
-                "smoking_status": request.POST.get("smoking_status"),
-            }
-        elif record_type == "BloodPressure":
-            data = {
-                "systolic_pressure": request.POST.get("systolic_pressure"),
-                "diastolic_pressure": request.POST.get("diastolic_pressure"),
-            }
-        elif record_type == "BloodWork":
-            data = {
-                "glucose_level": request.POST.get("glucose_level"),
-            }
-        elif record_type == "DiseaseHistory":
-            data = {
-                "disease_type": request.POST.get("disease_type"),
-            }
+        data = record_data(request.POST, record_type)
         
-        if create_medical_record(patient_id, record_type, **data):
-            logger.info(f"Medical record created successfully for patient ID {patient_id}.")
-            return redirect(reverse('patient_user_details', args=[patient_id]))
-        else:
-            logger.error(f"Failed to create medical record for patient ID {patient_id}.")
-            return render(request, 'patients/create_medical_record.html', {
-                'error_message': "Failed to create medical record. Please try again.",
-                'patient_id': patient_id,
-            })
+        if record_type in RECORD_TYPE_FIELDS:
+            try:
+                # The outbox worker writes the record to the blockchain in the background
+                enqueue_medical_record(patient_id, record_type, data)
+                messages.success(request, "Medical record saved. It will appear once the blockchain confirms it.")
+                return redirect(reverse('patient_user_details', args=[patient_id]))
+            except DatabaseError as e:
+                logger.error(f"Failed to queue medical record for patient ID {patient_id}: {e}")
+
+        logger.error(f"Failed to create medical record for patient ID {patient_id}.")
+        return render(request, 'patients/create_medical_record.html', {
+            'error_message': "Failed to create medical record. Please try again.",
+            'patient_id': patient_id,
+        })
 
     return render(request, 'patients/create_medical_record.html', {'patient_id': patient_id})
 
+@login_required
+@role_required(['Doctor'])
+def bulk_medical_records_view(request):
+    context = {"record_type_fields": RECORD_TYPE_FIELDS}
+    if request.method != "POST":
+        return render(request, 'patients/bulk_medical_records.html', context)
+
+    uploaded = request.FILES.get("records_file")
+    if uploaded:
+        content, filename = uploaded.read().decode("utf-8-sig", errors="replace"), uploaded.name
+    else:
+        content, filename = request.POST.get("records_text", ""), ""
+
+    try:
+        rows = parse_bulk_records(content, filename)
+    except ValueError as e:
+        context["error_message"] = str(e)
+        return render(request, 'patients/bulk_medical_records.html', context, status=400)
+
+    if len(rows) > settings.BULK_RECORDS_MAX_ROWS:
+        context["error_message"] = f"Too many rows: {len(rows)} (limit {settings.BULK_RECORDS_MAX_ROWS})."
+        return render(request, 'patients/bulk_medical_records.html', context, status=400)
+
+    report, valid = [], []
+    for row_number, row in enumerate(rows, start=1):
+        patient_id, record_type, data, error = validate_record_row(row)
+        entry = {"row": row_number, "patient_id": patient_id, "record_type": record_type,
+                 "status": "invalid" if error else "queued", "error": error}
+        report.append(entry)
+        if not error:
+            valid.append((patient_id, record_type, data))
+
+    logger.info(f"Bulk medical records: {len(valid)} valid of {len(rows)} rows")
+    try:
+        # The outbox worker writes them to the blockchain and retries failures
+        enqueue_medical_records(valid)
+    except DatabaseError as e:
+        logger.error(f"Failed to queue bulk medical records: {e}")
+        context["error_message"] = "Failed to save the medical records. Please try again."
+        return render(request, 'patients/bulk_medical_records.html', context, status=503)
+
+    summary = {status: sum(entry["status"] == status for entry in report) for status in ("queued", "invalid")}
+    if request.GET.get("format") == "json":
+        return JsonResponse({"summary": summary, "rows": report})
+
+    context.update({"report": report, "summary": summary})
+    return render(request, 'patients/bulk_medical_records.html', context)
+
+@login_required
+@role_required(['Doctor'])
+def bulk_patients_view(request):
+    if request.method == "POST":
+        uploaded = request.FILES.get("patients_file")
+        if not uploaded:
+            return render(request, 'patients/bulk_patients.html', {'error_message': "Choose a file to import."}, status=400)
+
+        # The import worker runs it; this page then shows its progress
+        checkpoint = enqueue_upload(uploaded, restart="restart" in request.POST)
+        status_url = f"{reverse('bulk_patients')}?{urlencode({'import': checkpoint.name})}"
+        if request.GET.get("format") == "json":
+            return JsonResponse({"import": import_status(checkpoint.name), "status_url": status_url}, status=202)
+        return redirect(status_url)
+
+    name = request.GET.get("import")
+    status = import_status(name) if name else None
+    if request.GET.get("format") == "json":
+        if status is None:
+            return JsonResponse({"error": "Import not found."}, status=404)
+        return JsonResponse({"import": status})
+    return render(request, 'patients/bulk_patients.html', {"patient_import": status, "recent_uploads": recent_uploads()})
+
 @login_required
 @role_required(['Doctor'])
 def add_patient_view(request):
@@ -143,7 +385,7 @@ def update_patient_view(request, patient_id):
         return redirect('view_patients')
     
     if patient.get("date_of_birth"):
-        patient["date_of_birth"] = datetime.datetime.fromisoformat(patient["date_of_birth"]).strftime("%Y-%m-%d")
+        patient["date_of_birth"] = patient["date_of_birth"][:10]
 
     if request.method == "POST":
         patient["name"] = request.POST.get("name", patient["name"])
@@ -154,11 +396,12 @@ def update_patient_view(request, patient_id):
         user["name"] = request.POST.get("name", user["name"])
         user["email"] = request.POST.get("email", user["email"])
 
-        if update_patient_data(patient_id, patient, user):
+        error = update_patient_data(patient_id, patient, user)
+        if error is None:
             messages.success(request, "Patient updated successfully.")
             return redirect('patient_user_details', patient_id=patient_id)
         else:
-            messages.error(request, "Failed to update patient. Please try again.")
+            messages.error(request, error)
 
     context = {
         "patient": patient,
@@ -171,12 +414,13 @@ def login_view(request):
         email = request.POST.get("email")
         password = request.POST.get("password")
 
-        user = verify_user(email, password)
-        
+        try:
+            user = verify_user(email, password)
+        except PasswordHasherBusy:
+            return _login_busy_response(request)
+
         if user:
-            request.session['user_id'] = user['id']
-            request.session['user_name'] = user['name']  
-            request.session['user_roles'] = user['roles']  
+            _start_session(request, user)
             if "Patient" in user['roles']:
                 patient_id = get_patient_id_by_user_id(user['id'])
                 if patient_id:
@@ -190,7 +434,7 @@ def login_view(request):
     return render(request, 'patients/login.html')
 
 def logout_view(request):
-    request.session.clear()  
+    request.session.flush()
     return redirect('login')
 
 def access_denied_view(request):
@@ -199,66 +443,137 @@ def access_denied_view(request):
 @login_required
 @role_required(['Doctor'])
 def age_risk_distribution_view(request):
-    # Step 1: Retrieve age and risk data from CosmosDB
-    data = get_age_risk_data()
+    # Step 1: Reduce patient ages and stroke risk to per-bucket counts
+    labels, total_counts, risk_counts_values = get_age_risk_histogram(
+        edges=settings.AGE_RISK_BUCKET_EDGES
+    )
     
-    # Step 2: Organize data into age groups and count stroke risk
-    age_groups = {
-        "0-18": 0,
-        "19-30": 0,
-        "31-40": 0,
-        "41-50": 0,
-        "51-60": 0,
-        "61+": 0
+    buckets = [
+        {"label": label, "total": total, "at_risk": risk}
+        for label, total, risk in zip(labels, total_counts, risk_counts_values)
+    ]
+    if request.GET.get("format") == "json":
+        return JsonResponse({"buckets": buckets})
+
+    context = {"buckets": buckets, "chart_mode": settings.AGE_RISK_CHART_MODE}
+
+    # Step 2: Either lay out an inline SVG, or cache the counts under their hash
+    # so age_risk_chart_view can serve a matplotlib PNG
+    if settings.AGE_RISK_CHART_MODE == "png":
+        context["chart_key"] = remember_chart_data(labels, total_counts, risk_counts_values)
+    else:
+        context["chart"] = svg_bars(labels, total_counts, risk_counts_values)
+
+    # Step 3: Pass the chart to the template
+    return render(request, 'patients/age_risk_distribution.html', context)
+
+@login_required
+@role_required(['Doctor'])
+@etag(lambda request, chart_key: f'"{chart_key}"')
+def age_risk_chart_view(request, chart_key):
+    png = get_chart_png(chart_key)
+    if png is None:
+        # Evicted or rendered by another worker: rebuild the counts and point at their current key
+        labels, total_counts, risk_counts_values = get_age_risk_histogram(
+            edges=settings.AGE_RISK_BUCKET_EDGES
+        )
+        key = remember_chart_data(labels, total_counts, risk_counts_values)
+        if key != chart_key:
+            return redirect('age_risk_chart', chart_key=key)
+        png = get_chart_png(key)
+
+    response = HttpResponse(png, content_type="image/png")
+    patch_cache_control(response, private=True, max_age=settings.CHART_CACHE_TTL)
+    return response
+
+RISK_DIMENSION_NAMES = {"age_bucket": "Age Group", "sex": "Sex", "ever_married": "Ever Married"}
+
+def _parse_risk_filters(params):
+    """Read the risk dashboard drill-down filters (``age_bucket``, ``sex``, ``ever_married``) from query parameters."""
+    return {dimension: params[dimension] for dimension in RISK_DIMENSIONS if params.get(dimension)}
+
+def _risk_dashboard_query(filters, disease, group_by):
+    return urlencode({**filters, **({"disease": disease} if disease else {}), "group_by": group_by})
+
+def _risk_dashboard_context(rollup, filters, disease, group_by):
+    """Rows with at-risk rates and the drill-down links for one rollup of the risk cube."""
+    unfiltered = [dimension for dimension in RISK_DIMENSIONS if dimension not in filters and dimension != group_by]
+
+    def rates(patients, at_risk):
+        return [{"count": count, "rate": 100 * count / patients if patients else 0} for count in at_risk]
+
+    rows = []
+    for group in rollup["groups"]:
+        drilled = {**filters, group_by: group["label"]}
+        rows.append({
+            "label": group["label"],
+            "patients": group["patients"],
+            "cells": rates(group["patients"], group["at_risk"]),
+            "drill_query": _risk_dashboard_query(drilled, disease, unfiltered[0]) if unfiltered else None,
+        })
+    return {
+        "rollup": rollup,
+        "rows": rows,
+        "totals": rates(rollup["patients"], rollup["at_risk"]),
+        "group_by": group_by,
+        "group_by_name": RISK_DIMENSION_NAMES[group_by],
+        "disease": disease,
+        "disease_links": [
+            {"name": name, "query": _risk_dashboard_query(filters, name, group_by)} for name in rollup["diseases"]
+        ],
+        "all_diseases_query": _risk_dashboard_query(filters, None, group_by),
+        "group_by_links": [
+            {"name": RISK_DIMENSION_NAMES[dimension], "query": _risk_dashboard_query(filters, disease, dimension)}
+            for dimension in RISK_DIMENSIONS if dimension not in filters and dimension != group_by
+        ],
+        "filter_links": [
+            {
+                "name": RISK_DIMENSION_NAMES[dimension],
+                "value": value,
+                "remove_query": _risk_dashboard_query(
+                    {other: v for other, v in filters.items() if other != dimension}, disease, dimension
+                ),
+            }
+            for dimension, value in filters.items()
+        ],
     }
-    risk_counts = defaultdict(int)
 
-    for entry in data:
-        age = entry["age"]
-        at_risk = entry["at_risk_for_stroke"]
-        
-        if age is not None:
-            if age <= 18:
-                group = "0-18"
-            elif age <= 30:
-                group = "19-30"
-            elif age <= 40:
-                group = "31-40"
-            elif age <= 50:
-                group = "41-50"
-            elif age <= 60:
-                group = "51-60"
-            else:
-                group = "61+"
-            
-            age_groups[group] += 1
-            if at_risk:
-                risk_counts[group] += 1
-
-    # Step 3: Prepare data for charting
-    labels = list(age_groups.keys())
-    total_counts = [age_groups[group] for group in labels]
-    risk_counts_values = [risk_counts[group] for group in labels]
-    
-    # Step 4: Generate the chart
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(labels, total_counts, label="Total Patients", color='skyblue')
-    ax.bar(labels, risk_counts_values, label="At Risk for Stroke", color='salmon')
-
-    ax.set_xlabel("Age Group")
-    ax.set_ylabel("Number of Patients")
-    ax.set_title("Age-Based Disease Risk Distribution")
-    ax.legend()
-
-    # Step 5: Save plot to a PNG image in memory, then encode to base64
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    buffer.close()
-
-    # Step 6: Pass the chart to the template
-    return render(request, 'patients/age_risk_distribution.html', {"chart": image_base64})
+@login_required
+@role_required(['Doctor'])
+def risk_dashboard_view(request):
+    """
+    Patients at risk of each disease, grouped by age group, sex or marital status,
+    with drill-down into any group. Served from the risk cube published by the
+    risk summary worker, so the cost doesn't grow with the number of patients.
+    """
+    filters = _parse_risk_filters(request.GET)
+    disease = request.GET.get("disease") or None
+    group_by = request.GET.get("group_by")
+    if group_by not in RISK_DIMENSIONS or group_by in filters:
+        group_by = next((dimension for dimension in RISK_DIMENSIONS if dimension not in filters), RISK_DIMENSIONS[-1])
+
+    rollup = get_risk_rollup(group_by, filters, disease, edges=settings.AGE_RISK_BUCKET_EDGES)
+    if request.GET.get("format") == "json":
+        if rollup is None:
+            return JsonResponse({"error": "The risk cube has not been built yet."}, status=503)
+        return JsonResponse(rollup)
+
+    if rollup is None:
+        return render(request, 'patients/risk_dashboard.html', {"rollup": None})
+    return render(request, 'patients/risk_dashboard.html', _risk_dashboard_context(rollup, filters, disease, group_by))
+
+def metrics_view(request):
+    # Counts cover this worker process only; Prometheus scrapes each worker separately
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if (
+        not settings.COSMOS_METRICS_TOKEN
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode(), settings.COSMOS_METRICS_TOKEN.encode())
+    ):
+        response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+        response["WWW-Authenticate"] = "Bearer"
+        return response
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 def custom_page_not_found_view(request, exception):
     return redirect('login')
\ No newline at end of file
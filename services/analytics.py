@@ -0,0 +1,73 @@
+import logging
+from datetime import date
+
+import numpy as np
+
+from services.cosmosdb_helper import RISK_DISEASE, get_age_risk_columns, get_age_risk_summary
+from services.patient_fields import DEFAULT_AGE_BUCKET_EDGES, age_bucket_labels
+
+logger = logging.getLogger(__name__)
+
+def birth_year_risk_histogram(birth_years, at_risk, edges=DEFAULT_AGE_BUCKET_EDGES, today=None):
+    """
+    Count patients and at-risk patients per age bucket with ``digitize``/``bincount``.
+
+    Ages are taken as the age reached in the current calendar year, as for the summary.
+
+    :param birth_years: Stored ``birth_year`` of each patient; missing values may be None.
+    :param at_risk: Booleans aligned with ``birth_years``.
+    :param edges: Ascending inclusive upper ages of every bucket but the last.
+    :param today: Reference date for age calculation.
+    :return: A tuple of (labels, total_counts, risk_counts).
+    """
+    edges = np.asarray(sorted(edges))
+    bucket_count = len(edges) + 1
+
+    years = np.array([-1 if year is None else year for year in birth_years], dtype=np.int64)
+    valid = years >= 0
+    risk = np.asarray(at_risk, dtype=bool)[valid]
+    buckets = np.digitize((today or date.today()).year - years[valid], edges, right=True)
+
+    totals = np.bincount(buckets, minlength=bucket_count)
+    risk_counts = np.bincount(buckets, weights=risk, minlength=bucket_count).astype(np.int64)
+
+    return age_bucket_labels(edges.tolist()), totals.tolist(), risk_counts.tolist()
+
+def summary_age_risk_histogram(summary, edges=DEFAULT_AGE_BUCKET_EDGES, today=None):
+    """
+    Bucket the per-birth-year counters of a materialized summary document.
+
+    Ages are taken as the age reached in the current calendar year, since the
+    summary only keeps birth years.
+
+    :param summary: Summary document with a ``birth_years`` mapping of year to totals.
+    :return: A tuple of (labels, total_counts, risk_counts).
+    """
+    edges = np.asarray(sorted(edges))
+    bucket_count = len(edges) + 1
+    birth_years = summary.get("birth_years", {})
+
+    years = np.fromiter((int(year) for year in birth_years), dtype=np.int64, count=len(birth_years))
+    totals = np.fromiter((entry["total"] for entry in birth_years.values()), dtype=np.int64, count=len(birth_years))
+    risk = np.fromiter((entry["at_risk"] for entry in birth_years.values()), dtype=np.int64, count=len(birth_years))
+
+    buckets = np.digitize((today or date.today()).year - years, edges, right=True)
+    total_counts = np.bincount(buckets, weights=totals, minlength=bucket_count).astype(np.int64)
+    risk_counts = np.bincount(buckets, weights=risk, minlength=bucket_count).astype(np.int64)
+
+    return age_bucket_labels(edges.tolist()), total_counts.tolist(), risk_counts.tolist()
+
+def get_age_risk_histogram(edges=DEFAULT_AGE_BUCKET_EDGES, disease=RISK_DISEASE):
+    """
+    Return per-bucket counts, preferring the materialized summary over a full patient scan.
+
+    :return: A tuple of (labels, total_counts, risk_counts).
+    """
+    summary = get_age_risk_summary()
+    if summary and summary.get("disease") == disease:
+        logger.info(f"Bucketing age/risk summary updated at {summary.get('updated_at')}")
+        return summary_age_risk_histogram(summary, edges=edges)
+
+    birth_years, at_risk = get_age_risk_columns(disease)
+    logger.info(f"Bucketing {len(birth_years)} patients into {len(edges) + 1} age groups")
+    return birth_year_risk_histogram(birth_years, at_risk, edges=edges)
@@ -1,113 +1,200 @@
+import base64
+import json
 import os
+import threading
+import time
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
 API_BASE_URL = os.getenv("BLOCKCHAIN_API_BASE_URL")
+# Connections kept open to the blockchain API per client
+POOL_MAXSIZE = int(os.getenv("BLOCKCHAIN_API_POOL_MAXSIZE", "10"))
+REQUEST_TIMEOUT = float(os.getenv("BLOCKCHAIN_API_TIMEOUT", "30"))
+# Used when neither the login response nor the token itself says when it expires
+DEFAULT_TOKEN_TTL = 300
+# Refresh this many seconds before the token actually expires
+TOKEN_EXPIRY_MARGIN = 30
 
-def authenticate():
-    username = os.getenv("BLOCKCHAIN_API_USERNAME")
-    password = os.getenv("BLOCKCHAIN_API_PASSWORD")
-    
-    if not username or not password:
-        logger.error("Blockchain API username or password not set in environment variables.")
-        return None
-
-    auth_url = f"{API_BASE_URL}/auth/login"
-    auth_payload = {
-        "username": username,
-        "password": password
-    }
-    
+def _jwt_expiry(token):
+    """Read the ``exp`` claim of a JWT without verifying it, or None if it can't be decoded."""
     try:
-        response = requests.post(auth_url, json=auth_payload)
-        
-        if response.status_code == 200:
-            access_token = response.json().get("access_token")
-            if access_token:
-                logger.info("Authentication successful. Access token retrieved.")
-                return access_token
-            else:
-                logger.error("Authentication response did not contain an access token.")
-                return None
-        else:
-            logger.error("Authentication failed. Status code: %s", response.status_code)
-            return None
-    except requests.RequestException as e:
-        logger.error("An error occurred during authentication: %s", e)
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
         return None
 
-import os
-import requests
-import logging
+class BlockchainClient:
+    """
+    Client for the blockchain API that reuses pooled connections and caches the
+    access token until shortly before it expires. Safe to share between threads.
+    """
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+    def __init__(self, base_url=None, username=None, password=None, pool_maxsize=POOL_MAXSIZE, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url or API_BASE_URL
+        self.username = username or os.getenv("BLOCKCHAIN_API_USERNAME")
+        self.password = password or os.getenv("BLOCKCHAIN_API_PASSWORD")
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
 
-# Base API URL from environment variable
-API_BASE_URL = os.getenv("BLOCKCHAIN_API_BASE_URL")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-def authenticate():
-    username = os.getenv("BLOCKCHAIN_API_USERNAME")
-    password = os.getenv("BLOCKCHAIN_API_PASSWORD")
-    
-    if not username or not password:
-        logger.error("Blockchain API username or password not set in environment variables.")
-        return None
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
 
-    auth_url = f"{API_BASE_URL}/auth/login"
-    auth_payload = {
-        "username": username,
-        "password": password
-    }
-    
-    try:
-        response = requests.post(auth_url, json=auth_payload)
-        
-        if response.status_code == 200:
-            access_token = response.json().get("access_token")
-            if access_token:
-                logger.info("Authentication successful. Access token retrieved.")
-                return access_token
+    def authenticate(self):
+        """Log in to the blockchain API and return a fresh access token, or None on failure."""
+        return self._login()[0]
+
+    def _login(self):
+        """Log in to the blockchain API and return (access_token, expires_at), or (None, 0) on failure."""
+        if not self.username or not self.password:
+            logger.error("Blockchain API username or password not set in environment variables.")
+            return None, 0.0
+
+        auth_url = f"{self.base_url}/auth/login"
+        auth_payload = {
+            "username": self.username,
+            "password": self.password
+        }
+
+        try:
+            response = self.session.post(auth_url, json=auth_payload, timeout=self.timeout)
+
+            if response.status_code == 200:
+                body = response.json()
+                access_token = body.get("access_token")
+                if access_token:
+                    logger.info("Authentication successful. Access token retrieved.")
+                    return access_token, self._expiry_for(access_token, body)
+                else:
+                    logger.error("Authentication response did not contain an access token.")
+                    return None, 0.0
             else:
-                logger.error("Authentication response did not contain an access token.")
-                return None
-        else:
-            logger.error("Authentication failed. Status code: %s", response.status_code)
-            return None
-    except requests.RequestException as e:
-        logger.error("An error occurred during authentication: %s", e)
-        return None
+                logger.error("Authentication failed. Status code: %s", response.status_code)
+                return None, 0.0
+        except requests.RequestException as e:
+            logger.error("An error occurred during authentication: %s", e)
+            return None, 0.0
 
-def create_medical_record(patient_id, record_type, **data):
-    access_token = authenticate()
-    if not access_token:
-        logger.error("Could not retrieve access token. Medical record creation aborted.")
-        return False
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    record_payload = {
-        "patient_id": patient_id,
-        "type": record_type,
-        **data  
-    }
-    
-    try:
-        create_url = f"{API_BASE_URL}/blocks"
-        response = requests.post(create_url, json=record_payload, headers=headers)
-        
-        if response.status_code == 200:
-            logger.info("Medical record created successfully on the blockchain.")
-            return True
-        else:
-            logger.error("Failed to create medical record. Status code: %s, Response: %s", response.status_code, response.json())
+    @staticmethod
+    def _expiry_for(token, login_response):
+        expires_in = login_response.get("expires_in")
+        if expires_in:
+            return time.time() + float(expires_in)
+        return _jwt_expiry(token) or time.time() + DEFAULT_TOKEN_TTL
+
+    def get_access_token(self, rejected_token=None):
+        """
+        Return the cached access token, logging in again if it is missing, about to
+        expire, or is the ``rejected_token`` the API just answered 401 for.
+        """
+        with self._token_lock:
+            still_valid = self._token_expires_at - TOKEN_EXPIRY_MARGIN > time.time()
+            if self._token and still_valid and self._token != rejected_token:
+                return self._token
+
+            self._token, self._token_expires_at = self._login()
+            return self._token
+
+    def _post_block(self, record_payload, access_token, idempotency_key=None):
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        if idempotency_key:
+            headers["Idempotency-Key"] = str(idempotency_key)
+        return self.session.post(f"{self.base_url}/blocks", json=record_payload, headers=headers, timeout=self.timeout)
+
+    def create_medical_record(self, patient_id, record_type, idempotency_key=None, **data):
+        """
+        Write a medical record block. Retries once with a new token if the cached one is rejected.
+
+        :param idempotency_key: Sent as the ``Idempotency-Key`` header so a retried write isn't recorded twice.
+
+        :return: True if the block was created.
+        """
+        access_token = self.get_access_token()
+        if not access_token:
+            logger.error("Could not retrieve access token. Medical record creation aborted.")
+            return False
+
+        record_payload = {
+            "patient_id": patient_id,
+            "type": record_type,
+            **data
+        }
+
+        try:
+            response = self._post_block(record_payload, access_token, idempotency_key)
+
+            if response.status_code == 401:
+                logger.info("Blockchain API rejected the cached access token. Re-authenticating.")
+                access_token = self.get_access_token(rejected_token=access_token)
+                if not access_token:
+                    logger.error("Could not retrieve access token. Medical record creation aborted.")
+                    return False
+                response = self._post_block(record_payload, access_token, idempotency_key)
+
+            if response.status_code == 200:
+                logger.info("Medical record created successfully on the blockchain.")
+                return True
+            else:
+                logger.error("Failed to create medical record. Status code: %s, Response: %s", response.status_code, response.text)
+                return False
+        except requests.RequestException as e:
+            logger.error("An error occurred while creating the medical record: %s", e)
             return False
-    except requests.RequestException as e:
-        logger.error("An error occurred while creating the medical record: %s", e)
-        return False
+
+    def create_medical_records(self, records, max_workers=None):
+        """
+        Write many medical record blocks concurrently over the pooled connections.
+
+        :param records: Iterable of (patient_id, record_type, data, idempotency_key) tuples.
+        :param max_workers: Concurrent requests; defaults to the connection pool size.
+        :return: A list of booleans aligned with ``records``.
+        """
+        records = list(records)
+        if not records:
+            return []
+        if not self.get_access_token():
+            logger.error("Could not retrieve access token. Bulk medical record creation aborted.")
+            return [False] * len(records)
+
+        workers = min(max_workers or self.pool_maxsize, len(records))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blockchain-writer") as executor:
+            results = list(executor.map(
+                lambda record: self.create_medical_record(record[0], record[1], idempotency_key=record[3], **record[2]),
+                records
+            ))
+        logger.info("Bulk submission finished: %s of %s medical records created.", sum(results), len(records))
+        return results
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide blockchain client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BlockchainClient()
+    return _client
+
+def authenticate():
+    return get_client().authenticate()
+
+def create_medical_record(patient_id, record_type, idempotency_key=None, **data):
+    return get_client().create_medical_record(patient_id, record_type, idempotency_key=idempotency_key, **data)
+
+def create_medical_records(records, max_workers=None):
+    return get_client().create_medical_records(records, max_workers=max_workers)
@@ -0,0 +1,121 @@
+import hashlib
+import io
+import json
+import logging
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+CHART_CACHE_ALIAS = "charts"
+
+def chart_key(labels, total_counts, risk_counts):
+    """
+    Hash the bucket counts so identical data always maps to the same cached chart.
+    """
+    payload = json.dumps([labels, total_counts, risk_counts], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def render_age_risk_chart(labels, total_counts, risk_counts):
+    """
+    Render the age/risk bar chart to PNG bytes.
+
+    Uses a standalone ``Figure`` rather than pyplot so no figure is registered
+    globally; the figure is cleared as soon as the PNG is written. Matplotlib is
+    imported here so workers that never render a PNG never load it.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    try:
+        ax = fig.subplots()
+        ax.bar(labels, total_counts, label="Total Patients", color='skyblue')
+        ax.bar(labels, risk_counts, label="At Risk for Stroke", color='salmon')
+
+        ax.set_xlabel("Age Group")
+        ax.set_ylabel("Number of Patients")
+        ax.set_title("Age-Based Disease Risk Distribution")
+        ax.legend()
+
+        with io.BytesIO() as buffer:
+            fig.savefig(buffer, format='png')
+            return buffer.getvalue()
+    finally:
+        fig.clear()
+
+def svg_bars(labels, total_counts, risk_counts, width=1000, height=600, padding=60):
+    """
+    Lay out the age/risk bar chart for inline SVG rendering.
+
+    :return: A dict with the plot geometry, y-axis ticks and one bar entry per bucket.
+    """
+    plot_width = width - 2 * padding
+    plot_height = height - 2 * padding
+    # Round the axis up to a multiple of four so every gridline lands on a whole number
+    peak = -(-max(total_counts + risk_counts + [1]) // 4) * 4
+    slot = plot_width / max(len(labels), 1)
+    bar_width = slot * 0.8
+    baseline = padding + plot_height
+
+    def scale(value):
+        return round(value / peak * plot_height, 1)
+
+    bars = []
+    for index, (label, total, risk) in enumerate(zip(labels, total_counts, risk_counts)):
+        x = round(padding + index * slot + (slot - bar_width) / 2, 1)
+        bars.append({
+            "label": label,
+            "total": total,
+            "risk": risk,
+            "x": x,
+            "center": round(x + bar_width / 2, 1),
+            "width": round(bar_width, 1),
+            "total_y": round(baseline - scale(total), 1),
+            "total_height": scale(total),
+            "risk_y": round(baseline - scale(risk), 1),
+            "risk_height": scale(risk),
+        })
+
+    ticks = [{"value": peak * step // 4, "y": round(baseline - plot_height * step / 4, 1)} for step in range(5)]
+
+    return {
+        "width": width,
+        "height": height,
+        "padding": padding,
+        "right": width - padding,
+        "center": width / 2,
+        "baseline": baseline,
+        "label_y": baseline + 20,
+        "ticks": ticks,
+        "bars": bars,
+    }
+
+def remember_chart_data(labels, total_counts, risk_counts):
+    """
+    Store the bucket counts under their hash so the chart URL can render them later.
+
+    :return: The chart key.
+    """
+    key = chart_key(labels, total_counts, risk_counts)
+    caches[CHART_CACHE_ALIAS].set(f"data:{key}", (labels, total_counts, risk_counts))
+    return key
+
+def get_chart_png(key):
+    """
+    Return the cached PNG for a chart key, rendering it from cached counts on a miss.
+
+    :return: PNG bytes, or None if neither the PNG nor its counts are cached.
+    """
+    cache = caches[CHART_CACHE_ALIAS]
+    png = cache.get(f"png:{key}")
+    if png is not None:
+        return png
+
+    data = cache.get(f"data:{key}")
+    if data is None:
+        return None
+
+    logger.info(f"Rendering age/risk chart {key}")
+    png = render_age_risk_chart(*data)
+    cache.set(f"png:{key}", png)
+    return png
@@ -0,0 +1,287 @@
+"""
+Cosmos DB call instrumentation.
+
+When ``settings.COSMOS_METRICS`` is on, ``instrument`` wraps a container client
+so every point operation and query records its operation, container, latency,
+request charge (from the ``x-ms-request-charge`` response header) and item count.
+Calls feed process-wide Prometheus histograms, and the calls made while
+serving a request are collected in ``RequestMetrics`` for
+``CosmosMetricsMiddleware``. When disabled, ``instrument`` returns the
+container unchanged, so there is no per-call overhead.
+"""
+
+import contextvars
+import threading
+import time
+from django.conf import settings
+from services.cosmos_query import ChargeCounter
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_CHARGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by label values."""
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = _format_labels(self.label_names, label_values)
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_format_labels(self.label_names, label_values)}}} {value}")
+        return lines
+
+def _format_labels(names, values):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+operation_duration = Histogram(
+    "cosmos_operation_duration_seconds", "Latency of Cosmos DB calls.", ("container", "operation"), LATENCY_BUCKETS
+)
+operation_request_charge = Histogram(
+    "cosmos_operation_request_charge", "Request units charged per Cosmos DB call.", ("container", "operation"), REQUEST_CHARGE_BUCKETS
+)
+operation_items = Counter("cosmos_operation_items_total", "Documents returned by Cosmos DB calls.", ("container", "operation"))
+request_duration = Histogram(
+    "cosmos_request_duration_seconds", "Time spent in Cosmos DB calls per HTTP request.", ("view",), LATENCY_BUCKETS
+)
+request_charge = Histogram(
+    "cosmos_request_charge", "Request units charged per HTTP request.", ("view",), REQUEST_CHARGE_BUCKETS
+)
+request_calls = Histogram(
+    "cosmos_request_calls", "Cosmos DB calls per HTTP request.", ("view",), (0, 1, 2, 4, 8, 16, 32, 64)
+)
+REGISTRY = (operation_duration, operation_request_charge, operation_items, request_duration, request_charge, request_calls)
+
+def render_metrics():
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class RequestMetrics:
+    """Cosmos DB calls made while serving one request, grouped by container and operation."""
+
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def add(self, container, operation, seconds, charge, items):
+        with self._lock:
+            totals = self.operations.setdefault(
+                (container, operation), {"calls": 0, "seconds": 0.0, "request_charge": 0.0, "items": 0}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            totals["request_charge"] += charge
+            totals["items"] += items
+
+    def totals(self):
+        with self._lock:
+            operations = list(self.operations.values())
+        return {
+            "calls": sum(totals["calls"] for totals in operations),
+            "seconds": sum(totals["seconds"] for totals in operations),
+            "request_charge": sum(totals["request_charge"] for totals in operations),
+            "items": sum(totals["items"] for totals in operations),
+        }
+
+_current_request = contextvars.ContextVar("cosmos_request_metrics", default=None)
+
+def begin_request():
+    """Start collecting calls for the current request; pass the token to ``end_request``."""
+    metrics = RequestMetrics()
+    return metrics, _current_request.set(metrics)
+
+def end_request(token):
+    _current_request.reset(token)
+
+def observe_request(view, metrics):
+    totals = metrics.totals()
+    request_duration.observe((view,), totals["seconds"])
+    request_charge.observe((view,), totals["request_charge"])
+    request_calls.observe((view,), totals["calls"])
+    return totals
+
+def record_call(container, operation, seconds, charge, items):
+    operation_duration.observe((container, operation), seconds)
+    operation_request_charge.observe((container, operation), charge)
+    operation_items.inc((container, operation), items)
+    metrics = _current_request.get()
+    if metrics is not None:
+        metrics.add(container, operation, seconds, charge, items)
+
+def _charge_hook(kwargs, started=True):
+    """Install a ``response_hook`` that counts request charge, keeping any hook the caller passed."""
+    counter = ChargeCounter(started)
+    caller_hook = kwargs.get("response_hook")
+
+    def hook(headers, result):
+        counter(headers, result)
+        if caller_hook is not None:
+            caller_hook(headers, result)
+
+    kwargs["response_hook"] = hook
+    return counter
+
+class InstrumentedContainer:
+    """Container client wrapper that records every call; other attributes pass through."""
+
+    def __init__(self, container, name):
+        self._container = container
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self._container, attribute)
+
+    def _point(self, operation, method, args, kwargs):
+        counter = _charge_hook(kwargs)
+        started = time.perf_counter()
+        items = 0
+        try:
+            result = method(*args, **kwargs)
+            items = 0 if result is None else 1
+            return result
+        finally:
+            record_call(self._name, operation, time.perf_counter() - started, counter.request_charge, items)
+
+    def read_item(self, *args, **kwargs):
+        return self._point("read", self._container.read_item, args, kwargs)
+
+    def create_item(self, *args, **kwargs):
+        return self._point("create", self._container.create_item, args, kwargs)
+
+    def upsert_item(self, *args, **kwargs):
+        return self._point("upsert", self._container.upsert_item, args, kwargs)
+
+    def replace_item(self, *args, **kwargs):
+        return self._point("replace", self._container.replace_item, args, kwargs)
+
+    def patch_item(self, *args, **kwargs):
+        return self._point("patch", self._container.patch_item, args, kwargs)
+
+    def delete_item(self, *args, **kwargs):
+        return self._point("delete", self._container.delete_item, args, kwargs)
+
+    def query_items(self, *args, **kwargs):
+        counter = _charge_hook(kwargs, started=False)
+        started = time.perf_counter()
+        results = self._container.query_items(*args, **kwargs)
+        counter.start()
+        return self._timed_results(results, counter, started)
+
+    def _timed_results(self, results, counter, started):
+        items = 0
+        try:
+            for item in results:
+                items += 1
+                yield item
+        finally:
+            record_call(self._name, "query", time.perf_counter() - started, counter.request_charge, items)
+
+class AsyncInstrumentedContainer(InstrumentedContainer):
+    """``InstrumentedContainer`` for ``azure.cosmos.aio`` container clients."""
+
+    async def _apoint(self, operation, method, args, kwargs):
+        counter = _charge_hook(kwargs)
+        started = time.perf_counter()
+        items = 0
+        try:
+            result = await method(*args, **kwargs)
+            items = 0 if result is None else 1
+            return result
+        finally:
+            record_call(self._name, operation, time.perf_counter() - started, counter.request_charge, items)
+
+    async def read_item(self, *args, **kwargs):
+        return await self._apoint("read", self._container.read_item, args, kwargs)
+
+    async def create_item(self, *args, **kwargs):
+        return await self._apoint("create", self._container.create_item, args, kwargs)
+
+    async def upsert_item(self, *args, **kwargs):
+        return await self._apoint("upsert", self._container.upsert_item, args, kwargs)
+
+    async def replace_item(self, *args, **kwargs):
+        return await self._apoint("replace", self._container.replace_item, args, kwargs)
+
+    async def patch_item(self, *args, **kwargs):
+        return await self._apoint("patch", self._container.patch_item, args, kwargs)
+
+    async def delete_item(self, *args, **kwargs):
+        return await self._apoint("delete", self._container.delete_item, args, kwargs)
+
+    async def _timed_results(self, results, counter, started):
+        items = 0
+        try:
+            async for item in results:
+                items += 1
+                yield item
+        finally:
+            record_call(self._name, "query", time.perf_counter() - started, counter.request_charge, items)
+
+def instrument(container, name):
+    """Wrap a sync container client when metrics are enabled; otherwise return it as is."""
+    return InstrumentedContainer(container, name) if settings.COSMOS_METRICS else container
+
+def instrument_async(container, name):
+    """Wrap an ``azure.cosmos.aio`` container client when metrics are enabled; otherwise return it as is."""
+    return AsyncInstrumentedContainer(container, name) if settings.COSMOS_METRICS else container
+
+def server_timing(metrics):
+    """Build a ``Server-Timing`` header value: a ``cosmos`` total plus one entry per container and operation."""
+    totals = metrics.totals()
+    entries = [
+        f'cosmos;dur={totals["seconds"] * 1000:.1f};desc="{totals["calls"]} calls, {totals["request_charge"]:.2f} RU"'
+    ]
+    with metrics._lock:
+        operations = sorted(metrics.operations.items())
+    for (container, operation), values in operations:
+        entries.append(
+            f'cosmos.{container}.{operation};dur={values["seconds"] * 1000:.1f};'
+            f'desc="{values["calls"]} calls, {values["request_charge"]:.2f} RU"'
+        )
+    return ", ".join(entries)
@@ -0,0 +1,127 @@
+"""
+Query layer for Cosmos DB that fetches only the fields a caller asks for and
+records what every query and point read cost.
+
+Each call is recorded under a label with its request charge (the
+``x-ms-request-charge`` header summed over result pages) and payload size
+(the compact JSON size of the returned items). ``query_stats()`` returns the
+totals per label.
+"""
+
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+REQUEST_CHARGE_HEADER = "x-ms-request-charge"
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def projection(fields):
+    """
+    Build the ``SELECT`` list for ``fields``, or ``*`` when no fields are given.
+
+    :param fields: Top-level document property names.
+    :raises ValueError: If a field name isn't a plain identifier.
+    """
+    if not fields:
+        return "*"
+    for field in fields:
+        if not FIELD_PATTERN.match(field):
+            raise ValueError(f"Invalid field name for projection: {field!r}")
+    return ", ".join(f"c.{field}" for field in dict.fromkeys(fields))
+
+def with_id(fields):
+    """Add ``id`` to a field list, keeping ``None`` (all fields) as is."""
+    if not fields:
+        return fields
+    return ("id", *(field for field in fields if field != "id"))
+
+class ChargeCounter:
+    """
+    ``response_hook`` that adds up the request charge over every page of a response.
+
+    ``query_items`` calls its hook once before sending any request, with the
+    headers of whatever call last used the client's connection. Counters for
+    queries are made with ``started=False`` and ``start()``-ed once
+    ``query_items`` returns, so only the pages of the query itself are counted.
+    """
+
+    def __init__(self, started=True):
+        self.request_charge = 0.0
+        self.started = started
+
+    def start(self):
+        self.started = True
+
+    def __call__(self, headers, _result):
+        if not self.started:
+            return
+        try:
+            self.request_charge += float(headers.get(REQUEST_CHARGE_HEADER, 0))
+        except (TypeError, ValueError):
+            pass
+
+def payload_bytes(items):
+    return len(json.dumps(items, separators=(",", ":"), default=str).encode())
+
+def record(label, request_charge, items):
+    """Record one call under ``label`` and log its cost."""
+    size = payload_bytes(items)
+    count = len(items) if isinstance(items, list) else int(items is not None)
+    with _stats_lock:
+        stats = _stats.setdefault(label, {"calls": 0, "items": 0, "request_charge": 0.0, "bytes": 0})
+        stats["calls"] += 1
+        stats["items"] += count
+        stats["request_charge"] += request_charge
+        stats["bytes"] += size
+    logger.info(f"{label}: {count} items, {request_charge:.2f} RU, {size} bytes")
+
+def query_stats():
+    """Return a copy of the per-label totals."""
+    with _stats_lock:
+        return {label: dict(stats) for label, stats in _stats.items()}
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def query(container, label, query_text, parameters=None, **kwargs):
+    """Run a query to completion and record its cost."""
+    charge = ChargeCounter(started=False)
+    results = container.query_items(query=query_text, parameters=parameters, response_hook=charge, **kwargs)
+    charge.start()
+    items = list(results)
+    record(label, charge.request_charge, items)
+    return items
+
+def read(container, label, item_id, partition_key=None):
+    """Point-read a document and record its cost. Point reads always return the whole document."""
+    charge = ChargeCounter()
+    item = container.read_item(
+        item=item_id, partition_key=item_id if partition_key is None else partition_key, response_hook=charge
+    )
+    record(label, charge.request_charge, item)
+    return item
+
+async def aquery(container, label, query_text, parameters=None, **kwargs):
+    """Async counterpart of ``query`` for ``azure.cosmos.aio`` containers."""
+    charge = ChargeCounter(started=False)
+    results = container.query_items(query=query_text, parameters=parameters, response_hook=charge, **kwargs)
+    charge.start()
+    items = [item async for item in results]
+    record(label, charge.request_charge, items)
+    return items
+
+async def aread(container, label, item_id, partition_key=None):
+    """Async counterpart of ``read`` for ``azure.cosmos.aio`` containers."""
+    charge = ChargeCounter()
+    item = await container.read_item(
+        item=item_id, partition_key=item_id if partition_key is None else partition_key, response_hook=charge
+    )
+    record(label, charge.request_charge, item)
+    return item
@@ -1,16 +1,26 @@
-from datetime import datetime
+import base64
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 import os
 import logging
+import threading
+import time
 import uuid
+from urllib.parse import quote
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, exceptions
-from passlib.context import CryptContext
+from services import cosmos_query, patient_cache
+from services.cosmos_metrics import instrument
+from services.cosmos_query import projection, with_id
+from services.patient_fields import DEFAULT_AGE_BUCKET_EDGES, age_bucket, patient_derived_fields
+from services.passwords import PasswordHasherBusy, hash_password, verify_password
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # Configuration
 CONNECTION_STRING = os.getenv("COSMOS_CONNECTION_STRING")
 DATABASE_NAME = "medical-records"
@@ -18,42 +28,435 @@ PATIENTS_CONTAINER_NAME = "patients"
 MEDICAL_RECORDS_CONTAINER_NAME = "medical_records"
 USERS_CONTAINER_NAME = "users"
 HEALTH_NOTIFICATIONS_CONTAINER_NAME = "health_notifications"
+ANALYTICS_CONTAINER_NAME = "analytics"
+# Point-read lookup documents (email -> user ID, user ID -> patient ID), partitioned by /id
+LOOKUPS_CONTAINER_NAME = "lookups"
+SESSIONS_CONTAINER_NAME = "sessions"
+AGE_RISK_SUMMARY_ID = "age_risk_summary"
+RISK_CUBE_ID = "risk_cube"
+# Threads shared by all requests for running independent Cosmos calls concurrently
+FANOUT_MAX_WORKERS = int(os.getenv("COSMOS_FANOUT_MAX_WORKERS", "8"))
+# User fields needed to check a password and start a session
+LOGIN_USER_FIELDS = ("id", "name", "email", "roles", "password_hash")
+# Disease whose health notifications mark a patient as at risk
+RISK_DISEASE = "Stroke"
+# Patient fields a doctor edits; the rest (e.g. at_risk) are left to the workers that own them
+PATIENT_EDITABLE_FIELDS = ("name", "date_of_birth", "sex", "ever_married")
+
+# Containers whose change feeds the background workers follow
+CHANGE_FEED_CONTAINER_NAMES = (
+    PATIENTS_CONTAINER_NAME,
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME,
+    MEDICAL_RECORDS_CONTAINER_NAME,
+    USERS_CONTAINER_NAME,
+)
+
+# The client, its containers and the fan-out pool are created on first use and
+# belong to the process that created them; a forked worker builds its own.
+_client = None
+_containers = {}
+_fanout_executor = None
+_owner_pid = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return this process's Cosmos DB client, creating it on first use."""
+    global _client, _containers, _fanout_executor, _owner_pid
+    if _owner_pid != os.getpid():
+        with _client_lock:
+            if _owner_pid != os.getpid():
+                logger.info("Initializing Cosmos DB client.")
+                _client = CosmosClient.from_connection_string(CONNECTION_STRING)
+                _containers = {}
+                _fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="cosmos-fanout")
+                _owner_pid = os.getpid()
+    return _client
+
+def get_container(name):
+    client = get_client()
+    container = _containers.get(name)
+    if container is None:
+        container = instrument(client.get_database_client(DATABASE_NAME).get_container_client(name), name)
+        _containers[name] = container
+    return container
 
-# Initialize Cosmos DB client and containers
-logger.info("Initializing Cosmos DB client and containers.")
-client = CosmosClient.from_connection_string(CONNECTION_STRING)
-database = client.get_database_client(DATABASE_NAME)
-patients_container = database.get_container_client(PATIENTS_CONTAINER_NAME)
-medical_records_container = database.get_container_client(MEDICAL_RECORDS_CONTAINER_NAME)
-users_container = database.get_container_client(USERS_CONTAINER_NAME)
-health_notifications_container = database.get_container_client(HEALTH_NOTIFICATIONS_CONTAINER_NAME)
-session_container = database.get_container_client("sessions")
+def get_fanout_executor():
+    get_client()
+    return _fanout_executor
 
-def get_patients_page(page_size=10, page=1):
-    logger.info(f"Fetching page {page} of patients, page size: {page_size}")
+def warm_up():
+    """
+    Create the client and open a connection by reading the database properties,
+    so a new worker's first request doesn't pay for it. Failures, including an
+    unreachable account or a bad connection string, are logged and not raised,
+    so the worker still starts.
+    """
+    started = time.perf_counter()
     try:
-        query = "SELECT * FROM c"
-        
-        results = patients_container.query_items(
-            query=query,
+        get_client().get_database_client(DATABASE_NAME).read()
+        logger.info(f"Cosmos DB connection warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        logger.error(f"Error warming up the Cosmos DB connection: {e}")
+
+def patients_page_query(page_size, after_id=None, before_id=None, fields=None):
+    """
+    Build the keyset query for a page of patients sorted by ID.
+
+    Each page is a single ``TOP`` query seeded from the last (or first) ID of the
+    neighbouring page, so the cost stays flat no matter how deep the page is.
+    One extra row is requested as a sentinel to tell whether the page has a
+    neighbour in the direction of travel.
+
+    :return: A tuple of (query, parameters).
+    """
+    select = projection(with_id(fields))
+    parameters = [{"name": "@limit", "value": page_size + 1}]
+    if before_id:
+        query = f"SELECT TOP @limit {select} FROM c WHERE c.id < @cursor ORDER BY c.id DESC"
+        parameters.append({"name": "@cursor", "value": before_id})
+    elif after_id:
+        query = f"SELECT TOP @limit {select} FROM c WHERE c.id > @cursor ORDER BY c.id ASC"
+        parameters.append({"name": "@cursor", "value": after_id})
+    else:
+        query = f"SELECT TOP @limit {select} FROM c ORDER BY c.id ASC"
+    return query, parameters
+
+def patients_page(patients, page_size, after_id=None, before_id=None):
+    """
+    Trim the sentinel patient off a page and put it in ID order.
+
+    :return: A tuple of (patients, has_previous, has_more).
+    """
+    has_neighbour = len(patients) > page_size
+    patients = patients[:page_size]
+    if before_id:
+        patients.reverse()
+        return patients, has_neighbour, True
+    return patients, after_id is not None, has_neighbour
+
+def get_patients_page_by_cursor(page_size=10, after_id=None, before_id=None, fields=None):
+    """
+    Fetch a page of patients using keyset pagination over the patient ID.
+
+    :param page_size: Number of patients per page.
+    :param after_id: Return the page that follows this patient ID.
+    :param before_id: Return the page that precedes this patient ID.
+    :param fields: Patient fields to fetch (``id`` is always included); all fields if omitted.
+    :return: A tuple of (patients, has_previous, has_more).
+    """
+    logger.info(f"Fetching patients page after: {after_id}, before: {before_id}, page size: {page_size}")
+    try:
+        query, parameters = patients_page_query(page_size, after_id, before_id, fields)
+        patients = cosmos_query.query(
+            get_container(PATIENTS_CONTAINER_NAME),
+            "patients.page",
+            query,
+            parameters,
             enable_cross_partition_query=True,
-            max_item_count=page * page_size
+            max_item_count=page_size + 1
         )
-        
-        patients = list(results)[(page - 1) * page_size: page * page_size]
-        
-        has_more = len(patients) == page_size
-        logger.info(f"Retrieved {len(patients)} patients for page {page}, has_more: {has_more}")
+        patients, has_previous, has_more = patients_page(patients, page_size, after_id, before_id)
+        logger.info(f"Retrieved {len(patients)} patients, has_previous: {has_previous}, has_more: {has_more}")
+
+        return patients, has_previous, has_more
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error querying patients page after {after_id}, before {before_id}: {e}")
+        return [], False, False
+
+def _timed(label, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        logger.info(f"{label} took {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def _read_patient(patient_id):
+    return cosmos_query.read(get_container(PATIENTS_CONTAINER_NAME), "patients.read", patient_id)
+
+def _read_user(user_id):
+    return cosmos_query.read(get_container(USERS_CONTAINER_NAME), "users.read", user_id)
+
+def _encode_cursor(sort_key, item_id):
+    payload = json.dumps([sort_key, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor, description):
+    try:
+        sort_key, item_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid {description} cursor: {cursor!r}") from e
+    if not isinstance(sort_key, str) or not isinstance(item_id, str):
+        raise ValueError(f"Invalid {description} cursor: {cursor!r}")
+    return sort_key, item_id
+
+def encode_record_cursor(record):
+    """Opaque cursor for the medical records that come after ``record`` in the history."""
+    return _encode_cursor(record["created_date_utc"], record["id"])
+
+def decode_record_cursor(cursor):
+    """
+    :raises ValueError: If the cursor wasn't made by ``encode_record_cursor``.
+    :return: A tuple of (created_date_utc, id).
+    """
+    return _decode_cursor(cursor, "medical records")
+
+def encode_patient_search_cursor(patient):
+    """Opaque cursor for the patient search results that come after ``patient``."""
+    return _encode_cursor(patient["name_lower"], patient["id"])
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        # 29 February in a year that doesn't have one
+        return day.replace(year=day.year - years, day=28)
+
+def birth_date_bounds(age_min=None, age_max=None, today=None):
+    """
+    Turn an age range in whole years into ``date_of_birth`` bounds.
+
+    :return: A tuple of (born_from, born_before) ISO dates; patients in the range were
+        born on or after ``born_from`` and before ``born_before``. Either is None when unbounded.
+    """
+    today = today or date.today()
+    born_from = (_years_before(today, age_max + 1) + timedelta(days=1)).isoformat() if age_max is not None else None
+    born_before = (_years_before(today, age_min) + timedelta(days=1)).isoformat() if age_min is not None else None
+    return born_from, born_before
+
+def patient_search_query(fields=None, limit=None, cursor=None, patient_id=None, name_prefix=None, sex=None, age_min=None, age_max=None, at_risk=False):
+    """
+    Build a patient search query, sorted by lowercase name and ID.
+
+    Pages are seeded from the (name_lower, id) of the previous page's last
+    patient. Name prefixes are matched as a range on ``name_lower`` so the range
+    index answers them; sorting on both fields needs a composite index on
+    (name_lower ASC, id ASC), plus (sex ASC, name_lower ASC, id ASC) for the sex filter.
+
+    :param limit: Patients to fetch; all matching patients if omitted.
+    :param cursor: ``next_cursor`` of the previous page.
+    :param patient_id: Only match this patient (an email search resolved to its patient).
+    :param name_prefix: Only match names starting with this text, ignoring case.
+    :param sex: Only match this sex.
+    :param age_min: Only match patients at least this old.
+    :param age_max: Only match patients at most this old.
+    :param at_risk: Only match patients flagged at risk of ``RISK_DISEASE``.
+    :raises ValueError: If the cursor is invalid.
+    :return: A tuple of (query, parameters).
+    """
+    if fields:
+        fields = (*with_id(fields), *(() if "name_lower" in fields else ("name_lower",)))
+    conditions, parameters = [], []
+    if patient_id:
+        conditions.append("c.id = @patient_id")
+        parameters.append({"name": "@patient_id", "value": patient_id})
+    if name_prefix:
+        prefix = name_prefix.strip().lower()
+        conditions.append("c.name_lower >= @name_from AND c.name_lower < @name_to")
+        parameters.append({"name": "@name_from", "value": prefix})
+        parameters.append({"name": "@name_to", "value": prefix + "\uffff"})
+    if sex:
+        conditions.append("c.sex = @sex")
+        parameters.append({"name": "@sex", "value": sex})
+    born_from, born_before = birth_date_bounds(age_min, age_max)
+    if born_from:
+        conditions.append("c.date_of_birth >= @born_from")
+        parameters.append({"name": "@born_from", "value": born_from})
+    if born_before:
+        conditions.append("c.date_of_birth < @born_before")
+        parameters.append({"name": "@born_before", "value": born_before})
+    if at_risk:
+        conditions.append("c.at_risk[@disease] = true")
+        parameters.append({"name": "@disease", "value": RISK_DISEASE})
+    if cursor:
+        cursor_name, cursor_id = _decode_cursor(cursor, "patient search")
+        conditions.append("(c.name_lower > @cursor_name OR (c.name_lower = @cursor_name AND c.id > @cursor_id))")
+        parameters.append({"name": "@cursor_name", "value": cursor_name})
+        parameters.append({"name": "@cursor_id", "value": cursor_id})
+
+    top = ""
+    if limit:
+        top = "TOP @limit "
+        parameters.append({"name": "@limit", "value": limit})
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT {top}{projection(fields)} FROM c{where} ORDER BY c.name_lower ASC, c.id ASC"
+    return query, parameters
+
+def patient_search_page(patients, page_size):
+    """
+    Trim a search result to one page.
+
+    :return: A dict with the page's ``patients`` and the ``next_cursor`` to pass
+        back for the following page, or None if this is the last one.
+    """
+    if len(patients) <= page_size:
+        return {"patients": patients, "next_cursor": None}
+    patients = patients[:page_size]
+    return {"patients": patients, "next_cursor": encode_patient_search_cursor(patients[-1])}
+
+def _search_patients(page_size, cursor=None, fields=None, email=None, **filters):
+    patient_id = None
+    if email:
+        user = get_user_by_email(email, fields=("id", "email"))
+        patient_id = get_patient_id_by_user_id(user["id"]) if user else None
+        if not patient_id:
+            return patient_search_page([], page_size)
+
+    query, parameters = patient_search_query(fields, page_size + 1, cursor, patient_id, **filters)
+    patients = cosmos_query.query(
+        get_container(PATIENTS_CONTAINER_NAME),
+        "patients.search",
+        query,
+        parameters,
+        enable_cross_partition_query=True,
+        max_item_count=page_size + 1
+    )
+    return patient_search_page(patients, page_size)
+
+def search_patients(page_size=10, cursor=None, fields=None, **filters):
+    """
+    Find patients by name prefix, email, sex, age range and at-risk status, sorted by name.
+
+    Only patients with the derived fields are found; ``manage.py
+    backfill_patient_fields`` adds them to patients created before they existed.
+
+    :param filters: ``name_prefix``, ``sex``, ``age_min`` and ``age_max`` as for
+        ``patient_search_query``, ``email`` for an exact email match, and
+        ``at_risk`` to only return patients flagged at risk of a stroke.
+    :raises ValueError: If the cursor is invalid.
+    :return: A page dict as returned by ``patient_search_page``; an empty page if a query fails.
+    """
+    logger.info(f"Searching patients: {filters}, cursor: {cursor}, page size: {page_size}")
+    try:
+        return _search_patients(page_size, cursor, fields, **filters)
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error searching patients with {filters}: {e}")
+        return patient_search_page([], page_size)
+
+def medical_records_query(patient_id, fields=None, page_size=None, cursor=None, record_type=None, date_from=None, date_to=None):
+    """
+    Build the query for a patient's medical record history, newest first.
+
+    Pages are seeded from the (created_date_utc, id) of the previous page's last
+    record rather than a continuation token, which the SDK doesn't return for
+    cross-partition ``ORDER BY`` queries. Ordering by both fields needs a
+    composite index on (created_date_utc DESC, id DESC).
+
+    :param page_size: Records per page; one extra is requested to tell whether another page follows.
+        All matching records if omitted.
+    :param cursor: ``next_cursor`` of the previous page.
+    :param record_type: Only return records of this type.
+    :param date_from: Only return records created on or after this date.
+    :param date_to: Only return records created on or before this date.
+    :raises ValueError: If the cursor is invalid.
+    :return: A tuple of (query, parameters).
+    """
+    if fields:
+        fields = (*with_id(fields), *(() if "created_date_utc" in fields else ("created_date_utc",)))
+    conditions = ["c.patient_id = @patient_id"]
+    parameters = [{"name": "@patient_id", "value": patient_id}]
+    if record_type:
+        conditions.append("c.type = @record_type")
+        parameters.append({"name": "@record_type", "value": record_type})
+    if date_from:
+        conditions.append("c.created_date_utc >= @date_from")
+        parameters.append({"name": "@date_from", "value": date_from.isoformat()})
+    if date_to:
+        conditions.append("c.created_date_utc < @date_to")
+        parameters.append({"name": "@date_to", "value": (date_to + timedelta(days=1)).isoformat()})
+    if cursor:
+        cursor_date, cursor_id = decode_record_cursor(cursor)
+        conditions.append("(c.created_date_utc < @cursor_date OR (c.created_date_utc = @cursor_date AND c.id < @cursor_id))")
+        parameters.append({"name": "@cursor_date", "value": cursor_date})
+        parameters.append({"name": "@cursor_id", "value": cursor_id})
+
+    top = ""
+    if page_size:
+        top = "TOP @limit "
+        parameters.append({"name": "@limit", "value": page_size + 1})
+    query = (
+        f"SELECT {top}{projection(fields)} FROM c WHERE {' AND '.join(conditions)} "
+        "ORDER BY c.created_date_utc DESC, c.id DESC"
+    )
+    return query, parameters
+
+def medical_records_page(records, page_size=None):
+    """
+    Trim the sentinel record off a page.
+
+    :return: A dict with the page's ``records`` and the ``next_cursor`` to pass
+        back for the following page, or None if this is the last one.
+    """
+    if not page_size or len(records) <= page_size:
+        return {"records": records, "next_cursor": None}
+    records = records[:page_size]
+    return {"records": records, "next_cursor": encode_record_cursor(records[-1])}
+
+def _query_medical_records(patient_id, page_size=None, cursor=None, fields=None, **filters):
+    query, parameters = medical_records_query(patient_id, fields, page_size, cursor, **filters)
+    records = cosmos_query.query(
+        get_container(MEDICAL_RECORDS_CONTAINER_NAME),
+        "medical_records.by_patient",
+        query,
+        parameters,
+        enable_cross_partition_query=True,
+        max_item_count=page_size + 1 if page_size else None
+    )
+    return medical_records_page(records, page_size)
+
+def get_medical_records_page(patient_id, page_size=None, cursor=None, fields=None, **filters):
+    """
+    Fetch one page of a patient's medical record history, newest first.
 
-        return patients, has_more
+    :param filters: ``record_type``, ``date_from`` and ``date_to``, as for ``medical_records_query``.
+    :raises ValueError: If the cursor is invalid.
+    :return: A page dict as returned by ``medical_records_page``; an empty page if the query fails.
+    """
+    try:
+        return _query_medical_records(patient_id, page_size, cursor, fields, **filters)
     except exceptions.CosmosHttpResponseError as e:
-        logger.error(f"Error querying patients for page {page}: {e}")
-        return [], False
+        logger.error(f"Error querying medical records page for patient ID {patient_id}: {e}")
+        return {"records": [], "next_cursor": None}
+
+def _query_health_notifications(user_id, fields=None):
+    user_params = [{"name": "@user_id", "value": user_id}]
+    health_notifications_query = f"SELECT {projection(fields)} FROM c WHERE c.patient_id = @user_id"
+    return cosmos_query.query(
+        get_container(HEALTH_NOTIFICATIONS_CONTAINER_NAME),
+        "health_notifications.by_user",
+        health_notifications_query,
+        user_params,
+        enable_cross_partition_query=True
+    )
+
+def get_patient_details(patient_id, record_fields=None, notification_fields=None, record_page_size=None, record_filters=None):
+    """
+    Fetch a patient with their user, first page of medical records and health notifications.
+
+    The patient read and the medical records query start together; the user read
+    and the notifications query follow as soon as the patient's ``user_id`` is
+    known, so the page waits for about two round trips instead of four.
 
-def get_patient_details(patient_id):
+    :param record_fields: Medical record fields to fetch; all fields if omitted.
+    :param notification_fields: Health notification fields to fetch; all fields if omitted.
+    :param record_page_size: Medical records to fetch, newest first; all of them if omitted.
+    :param record_filters: ``record_type``, ``date_from`` and ``date_to`` filters for the medical records.
+    :return: A tuple of (patient, user, medical_records_page, health_notifications), where
+        ``medical_records_page`` is a dict as returned by ``medical_records_page``.
+    """
     logger.info(f"Fetching details for patient ID: {patient_id}")
     try:
-        patient = patients_container.read_item(item=patient_id, partition_key=patient_id)
+        # Run in a copy of this context so the fan-out calls count toward the request's Cosmos metrics.
+        medical_records_future = get_fanout_executor().submit(
+            contextvars.copy_context().run,
+            _timed,
+            f"medical_records query for patient {patient_id}",
+            _query_medical_records,
+            patient_id,
+            record_page_size,
+            fields=record_fields,
+            **(record_filters or {}),
+        )
+        patient = _timed(f"patient read {patient_id}", _read_patient, patient_id)
         
         if not patient:
             logger.error(f"No patient found with patient ID: {patient_id}")
@@ -64,33 +467,24 @@ def get_patient_details(patient_id):
         user_id = patient.get("user_id")
         
         if user_id:
-            user = users_container.read_item(item=user_id, partition_key=user_id)
+            user_future = get_fanout_executor().submit(
+                contextvars.copy_context().run, _timed, f"user read {user_id}", _read_user, user_id
+            )
+            health_notifications = _timed(
+                f"health_notifications query for user {user_id}", _query_health_notifications, user_id, notification_fields
+            )
+            user = user_future.result()
             if user:
                 logger.info(f"User associated with patient ID {patient_id}: {user.get('email')}")
             else:
                 logger.warning(f"No user found for user ID associated with patient ID: {patient_id}")
         else:
             user = None
+            health_notifications = []
             logger.warning(f"No user ID associated with patient ID: {patient_id}")
 
-        patient_params = [{"name": "@patient_id", "value": patient_id}]
-        medical_records_query = "SELECT * FROM c WHERE c.patient_id = @patient_id ORDER BY c.created_date_utc ASC"
-        medical_records_results = medical_records_container.query_items(
-            query=medical_records_query,
-            parameters=patient_params,
-            enable_cross_partition_query=True
-        )
-        medical_records = list(medical_records_results)
-        logger.info(f"Found {len(medical_records)} medical records for patient ID: {patient_id}")
-
-        user_params = [{"name": "@user_id", "value": user_id}]
-        health_notifications_query = "SELECT * FROM c WHERE c.patient_id = @user_id"
-        health_notifications_results = health_notifications_container.query_items(
-            query=health_notifications_query,
-            parameters=user_params,
-            enable_cross_partition_query=True
-        )
-        health_notifications = list(health_notifications_results)
+        medical_records = medical_records_future.result()
+        logger.info(f"Found {len(medical_records['records'])} medical records for patient ID: {patient_id}")
         logger.info(f"Found {len(health_notifications)} health notifications for patient ID: {patient_id}")
 
         return patient, user, medical_records, health_notifications
@@ -98,10 +492,70 @@ def get_patient_details(patient_id):
         logger.error(f"Error querying Cosmos DB for patient ID {patient_id}: {e}")
         return None, None, None, None
     
-def create_user_and_patient(name, email, password, date_of_birth, sex, ever_married):
-    user_id = str(uuid.uuid4())
-    password_hash = pwd_context.hash(password) 
-    
+def email_lookup_id(email):
+    # Cosmos DB item IDs can't contain '/', '\\', '?' or '#'
+    return "email:" + quote(email, safe="@")
+
+def user_lookup_id(user_id):
+    return f"user:{user_id}"
+
+def patient_details_variant(record_fields=None, notification_fields=None, record_page_size=None):
+    return tuple(record_fields or ()), tuple(notification_fields or ()), record_page_size
+
+def get_cached_patient_details(patient_id, record_fields=None, notification_fields=None, record_page_size=None, record_filters=None):
+    """
+    ``get_patient_details`` through the patient details cache. Failed or empty
+    lookups, and filtered medical record histories, are not cached.
+    """
+    if record_filters and any(record_filters.values()):
+        return get_patient_details(patient_id, record_fields, notification_fields, record_page_size, record_filters)
+
+    variant = patient_details_variant(record_fields, notification_fields, record_page_size)
+    details = patient_cache.get_details(patient_id, variant)
+    if details is not None:
+        logger.info(f"Serving cached details for patient ID: {patient_id}")
+        return details
+
+    details = get_patient_details(patient_id, record_fields, notification_fields, record_page_size)
+    if details[0]:
+        patient_cache.set_details(patient_id, details, variant)
+    return details
+
+def _read_lookup(lookup_id):
+    try:
+        return cosmos_query.read(get_container(LOOKUPS_CONTAINER_NAME), "lookups.read", lookup_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+def _delete_lookup(lookup_id):
+    try:
+        get_container(LOOKUPS_CONTAINER_NAME).delete_item(item=lookup_id, partition_key=lookup_id)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+
+def save_email_lookup(email, user_id):
+    get_container(LOOKUPS_CONTAINER_NAME).upsert_item({"id": email_lookup_id(email), "type": "email", "user_id": user_id})
+
+def claim_email(email, user_id):
+    """
+    Create the lookup from ``email`` to ``user_id`` unless another user already has the email.
+
+    :return: True if the email now belongs to ``user_id``, False if it belongs to another user.
+    """
+    lookup_id = email_lookup_id(email)
+    try:
+        get_container(LOOKUPS_CONTAINER_NAME).create_item(body={"id": lookup_id, "type": "email", "user_id": user_id})
+        return True
+    except exceptions.CosmosResourceExistsError:
+        lookup = _read_lookup(lookup_id)
+        return bool(lookup) and lookup.get("user_id") == user_id
+
+def save_user_lookup(user_id, patient_id):
+    get_container(LOOKUPS_CONTAINER_NAME).upsert_item({"id": user_lookup_id(user_id), "type": "user", "patient_id": patient_id})
+
+def new_user_and_patient(name, email, password_hash, date_of_birth, sex, ever_married, user_id=None, patient_id=None):
+    """Build the user and patient documents for a new patient account; IDs default to fresh UUIDs."""
+    user_id = user_id or str(uuid.uuid4())
     user = {
         "id": user_id,
         "name": name,
@@ -110,47 +564,196 @@ def create_user_and_patient(name, email, password, date_of_birth, sex, ever_marr
         "roles": ["Patient"],
         "validator_id": ""
     }
-    
-    try:
-        users_container.create_item(body=user)
-        logger.info(f"User created with ID: {user_id}")
-    except exceptions.CosmosHttpResponseError as e:
-        logger.error(f"Failed to create user: {e}")
-        return False
-
-    patient_id = str(uuid.uuid4())
     patient = {
-        "id": patient_id,
+        "id": patient_id or str(uuid.uuid4()),
         "name": name,
         "date_of_birth": date_of_birth,
         "sex": sex,
         "ever_married": bool(ever_married),
         "user_id": user_id,
+        **patient_derived_fields(name, date_of_birth),
+        "at_risk": {},
     }
-    
+    return user, patient
+
+def _create_or_match(container_name, document, field):
+    """
+    Create ``document``; an existing document with its ID is accepted if ``field`` matches.
+
+    :raises exceptions.CosmosResourceExistsError: If a document with other ``field`` has the ID.
+    """
+    container = get_container(container_name)
     try:
-        patients_container.create_item(body=patient)
-        logger.info(f"Patient created with ID: {patient_id}, linked to user ID: {user_id}")
-        return True
+        container.create_item(body=document)
+    except exceptions.CosmosResourceExistsError:
+        existing = container.read_item(item=document["id"], partition_key=document["id"])
+        if existing.get(field) != document[field]:
+            raise
+
+def save_user_and_patient(user, patient):
+    """
+    Write a new user and its patient, claiming the user's email first.
+
+    A failed write deletes the documents written before it, so no user is left
+    without a patient. Documents are created, never overwritten: an email
+    already claimed by this same user ID, and a user or patient already saved
+    for this email (an interrupted import being run again), are taken as ours.
+
+    :return: None on success, otherwise the reason the account wasn't created.
+    """
+    email, user_id = user["email"], user["id"]
+    lookup_id = email_lookup_id(email)
+
+    # Claiming the email lookup first also rejects a second account for the same email
+    try:
+        if not claim_email(email, user_id):
+            logger.error(f"Failed to create user: email {email} is already registered.")
+            return f"Email {email} is already registered."
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to create email lookup: {e}")
+        return "Could not claim the email address."
+
+    try:
+        _create_or_match(USERS_CONTAINER_NAME, user, "email")
+        logger.info(f"User created with ID: {user_id}")
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to create user: {e}")
+        _delete_lookup(lookup_id)
+        return "Could not save the user."
+
+    try:
+        _create_or_match(PATIENTS_CONTAINER_NAME, patient, "user_id")
+        logger.info(f"Patient created with ID: {patient['id']}, linked to user ID: {user_id}")
     except exceptions.CosmosHttpResponseError as e:
         logger.error(f"Failed to create patient: {e}")
+        _delete_user_and_lookup(user_id, lookup_id)
+        return "Could not save the patient."
+
+    try:
+        save_user_lookup(user_id, patient["id"])
+    except exceptions.CosmosHttpResponseError as e:
+        # Patients are still found by user ID through a query without it
+        logger.error(f"Failed to save user lookup for user ID {user_id}: {e}")
+    return None
+
+def _delete_user_and_lookup(user_id, lookup_id):
+    try:
+        get_container(USERS_CONTAINER_NAME).delete_item(item=user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+    except exceptions.CosmosHttpResponseError as e:
+        # Keep the email claimed so the orphaned user can't be duplicated; it is logged for cleanup
+        logger.error(f"Failed to delete orphaned user {user_id}: {e}")
+        return
+    _delete_lookup(lookup_id)
+
+def create_user_and_patient(name, email, password, date_of_birth, sex, ever_married):
+    try:
+        password_hash = hash_password(password)
+    except PasswordHasherBusy:
+        logger.error("Failed to create user: password hashing is saturated.")
         return False
-    
+
+    user, patient = new_user_and_patient(name, email, password_hash, date_of_birth, sex, ever_married)
+    return save_user_and_patient(user, patient) is None
+
+def get_user_by_email(email, fields=None):
+    """
+    Fetch the user with the given email through its lookup document (two point reads),
+    falling back to a cross-partition query for users that haven't been backfilled.
+
+    :param fields: User fields the fallback query fetches; point reads return the whole user.
+    """
+    lookup = _read_lookup(email_lookup_id(email))
+    if lookup:
+        try:
+            user = _read_user(lookup["user_id"])
+            if user.get("email") == email:
+                return user
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+        logger.warning(f"Stale email lookup for {email}; falling back to a query.")
+
+    query = f"SELECT {projection(fields)} FROM c WHERE c.email = @email"
+    params = [{"name": "@email", "value": email}]
+
+    results = cosmos_query.query(
+        get_container(USERS_CONTAINER_NAME),
+        "users.by_email",
+        query,
+        params,
+        enable_cross_partition_query=True
+    )
+    return results[0] if results else None
+
+def patch_patient_fields(patient_id, fields):
+    """
+    Set ``fields`` on the patient document, leaving concurrent edits to other fields intact.
+
+    :return: True if the patient was updated.
+    """
+    try:
+        get_container(PATIENTS_CONTAINER_NAME).patch_item(
+            item=patient_id,
+            partition_key=patient_id,
+            patch_operations=[{"op": "set", "path": f"/{name}", "value": value} for name, value in fields.items()]
+        )
+        return True
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to update fields {list(fields)} of patient ID {patient_id}: {e}")
+        return False
+
+def set_patient_at_risk(user_id, disease):
+    """
+    Flag the user's patient as at risk of ``disease`` when a health notification arrives.
+    Setting the flag again is harmless, so replayed notifications need no check.
+
+    :return: True if a patient was flagged.
+    """
+    patient_id = get_patient_id_by_user_id(user_id)
+    if not patient_id:
+        logger.warning(f"No patient for user ID {user_id}; not flagging risk of {disease}.")
+        return False
+    # JSON Pointer escaping, for disease names containing "~" or "/"
+    key = disease.replace("~", "~0").replace("/", "~1")
+    try:
+        get_container(PATIENTS_CONTAINER_NAME).patch_item(
+            item=patient_id,
+            partition_key=patient_id,
+            patch_operations=[{"op": "set", "path": f"/at_risk/{key}", "value": True}]
+        )
+        logger.info(f"Flagged patient {patient_id} at risk of {disease}")
+        return True
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to flag patient {patient_id} at risk of {disease}: {e}")
+        return False
+
+def update_password_hash(user_id, password_hash):
+    """Replace only the user's password hash, leaving concurrent edits to other fields intact."""
+    try:
+        get_container(USERS_CONTAINER_NAME).patch_item(
+            item=user_id,
+            partition_key=user_id,
+            patch_operations=[{"op": "set", "path": "/password_hash", "value": password_hash}]
+        )
+        logger.info(f"Rehashed password for user ID: {user_id}")
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to rehash password for user ID {user_id}: {e}")
+
 def verify_user(email, password):
-    """Verify user credentials by matching email and bcrypt-hashed password."""
+    """
+    Verify user credentials by matching email and bcrypt-hashed password. Hashes made
+    with outdated settings are replaced on a successful login.
+
+    :raises PasswordHasherBusy: If too many password checks are already in progress.
+    """
     try:
-        query = "SELECT * FROM c WHERE c.email = @email"
-        params = [{"name": "@email", "value": email}]
-        
-        results = list(users_container.query_items(
-            query=query,
-            parameters=params,
-            enable_cross_partition_query=True
-        ))
-        
-        if results:
-            user = results[0]
-            if pwd_context.verify(password, user['password_hash']):
+        user = get_user_by_email(email, fields=LOGIN_USER_FIELDS)
+        if user:
+            valid, new_hash = verify_password(password, user['password_hash'])
+            if valid:
+                if new_hash:
+                    update_password_hash(user['id'], new_hash)
                 return user
         return None
     except exceptions.CosmosHttpResponseError as e:
@@ -158,89 +761,264 @@ def verify_user(email, password):
         return None
 
 def get_session_data(session_id):
+    session = get_session_item(session_id)
+    return session.get("data", {}) if session else {}
+
+def get_session_item(session_id):
+    """Return the whole session document, including its ``_etag``, or None if it doesn't exist."""
     try:
-        session = session_container.read_item(item=session_id, partition_key=session_id)
-        return session.get("data", {})
+        return get_container(SESSIONS_CONTAINER_NAME).read_item(item=session_id, partition_key=session_id)
     except exceptions.CosmosResourceNotFoundError:
-        return {}
+        return None
 
-def save_session_data(session_id, data):
+def read_session_if_changed(session_id, etag):
+    """
+    Read the session document only if it no longer has ``etag``. An unchanged
+    session costs a 304 response without a body instead of a full read.
+
+    :return: A tuple of (changed, session); ``session`` is None when it is
+        unchanged or no longer exists.
+    """
+    try:
+        session = get_container(SESSIONS_CONTAINER_NAME).read_item(
+            item=session_id, partition_key=session_id, etag=etag, match_condition=MatchConditions.IfModified
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        return True, None
+    # A 304 comes back as an empty result
+    return session is not None, session
+
+def session_item(session_id, data, ttl=None):
+    """Build the session document; a ``ttl`` makes it expire with the session."""
     session_item = {
         "id": session_id,
         "data": data
     }
-    session_container.upsert_item(session_item)
+    if ttl:
+        # Requires time-to-live to be enabled on the sessions container
+        session_item["ttl"] = int(ttl)
+    return session_item
+
+def save_session_data(session_id, data, ttl=None, etag=None):
+    """
+    Store the session and return the written document.
+
+    :param etag: Only overwrite the session if it still exists with this etag.
+    :raises exceptions.CosmosAccessConditionFailedError: If ``etag`` no longer matches.
+    :raises exceptions.CosmosResourceNotFoundError: If ``etag`` is given and the session was deleted.
+    """
+    if etag:
+        return get_container(SESSIONS_CONTAINER_NAME).replace_item(
+            session_id, session_item(session_id, data, ttl), etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+    return get_container(SESSIONS_CONTAINER_NAME).upsert_item(session_item(session_id, data, ttl))
+
+def create_session_data(session_id, data, ttl=None):
+    """
+    Store a new session, failing if the ID is already taken.
+
+    :raises exceptions.CosmosResourceExistsError: If a session with this ID exists.
+    """
+    return get_container(SESSIONS_CONTAINER_NAME).create_item(body=session_item(session_id, data, ttl))
+
+def session_exists(session_id):
+    try:
+        get_container(SESSIONS_CONTAINER_NAME).read_item(item=session_id, partition_key=session_id)
+        return True
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+
+def delete_session_data(session_id):
+    try:
+        get_container(SESSIONS_CONTAINER_NAME).delete_item(item=session_id, partition_key=session_id)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
 
 def get_patient_id_by_user_id(user_id):
     """
     Fetch the patient ID associated with the given user ID.
     """
     try:
-        query = "SELECT * FROM c WHERE c.user_id = @user_id"
+        lookup = _read_lookup(user_lookup_id(user_id))
+        if lookup:
+            return lookup["patient_id"]
+
+        query = "SELECT VALUE c.id FROM c WHERE c.user_id = @user_id"
         parameters = [{"name": "@user_id", "value": user_id}]
-        results = list(patients_container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
+        results = cosmos_query.query(get_container(PATIENTS_CONTAINER_NAME), "patients.id_by_user", query, parameters, enable_cross_partition_query=True)
 
         if results:
-            return results[0]['id']
+            return results[0]
     except Exception as e:
         logger.error(f"Error retrieving patient ID for user ID {user_id}: {e}")
     
     return None
 
 def update_patient_data(patient_id, patient_data, user_data):
+    """
+    Save an edited patient and its user.
+
+    A changed email is claimed before anything is written and rejected if it
+    belongs to another user; the previous email is only released once the user
+    has been saved with the new one. Only the editable patient fields, and those
+    derived from them, are patched, so ``at_risk`` flags set meanwhile are kept.
+
+    :return: None on success, otherwise the reason the update failed.
+    """
+    user_id = patient_data.get("user_id")
     try:
-        user_id = patient_data["user_id"]
-        users_container.replace_item(item=user_id, body=user_data)
+        previous_email = get_container(USERS_CONTAINER_NAME).read_item(item=user_id, partition_key=user_id).get("email")
+        email = user_data.get("email")
+        email_changed = bool(email) and email != previous_email
+        if email_changed and not claim_email(email, user_id):
+            logger.error(f"Failed to update user {user_id}: email {email} is already registered.")
+            return f"Email {email} is already registered."
+
+        try:
+            get_container(USERS_CONTAINER_NAME).replace_item(item=user_id, body=user_data)
+        except exceptions.CosmosHttpResponseError:
+            if email_changed:
+                _delete_lookup(email_lookup_id(email))
+            raise
         logger.info(f"User {user_id} updated successfully.")
+        if email_changed and previous_email:
+            _delete_lookup(email_lookup_id(previous_email))
 
-        patients_container.replace_item(item=patient_id, body=patient_data)
+        fields = {name: patient_data[name] for name in PATIENT_EDITABLE_FIELDS if name in patient_data}
+        fields.update(patient_derived_fields(patient_data.get("name"), patient_data.get("date_of_birth")))
+        if not patch_patient_fields(patient_id, fields):
+            return "Failed to update patient. Please try again."
         logger.info(f"Patient {patient_id} updated successfully.")
+        save_user_lookup(user_id, patient_id)
+        patient_cache.invalidate(patient_id)
 
-        return True
+        return None
     except Exception as e:
         logger.error(f"Error updating patient {patient_id} and user {user_id}: {e}")
-        return False
+        return "Failed to update patient. Please try again."
 
-def get_age_risk_data():
+def get_age_risk_data(disease=RISK_DISEASE, edges=DEFAULT_AGE_BUCKET_EDGES):
     """
     Retrieve patient data and their risk of stroke for analysis.
 
-    :return: A list of dictionaries containing patient id, age, and stroke risk status.
+    Reads the stored ``birth_year`` and ``at_risk`` fields in a single scan of
+    the patients; age buckets are computed from ``birth_year`` for ``edges``.
+
+    :return: A list of dictionaries containing patient id, age, age bucket, and stroke risk status.
     """
     try:
-        result = []
-        
-        patients_query = "SELECT c.id, c.date_of_birth, c.user_id FROM c"
-        patients = list(patients_container.query_items(
-            query=patients_query, enable_cross_partition_query=True
-        ))
-        
-        for patient in patients:
-            dob = patient.get("date_of_birth")
-            if dob:
-                birth_date = datetime.fromisoformat(dob).date()
-                age = (datetime.now().date() - birth_date).days // 365
-            else:
-                age = None  
-            
-            stroke_notification_query = """
-                SELECT * FROM c WHERE c.patient_id = @user_id AND c.disease = 'Stroke'
-            """
-            params = [{"name": "@user_id", "value": patient["user_id"]}]
-            notifications = list(health_notifications_container.query_items(
-                query=stroke_notification_query, parameters=params, enable_cross_partition_query=True
-            ))
-            
-            at_risk_for_stroke = bool(notifications)
-            
-            result.append({
+        patients = get_container(PATIENTS_CONTAINER_NAME).query_items(
+            query="SELECT c.id, c.birth_year, c.at_risk FROM c", enable_cross_partition_query=True
+        )
+
+        this_year = date.today().year
+        return [
+            {
                 "patient_id": patient["id"],
-                "age": age,
-                "at_risk_for_stroke": at_risk_for_stroke
-            })
-        
-        return result
-    
+                "age": this_year - patient["birth_year"] if patient.get("birth_year") is not None else None,
+                "age_bucket": age_bucket(patient.get("birth_year"), edges),
+                "at_risk_for_stroke": bool((patient.get("at_risk") or {}).get(disease)),
+            }
+            for patient in patients
+        ]
     except Exception as e:
         logger.error(f"Error retrieving age and risk data: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def get_age_risk_columns(disease=RISK_DISEASE):
+    """
+    Retrieve the columns needed for the age/risk histogram without building per-patient records.
+
+    :param disease: Disease that marks a patient as at risk.
+    :return: A tuple of (birth_years, at_risk) lists, aligned by patient.
+    """
+    try:
+        patients = get_container(PATIENTS_CONTAINER_NAME).query_items(
+            query="SELECT c.birth_year, c.at_risk FROM c", enable_cross_partition_query=True
+        )
+
+        birth_years, at_risk = [], []
+        for patient in patients:
+            birth_years.append(patient.get("birth_year"))
+            at_risk.append(bool((patient.get("at_risk") or {}).get(disease)))
+
+        return birth_years, at_risk
+    except Exception as e:
+        logger.error(f"Error retrieving age and risk columns: {e}")
+        return [], []
+
+def get_change_feed_range_ids(container_name):
+    """
+    List the partition key range IDs of a container so each range's change feed can be checkpointed separately.
+    """
+    container = get_container(container_name)
+    # azure-cosmos 4.7.0 has no public way to list partition key ranges (read_feed_ranges
+    # came in 4.8.0), so this uses the client's internal reader; requirements.txt pins 4.7.0.
+    ranges = container.client_connection._ReadPartitionKeyRanges(container.container_link)
+    return [partition_key_range["id"] for partition_key_range in ranges]
+
+def read_change_feed(container_name, partition_key_range_id, continuation=None, max_item_count=100, start_time=None):
+    """
+    Read the change feed of one partition key range page by page.
+
+    :param container_name: Name of a container in ``CHANGE_FEED_CONTAINER_NAMES``.
+    :param partition_key_range_id: Partition key range to read.
+    :param continuation: Continuation (etag) saved from a previous read, or None to start from the beginning.
+    :param max_item_count: Maximum number of changed documents per page.
+    :param start_time: Without a continuation, read changes made after this datetime instead of from the beginning.
+    :return: A generator of (documents, continuation) tuples, one per page.
+    """
+    container = get_container(container_name)
+    options = {"start_time": start_time} if continuation is None and start_time else {}
+    # The client's last_response_headers are shared with every other thread using it,
+    # so each page's continuation is taken from the headers passed to this feed's hook.
+    headers = {}
+    feed = container.query_items_change_feed(
+        partition_key_range_id=partition_key_range_id,
+        is_start_from_beginning=continuation is None and start_time is None,
+        continuation=continuation,
+        max_item_count=max_item_count,
+        response_hook=lambda response_headers, _result: headers.update(etag=response_headers.get("etag")),
+        **options
+    )
+    for page in feed.by_page():
+        documents = list(page)
+        yield documents, headers.get("etag")
+
+def get_age_risk_summary():
+    """
+    Read the materialized age/risk summary maintained by the risk summary worker.
+
+    :return: The summary document, or None if it has not been built yet.
+    """
+    try:
+        return get_container(ANALYTICS_CONTAINER_NAME).read_item(item=AGE_RISK_SUMMARY_ID, partition_key=AGE_RISK_SUMMARY_ID)
+    except exceptions.CosmosResourceNotFoundError:
+        logger.warning("Age/risk summary document not found.")
+        return None
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error reading age/risk summary: {e}")
+        return None
+
+def save_age_risk_summary(summary):
+    summary["id"] = AGE_RISK_SUMMARY_ID
+    get_container(ANALYTICS_CONTAINER_NAME).upsert_item(summary)
+
+def get_risk_cube():
+    """
+    Read the risk cube maintained by the risk summary worker.
+
+    :return: The cube document, or None if it has not been built yet.
+    """
+    try:
+        return get_container(ANALYTICS_CONTAINER_NAME).read_item(item=RISK_CUBE_ID, partition_key=RISK_CUBE_ID)
+    except exceptions.CosmosResourceNotFoundError:
+        logger.warning("Risk cube document not found.")
+        return None
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error reading risk cube: {e}")
+        return None
+
+def save_risk_cube(cube):
+    cube["id"] = RISK_CUBE_ID
+    get_container(ANALYTICS_CONTAINER_NAME).upsert_item(cube)
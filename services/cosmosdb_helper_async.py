@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import weakref
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from azure.cosmos.aio import CosmosClient
+from services import cosmos_query, patient_cache
+from services.cosmos_metrics import instrument_async
+from services.cosmos_query import projection
+from services.cosmosdb_helper import (
+    CONNECTION_STRING,
+    DATABASE_NAME,
+    HEALTH_NOTIFICATIONS_CONTAINER_NAME,
+    LOGIN_USER_FIELDS,
+    LOOKUPS_CONTAINER_NAME,
+    MEDICAL_RECORDS_CONTAINER_NAME,
+    PATIENTS_CONTAINER_NAME,
+    SESSIONS_CONTAINER_NAME,
+    USERS_CONTAINER_NAME,
+    email_lookup_id,
+    medical_records_page,
+    medical_records_query,
+    patient_details_variant,
+    patient_search_page,
+    patient_search_query,
+    patients_page,
+    patients_page_query,
+    session_item,
+    user_lookup_id,
+)
+from services.passwords import hasher
+
+logger = logging.getLogger(__name__)
+
+# One client per event loop: aio clients hold an aiohttp session bound to the loop that created them.
+_clients = weakref.WeakKeyDictionary()
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        logger.info("Initializing async Cosmos DB client for event loop.")
+        client = CosmosClient.from_connection_string(CONNECTION_STRING)
+        _clients[loop] = client
+    return client
+
+def get_container(name):
+    return instrument_async(get_client().get_database_client(DATABASE_NAME).get_container_client(name), name)
+
+async def close_client():
+    """Close the client bound to the running event loop, if any."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+async def _query(container_name, label, query, parameters=None, **kwargs):
+    return await cosmos_query.aquery(get_container(container_name), label, query, parameters, **kwargs)
+
+async def _read(container_name, label, item_id):
+    return await cosmos_query.aread(get_container(container_name), label, item_id)
+
+async def get_patients_page_by_cursor(page_size=10, after_id=None, before_id=None, fields=None):
+    """
+    Async counterpart of ``cosmosdb_helper.get_patients_page_by_cursor``.
+
+    :return: A tuple of (patients, has_previous, has_more).
+    """
+    logger.info(f"Fetching patients page after: {after_id}, before: {before_id}, page size: {page_size}")
+    try:
+        query, parameters = patients_page_query(page_size, after_id, before_id, fields)
+        patients = await _query(PATIENTS_CONTAINER_NAME, "patients.page", query, parameters, max_item_count=page_size + 1)
+        return patients_page(patients, page_size, after_id, before_id)
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error querying patients page after {after_id}, before {before_id}: {e}")
+        return [], False, False
+
+async def _search_patients(page_size, cursor=None, fields=None, email=None, **filters):
+    patient_id = None
+    if email:
+        user = await get_user_by_email(email, fields=("id", "email"))
+        patient_id = await get_patient_id_by_user_id(user["id"]) if user else None
+        if not patient_id:
+            return patient_search_page([], page_size)
+
+    query, parameters = patient_search_query(fields, page_size + 1, cursor, patient_id, **filters)
+    patients = await _query(PATIENTS_CONTAINER_NAME, "patients.search", query, parameters, max_item_count=page_size + 1)
+    return patient_search_page(patients, page_size)
+
+async def search_patients(page_size=10, cursor=None, fields=None, **filters):
+    """Async counterpart of ``cosmosdb_helper.search_patients``."""
+    logger.info(f"Searching patients: {filters}, cursor: {cursor}, page size: {page_size}")
+    try:
+        return await _search_patients(page_size, cursor, fields, **filters)
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error searching patients with {filters}: {e}")
+        return patient_search_page([], page_size)
+
+async def _query_medical_records(patient_id, page_size=None, cursor=None, fields=None, **filters):
+    query, parameters = medical_records_query(patient_id, fields, page_size, cursor, **filters)
+    records = await _query(
+        MEDICAL_RECORDS_CONTAINER_NAME,
+        "medical_records.by_patient",
+        query,
+        parameters,
+        max_item_count=page_size + 1 if page_size else None,
+    )
+    return medical_records_page(records, page_size)
+
+async def get_medical_records_page(patient_id, page_size=None, cursor=None, fields=None, **filters):
+    """Async counterpart of ``cosmosdb_helper.get_medical_records_page``."""
+    try:
+        return await _query_medical_records(patient_id, page_size, cursor, fields, **filters)
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error querying medical records page for patient ID {patient_id}: {e}")
+        return {"records": [], "next_cursor": None}
+
+async def get_patient_details(patient_id, record_fields=None, notification_fields=None, record_page_size=None, record_filters=None):
+    """
+    Async counterpart of ``cosmosdb_helper.get_patient_details``; the medical records
+    query overlaps the patient read, and the user read overlaps the notifications query.
+    """
+    logger.info(f"Fetching details for patient ID: {patient_id}")
+    medical_records_task = asyncio.ensure_future(_query_medical_records(
+        patient_id, record_page_size, fields=record_fields, **(record_filters or {})
+    ))
+    try:
+        patient = await _read(PATIENTS_CONTAINER_NAME, "patients.read", patient_id)
+
+        user_id = patient.get("user_id")
+        if user_id:
+            user, health_notifications = await asyncio.gather(
+                _read(USERS_CONTAINER_NAME, "users.read", user_id),
+                _query(
+                    HEALTH_NOTIFICATIONS_CONTAINER_NAME,
+                    "health_notifications.by_user",
+                    f"SELECT {projection(notification_fields)} FROM c WHERE c.patient_id = @user_id",
+                    [{"name": "@user_id", "value": user_id}],
+                ),
+            )
+        else:
+            user, health_notifications = None, []
+            logger.warning(f"No user ID associated with patient ID: {patient_id}")
+
+        medical_records = await medical_records_task
+        logger.info(f"Found {len(medical_records['records'])} medical records and {len(health_notifications)} health notifications for patient ID: {patient_id}")
+
+        return patient, user, medical_records, health_notifications
+    except exceptions.CosmosHttpResponseError as e:
+        medical_records_task.cancel()
+        logger.error(f"Error querying Cosmos DB for patient ID {patient_id}: {e}")
+        return None, None, None, None
+
+async def get_cached_patient_details(patient_id, record_fields=None, notification_fields=None, record_page_size=None, record_filters=None):
+    """Async counterpart of ``cosmosdb_helper.get_cached_patient_details``."""
+    if record_filters and any(record_filters.values()):
+        return await get_patient_details(patient_id, record_fields, notification_fields, record_page_size, record_filters)
+
+    variant = patient_details_variant(record_fields, notification_fields, record_page_size)
+    details = await patient_cache.aget_details(patient_id, variant)
+    if details is not None:
+        logger.info(f"Serving cached details for patient ID: {patient_id}")
+        return details
+
+    details = await get_patient_details(patient_id, record_fields, notification_fields, record_page_size)
+    if details[0]:
+        await patient_cache.aset_details(patient_id, details, variant)
+    return details
+
+async def _read_lookup(lookup_id):
+    try:
+        return await _read(LOOKUPS_CONTAINER_NAME, "lookups.read", lookup_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+async def get_user_by_email(email, fields=None):
+    """Async counterpart of ``cosmosdb_helper.get_user_by_email``."""
+    lookup = await _read_lookup(email_lookup_id(email))
+    if lookup:
+        try:
+            user = await _read(USERS_CONTAINER_NAME, "users.read", lookup["user_id"])
+            if user.get("email") == email:
+                return user
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+        logger.warning(f"Stale email lookup for {email}; falling back to a query.")
+
+    results = await _query(
+        USERS_CONTAINER_NAME,
+        "users.by_email",
+        f"SELECT {projection(fields)} FROM c WHERE c.email = @email",
+        [{"name": "@email", "value": email}],
+    )
+    return results[0] if results else None
+
+async def update_password_hash(user_id, password_hash):
+    try:
+        await get_container(USERS_CONTAINER_NAME).patch_item(
+            item=user_id,
+            partition_key=user_id,
+            patch_operations=[{"op": "set", "path": "/password_hash", "value": password_hash}],
+        )
+        logger.info(f"Rehashed password for user ID: {user_id}")
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Failed to rehash password for user ID {user_id}: {e}")
+
+async def verify_user(email, password):
+    """
+    Verify user credentials; bcrypt runs in the password hashing pool so it doesn't block the event loop.
+
+    :raises PasswordHasherBusy: If too many password checks are already in progress.
+    """
+    try:
+        user = await get_user_by_email(email, fields=LOGIN_USER_FIELDS)
+        if user:
+            valid, new_hash = await hasher.averify_and_update(password, user['password_hash'])
+            if valid:
+                if new_hash:
+                    await update_password_hash(user['id'], new_hash)
+                return user
+        return None
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error(f"Error verifying user: {e}")
+        return None
+
+async def get_patient_id_by_user_id(user_id):
+    try:
+        lookup = await _read_lookup(user_lookup_id(user_id))
+        if lookup:
+            return lookup["patient_id"]
+
+        results = await _query(
+            PATIENTS_CONTAINER_NAME,
+            "patients.id_by_user",
+            "SELECT VALUE c.id FROM c WHERE c.user_id = @user_id",
+            [{"name": "@user_id", "value": user_id}],
+        )
+        if results:
+            return results[0]
+    except Exception as e:
+        logger.error(f"Error retrieving patient ID for user ID {user_id}: {e}")
+    return None
+
+async def get_session_data(session_id):
+    session = await get_session_item(session_id)
+    return session.get("data", {}) if session else {}
+
+async def get_session_item(session_id):
+    try:
+        return await get_container(SESSIONS_CONTAINER_NAME).read_item(item=session_id, partition_key=session_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+async def read_session_if_changed(session_id, etag):
+    try:
+        session = await get_container(SESSIONS_CONTAINER_NAME).read_item(
+            item=session_id, partition_key=session_id, etag=etag, match_condition=MatchConditions.IfModified
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        return True, None
+    return session is not None, session
+
+async def save_session_data(session_id, data, ttl=None, etag=None):
+    container = get_container(SESSIONS_CONTAINER_NAME)
+    if etag:
+        return await container.replace_item(
+            session_id, session_item(session_id, data, ttl), etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+    return await container.upsert_item(session_item(session_id, data, ttl))
+
+async def create_session_data(session_id, data, ttl=None):
+    return await get_container(SESSIONS_CONTAINER_NAME).create_item(body=session_item(session_id, data, ttl))
+
+async def session_exists(session_id):
+    try:
+        await get_container(SESSIONS_CONTAINER_NAME).read_item(item=session_id, partition_key=session_id)
+        return True
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+
+async def delete_session_data(session_id):
+    try:
+        await get_container(SESSIONS_CONTAINER_NAME).delete_item(item=session_id, partition_key=session_id)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor for new hashes; existing hashes with another cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes hashing passwords; bcrypt is CPU-bound, so more than one per core doesn't help
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hashes running or waiting before new ones are turned away
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(HASH_WORKERS * 4)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class PasswordHasherBusy(Exception):
+    """Raised instead of queueing when too many password hashes are already pending."""
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+def _verify_and_update(password, password_hash):
+    return pwd_context.verify_and_update(password, password_hash)
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of worker processes so hashing doesn't hold up the
+    request threads. At most ``max_pending`` hashes may be running or queued;
+    further calls fail fast with ``PasswordHasherBusy``.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each gunicorn worker starts its own pool after forking.
+        # "spawn" avoids forking a process that already runs Cosmos and fan-out threads.
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Password hashing pool is saturated; rejecting request.")
+            raise PasswordHasherBusy("Too many password checks in progress.")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password):
+        return self._submit(_hash, password).result()
+
+    def hash_many(self, passwords):
+        """
+        Hash passwords across the pool, keeping as many in flight as there are
+        free slots and waiting for them instead of failing. Meant for bulk
+        imports with their own ``PasswordHasher``, so logins keep the shared pool.
+
+        :return: A generator of hashes in the order of ``passwords``, each yielded as soon as it is ready.
+        """
+        pending = collections.deque()
+        for password in passwords:
+            acquired = self._slots.acquire(blocking=False)
+            while not acquired and pending:
+                yield pending.popleft().result()
+                acquired = self._slots.acquire(blocking=False)
+            if not acquired:
+                self._slots.acquire()
+            try:
+                future = self._get_executor().submit(_hash, password)
+            except Exception:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            pending.append(future)
+        while pending:
+            yield pending.popleft().result()
+
+    def verify_and_update(self, password, password_hash):
+        """
+        Check ``password`` against ``password_hash``.
+
+        :return: A tuple of (valid, new_hash); ``new_hash`` is set when the stored
+            hash uses outdated settings and should be replaced.
+        """
+        return self._submit(_verify_and_update, password, password_hash).result()
+
+    async def ahash(self, password):
+        return await asyncio.wrap_future(self._submit(_hash, password))
+
+    async def averify_and_update(self, password, password_hash):
+        return await asyncio.wrap_future(self._submit(_verify_and_update, password, password_hash))
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+hasher = PasswordHasher()
+
+def hash_password(password):
+    return hasher.hash(password)
+
+def verify_password(password, password_hash):
+    return hasher.verify_and_update(password, password_hash)
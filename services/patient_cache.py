@@ -0,0 +1,54 @@
+"""
+Read-through cache for the patient details page.
+
+The patient, user, first page of medical records and health notifications
+loaded for one patient are cached together under the patient's ID, along with
+the field lists and page size they were fetched with, so a request for
+anything else is a miss. The ``patient_details`` cache alias is per-process or
+shared depending on ``PATIENT_CACHE`` in settings. Entries are dropped by
+``invalidate`` when the app changes a patient, and by the change feed listener
+when anything else does.
+"""
+
+import logging
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+PATIENT_CACHE_ALIAS = "patient_details"
+
+def _key(patient_id):
+    return f"patient_details:{patient_id}"
+
+def _unpack(entry, variant):
+    if entry is None or entry["variant"] != variant:
+        return None
+    return entry["details"]
+
+def get_details(patient_id, variant):
+    """
+    Return the cached (patient, user, medical_records, health_notifications), or None on a miss.
+
+    :param variant: Hashable description of what was fetched (field lists, page size);
+        an entry stored for another variant is a miss.
+    """
+    entry = caches[PATIENT_CACHE_ALIAS].get(_key(patient_id))
+    return _unpack(entry, variant)
+
+def set_details(patient_id, details, variant):
+    caches[PATIENT_CACHE_ALIAS].set(_key(patient_id), {"variant": variant, "details": details})
+
+def invalidate(patient_id):
+    """Drop the cached details of a patient. Failures are logged; the entry then expires on its own."""
+    try:
+        caches[PATIENT_CACHE_ALIAS].delete(_key(patient_id))
+    except Exception as e:
+        logger.error(f"Error invalidating cached details for patient ID {patient_id}: {e}")
+
+async def aget_details(patient_id, variant):
+    entry = await caches[PATIENT_CACHE_ALIAS].aget(_key(patient_id))
+    return _unpack(entry, variant)
+
+async def aset_details(patient_id, details, variant):
+    await caches[PATIENT_CACHE_ALIAS].aset(_key(patient_id), {"variant": variant, "details": details})
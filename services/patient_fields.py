@@ -0,0 +1,65 @@
+"""
+Fields derived from a patient's own data and stored on the patient document,
+so queries and pages read them directly instead of parsing ``date_of_birth``
+or joining health notifications for every row. The age bucket isn't stored:
+it changes with the year and the configured bucket edges, so it is computed
+from ``birth_year`` when read.
+"""
+
+from datetime import date
+
+# Upper (inclusive) age of every bucket but the last, e.g. 0-18, 19-30, ..., 61+
+DEFAULT_AGE_BUCKET_EDGES = (18, 30, 40, 50, 60)
+
+def age_bucket_labels(edges=DEFAULT_AGE_BUCKET_EDGES):
+    """
+    Build display labels for the buckets defined by ``edges``.
+
+    :param edges: Ascending inclusive upper ages of every bucket but the last.
+    :return: A list of ``len(edges) + 1`` labels.
+    """
+    labels, lower = [], 0
+    for edge in edges:
+        labels.append(f"{lower}-{edge}")
+        lower = edge + 1
+    labels.append(f"{lower}+")
+    return labels
+
+def birth_year(date_of_birth):
+    """Year of an ISO date-of-birth string, or None if it is missing or malformed."""
+    try:
+        return int(date_of_birth[:4]) if date_of_birth else None
+    except ValueError:
+        return None
+
+def age_bucket(year, edges=DEFAULT_AGE_BUCKET_EDGES, today=None):
+    """
+    Label of the bucket for patients born in ``year``, or None if it is unknown.
+
+    Ages are taken as the age reached in the current calendar year, like the
+    age/risk summary.
+    """
+    if year is None:
+        return None
+    age = (today or date.today()).year - year
+    labels = age_bucket_labels(edges)
+    for label, edge in zip(labels, sorted(edges)):
+        if age <= edge:
+            return label
+    return labels[-1]
+
+def patient_search_fields(name):
+    """Fields derived from the patient's name that patient search filters and sorts on."""
+    return {"name_lower": (name or "").strip().lower()}
+
+def patient_derived_fields(name, date_of_birth):
+    """
+    Fields derived from the patient's name and date of birth, to store on the patient document.
+
+    ``at_risk`` isn't included: it comes from health notifications, not the patient.
+    """
+    return {**patient_search_fields(name), "birth_year": birth_year(date_of_birth)}
+
+def at_risk_flags(diseases):
+    """The ``at_risk`` map stored on a patient with health notifications for ``diseases``."""
+    return {disease: True for disease in diseases}
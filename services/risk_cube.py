@@ -0,0 +1,163 @@
+"""
+Risk cube: patients counted per (birth year, sex, marital status, disease)
+cell, where the ``ALL_PATIENTS`` disease counts every patient. The risk
+summary worker keeps the cells current and publishes them as one document;
+the risk dashboard rolls them up by age bucket, sex or marital status.
+
+Cells are built and rolled up with NumPy ``unique``/``bincount``, so the
+cost depends on the number of cells (a few thousand), not on the number of
+patients.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+from datetime import date
+
+import numpy as np
+from django.core.cache import caches
+
+from services.cosmosdb_helper import get_risk_cube
+from services.patient_fields import DEFAULT_AGE_BUCKET_EDGES, age_bucket_labels
+
+logger = logging.getLogger(__name__)
+
+RISK_CUBE_CACHE_ALIAS = "risk_cube"
+# Disease of the cells that count every patient
+ALL_PATIENTS = ""
+# Dimensions the dashboard groups and filters by, in drill-down order
+DIMENSIONS = ("age_bucket", "sex", "ever_married")
+CELL_COLUMNS = ("birth_year", "sex", "ever_married", "disease")
+
+def cube_cells(birth_years, sexes, ever_married, diseases, weights=None):
+    """
+    Count patients per cube cell.
+
+    :param birth_years: Birth year of each patient.
+    :param sexes: Sex of each patient; missing values may be empty.
+    :param ever_married: Marital status of each patient.
+    :param diseases: Diseases each patient is at risk of.
+    :param weights: Per-patient multiplier, e.g. -1 to remove a patient's previous cells. Defaults to 1.
+    :return: A dict of ``CELL_COLUMNS`` plus ``patients`` lists, one entry per non-zero cell.
+    """
+    sizes = np.fromiter((len(patient_diseases) + 1 for patient_diseases in diseases), dtype=np.int64, count=len(diseases))
+    if not len(sizes):
+        return {name: [] for name in (*CELL_COLUMNS, "patients")}
+
+    # Each patient adds to the ALL_PATIENTS cell and to one cell per disease
+    rows = np.repeat(np.arange(len(sizes)), sizes)
+    disease_column = np.empty(int(sizes.sum()), dtype=object)
+    disease_column[:] = list(itertools.chain.from_iterable((ALL_PATIENTS, *patient_diseases) for patient_diseases in diseases))
+    sex_column = np.empty(len(sizes), dtype=object)
+    sex_column[:] = [sex or "" for sex in sexes]
+    columns = (
+        np.asarray(birth_years, dtype=np.int64)[rows],
+        sex_column[rows],
+        np.asarray(ever_married, dtype=bool)[rows],
+        disease_column,
+    )
+    weights = np.ones(len(sizes), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+
+    uniques, codes = zip(*(np.unique(column, return_inverse=True) for column in columns))
+    shape = tuple(len(values) for values in uniques)
+    cells = np.ravel_multi_index(codes, shape)
+    counts = np.bincount(cells, weights=weights[rows], minlength=int(np.prod(shape))).astype(np.int64)
+
+    present = np.flatnonzero(counts)
+    indexes = np.unravel_index(present, shape)
+    result = {name: values[index].tolist() for name, values, index in zip(CELL_COLUMNS, uniques, indexes)}
+    result["patients"] = counts[present].tolist()
+    return result
+
+def _dimension_labels(cube, edges, today):
+    """Label every cell with its age bucket, sex and marital status, in display order."""
+    years = np.asarray(cube["birth_year"], dtype=np.int64)
+    buckets = np.digitize((today or date.today()).year - years, edges, right=True)
+    sexes = np.asarray(cube["sex"], dtype=object)
+    married = np.asarray(cube["ever_married"], dtype=bool)
+    sex_values = sorted(set(cube["sex"]))
+    return {
+        "age_bucket": (buckets, age_bucket_labels(edges.tolist())),
+        "sex": (np.searchsorted(np.asarray(sex_values, dtype=object), sexes), [sex or "Unknown" for sex in sex_values]),
+        "ever_married": (married.astype(np.int64), ["No", "Yes"]),
+    }
+
+def rollup(cube, group_by="age_bucket", filters=None, disease=None, edges=DEFAULT_AGE_BUCKET_EDGES, today=None):
+    """
+    Roll the cube up by one dimension.
+
+    :param group_by: One of ``DIMENSIONS``.
+    :param filters: Dimension to label, e.g. ``{"sex": "Female", "age_bucket": "31-40"}``.
+    :param disease: Only report this disease; all diseases if omitted.
+    :return: A dict with the ``diseases`` reported, the ``patients`` and ``at_risk``
+        totals, and one entry per non-empty group with its ``label``,
+        ``patients`` and ``at_risk`` counts (aligned with ``diseases``).
+    """
+    edges = np.asarray(sorted(edges))
+    labels = _dimension_labels(cube, edges, today)
+    patients = np.asarray(cube["patients"], dtype=np.int64)
+    disease_column = np.asarray(cube["disease"], dtype=object)
+
+    mask = np.ones(len(patients), dtype=bool)
+    for dimension, value in (filters or {}).items():
+        codes, names = labels[dimension]
+        mask &= codes == (names.index(value) if value in names else -1)
+
+    diseases = sorted(set(cube["disease"]) - {ALL_PATIENTS})
+    if disease is not None:
+        diseases = [disease] if disease in diseases else []
+    group_codes, group_names = labels[group_by]
+    group_count = len(group_names)
+
+    everyone = mask & (disease_column == ALL_PATIENTS)
+    totals = np.bincount(group_codes[everyone], weights=patients[everyone], minlength=group_count).astype(np.int64)
+
+    at_risk = np.zeros((group_count, len(diseases)), dtype=np.int64)
+    flagged = mask & np.isin(disease_column, diseases)
+    if diseases and flagged.any():
+        disease_codes = np.searchsorted(np.asarray(diseases, dtype=object), disease_column[flagged])
+        at_risk = np.bincount(
+            group_codes[flagged] * len(diseases) + disease_codes,
+            weights=patients[flagged],
+            minlength=group_count * len(diseases),
+        ).astype(np.int64).reshape(group_count, len(diseases))
+
+    return {
+        "group_by": group_by,
+        "filters": dict(filters or {}),
+        "disease": disease,
+        "diseases": diseases,
+        "patients": int(totals.sum()),
+        "at_risk": at_risk.sum(axis=0).tolist(),
+        "groups": [
+            {"label": group_names[code], "patients": int(totals[code]), "at_risk": at_risk[code].tolist()}
+            for code in np.flatnonzero(totals)
+        ],
+        "updated_at": cube.get("updated_at"),
+    }
+
+def get_risk_rollup(group_by="age_bucket", filters=None, disease=None, edges=DEFAULT_AGE_BUCKET_EDGES):
+    """
+    Roll up the published cube, caching both the cube and each rollup per process.
+
+    :return: A rollup as returned by ``rollup``, or None if the cube has not been built yet.
+    """
+    cache = caches[RISK_CUBE_CACHE_ALIAS]
+    cube = cache.get("cube")
+    if cube is None:
+        cube = get_risk_cube()
+        if cube is None:
+            return None
+        cache.set("cube", cube)
+
+    request = json.dumps(
+        [cube.get("updated_at"), group_by, sorted((filters or {}).items()), disease, list(edges), date.today().isoformat()]
+    )
+    key = f"rollup:{hashlib.sha1(request.encode()).hexdigest()}"
+    result = cache.get(key)
+    if result is None:
+        logger.info(f"Rolling up risk cube by {group_by} with {filters}, disease {disease}")
+        result = rollup(cube, group_by, filters, disease, edges)
+        cache.set(key, result)
+    return result